@@ -17,10 +17,16 @@
 #   http://ec2-54-204-216-109.compute-1.amazonaws.com:6080/arcgis/sdk/rest/ms_dyn_query.html
 #
 
-import copy,json,sys
+import os,copy,json,sys,re
+import concurrent.futures
+import multiprocessing
+import threading
 import urllib3
 import uritools
-import pprint
+import numpy
+# Incremental decoder of replies
+import feature_stream
+import http_session
 import datetime
 from collections.abc import Iterable
 from numbers import Number
@@ -37,9 +43,370 @@ def are_values_equal( case, vals, err = 3 ):
       eprint( "Inconsistent %s: %d != %d" % (case,v,vals[0]) )
     assert abs(v-vals[0]) < err
 
+# Same URI on another server (e.g. a local stand-in), keeps path and query
+def rebase_uri( uri, server ):
+  parts = uritools.urisplit( uri )
+  base = uritools.urisplit( server )
+  return uritools.uriunsplit( ( base.scheme, base.authority, parts.path, parts.query, parts.fragment ) )
+
+# The base query of all others
+def default_query():
+  return {  'f':'json',         # output format JSON
+            'where':'1=1',      # SQL request anything
+            'returnGeometry':'false',   # No geometry needed
+            'spatialRel':'esriSpatialRelIntersects',
+            'outFields':'*',            # output any field
+            'resultType':'standard',
+            'cacheHint':'true' }
+
+# Statistics that can be combined over groups
+combinable_statistics = { 'sum':sum, 'count':sum, 'min':min, 'max':max }
+
+# Condition of a where clause that can be evaluated on groups:
+# None for any record, (field, set of values) for "<field> IN(<integers>)"
+# or False if not possible.
+def flag_condition( where ):
+  if not where or where == '1=1':
+    return None
+  m = re.match( r'^\s*(\w+)\s+IN\s*\(\s*(-?\d+(?:\s*,\s*-?\d+)*)\s*\)\s*$', where )
+  if not m:
+    return False
+  return ( m.group(1), set( int(v) for v in m.group(2).split( ',' ) ) )
+
+# Order of records for paging by offset: ties of the fields of order (e.g.
+# 'Meldedatum asc') are broken by the object id so that pages neither
+# overlap nor skip records.
+def stable_order( order, oid ):
+  fields = [ f.split()[0] for f in (order or '').split( ',' ) if f.strip() ]
+  if oid in fields:
+    return order
+  return '%s,%s asc' % ( order, oid ) if fields else '%s asc' % oid
+
+# Fields of a reply by name and by alias
+def fields_by_name( fields ):
+  d = dict()
+  for f in fields:
+    d[f['alias']] = f
+    d[f['name']] = f
+  return d
+
+# Convert attributes of one feature (accumulate numbers in totals)
+def parse_row( attributes, fields, totals=None ):
+  if totals is None: totals = dict()
+  d = dict()
+  for a in attributes:
+    val = attributes[a]
+    esriType = fields[a]['type']
+    if esriType == 'esriFieldTypeDate':
+      assert isinstance( val, int )  # epoche in msec
+      d[a] = datetime.datetime.utcfromtimestamp(val/1000)
+    elif esriType == 'esriFieldTypeInteger':
+      assert isinstance( val, int )
+      totals[a] = totals.setdefault(a,0) + val
+      d[a] = val
+    elif esriType == 'esriFieldTypeDouble':
+      assert isinstance( val, float ) or isinstance( val, int )
+      totals[a] = totals.setdefault(a,0) + val
+      d[a] = val
+    elif esriType == 'esriFieldTypeOID':
+      assert isinstance( val, int )
+      d[a] = val
+    else:
+      d[a] = val
+  return d
+
+# Convert features to one typed numpy array per field (accumulate numbers in totals)
+def parse_columns( features, fields, totals=None ):
+  if totals is None: totals = dict()
+  columns = dict()
+  if not features: return columns
+  for a in features[0]['attributes']:
+    vals = [ f['attributes'][a] for f in features ]
+    esriType = fields[a]['type']
+    if esriType == 'esriFieldTypeDate':
+      # epoche in msec
+      columns[a] = numpy.array( vals, dtype=numpy.int64 ).astype( 'datetime64[ms]' )
+    elif esriType == 'esriFieldTypeInteger':
+      columns[a] = numpy.array( vals, dtype=numpy.int64 )
+      totals[a] = columns[a].sum().item()
+    elif esriType == 'esriFieldTypeDouble':
+      columns[a] = numpy.array( vals, dtype=numpy.float64 )
+      totals[a] = columns[a].sum().item()
+    elif esriType == 'esriFieldTypeOID':
+      columns[a] = numpy.array( vals, dtype=numpy.int64 )
+    elif esriType == 'esriFieldTypeString':
+      columns[a] = dictionary_column( vals )
+    else:
+      columns[a] = numpy.array( vals, dtype=object )
+  return columns
+
+# Decode a raw reply (bytes) of one page into columns (of parse_columns),
+# run by the processes of get_column_chunks. fields: fields of the layer for
+# replies without. Returns columns, number of features, exceededTransferLimit
+# and the error of the reply (None if there is none).
+def decode_page( data, fields=None ):
+  reply = json.loads( data )
+  if 'error' in reply:
+    return None, 0, False, reply['error']
+  features = reply.get( 'features', [] )
+  columns = parse_columns( features, fields_by_name( reply.get( 'fields', fields or [] ) ) )
+  return columns, len(features), reply.get( 'exceededTransferLimit', False ), None
+
+# Pool of jobs processes (all cores if None) decoding pages of
+# get_column_chunks or None to decode in the calling process (one job).
+# Workers are started by a fork server, never forked from a process with
+# threads in the middle of requests.
+def decoder_pool( jobs=None ):
+  jobs = jobs or os.cpu_count() or 1
+  if jobs <= 1:
+    return None
+  return concurrent.futures.ProcessPoolExecutor( jobs, mp_context=multiprocessing.get_context( 'forkserver' ) )
+
+# Dictionary encoded string column: small integer codes into a table of strings
+class dictionary_column:
+  def __init__( self, values, table=None ):
+    index = dict( (v,n) for n,v in enumerate( table or [] ) )
+    codes = [ index.setdefault( v, len(index) ) for v in values ]
+    self.table = list( index )
+    self.codes = numpy.array( codes, dtype=numpy.min_scalar_type( max(len(self.table)-1,0) ) )
+
+  def __len__( self ):
+    return len(self.codes)
+
+  def __getitem__( self, n ):
+    return self.table[self.codes[n]]
+
+  # Code of a string (e.g. to filter by codes == code) or -1 if unknown
+  def code( self, value ):
+    try:
+      return self.table.index( value )
+    except ValueError:
+      return -1
+
+  # All strings as numpy array of objects
+  def decode( self ):
+    return numpy.array( self.table, dtype=object )[self.codes]
+
+# Immutable query of a layer. Each method of the builder returns a new query:
+#   arcgis_query().where( 'NeuerFall IN(0, 1)' ).group_by( 'Meldedatum' )
+#                 .order_by( 'Meldedatum asc' ).statistics( 'sum', 'AnzahlFall' ).paged()
+# Queries are hashable and can be shared by threads.
+class arcgis_query:
+  __slots__ = ( 'items', 'stats', 'all_pages' )
+
+  # items: parameters (default_query() if None), stats: tuples (type, field, name),
+  # all_pages: request all pages (not limited by maxRecordCount)
+  def __init__( self, items=None, stats=(), all_pages=False ):
+    if items is None: items = default_query()
+    object.__setattr__( self, 'items', tuple( sorted( dict( items ).items() ) ) )
+    object.__setattr__( self, 'stats', tuple( stats ) )
+    object.__setattr__( self, 'all_pages', all_pages )
+
+  def __setattr__( self, name, value ):
+    raise AttributeError( "arcgis_query is immutable" )
+
+  def __eq__( self, other ):
+    return isinstance( other, arcgis_query ) and self.__key() == other.__key()
+
+  def __hash__( self ):
+    return hash( self.__key() )
+
+  def __repr__( self ):
+    return "arcgis_query(%r, %r, %r)" % ( dict( self.items ), self.stats, self.all_pages )
+
+  def __key( self ):
+    return ( self.items, self.stats, self.all_pages )
+
+  # Copy with parameters changed (None removes a parameter)
+  def set( self, **changes ):
+    items = dict( self.items )
+    for k, v in changes.items():
+      if v is None:
+        items.pop( k, None )
+      else:
+        items[k] = v
+    return arcgis_query( items, self.stats, self.all_pages )
+
+  # Value of a parameter
+  def get( self, name, default=None ):
+    return dict( self.items ).get( name, default )
+
+  # Replace the condition (None keeps it)
+  def where( self, condition ):
+    return self.set( where=condition ) if condition else self
+
+  # Add new condition to where
+  def where_and( self, condition ):
+    if not condition: return self
+    where = self.get( 'where' )
+    if where and where != '1=1':
+      condition = '%s AND %s' % ( where, condition )
+    return self.set( where=condition )
+
+  def out_fields( self, fields ):
+    return self.set( outFields=fields )
+
+  # Statistics grouped by fields
+  def group_by( self, *fields ):
+    return self.set( groupByFieldsForStatistics=','.join( fields ) if fields else None )
+
+  # Order by e.g. 'Meldedatum asc', 'value desc'
+  def order_by( self, *fields ):
+    return self.set( orderByFields=','.join( f for f in fields if f ) or None )
+
+  # Add statistics of one type on one field
+  def statistics( self, stype, field, name='value' ):
+    return arcgis_query( self.items, self.stats+( ( stype, field, name ), ), self.all_pages )
+
+  # Request a part only
+  def page( self, offset=0, count=1 ):
+    return self.set( resultOffset=offset if offset > 0 else None, resultRecordCount=count )
+
+  # Request all records or groups page by page
+  def paged( self ):
+    return arcgis_query( self.items, self.stats, True )
+
+  # Count the records only
+  def count_only( self ):
+    return self.set( returnCountOnly='true' )
+
+  @property
+  def grouped( self ):
+    return self.get( 'groupByFieldsForStatistics' ) is not None
+
+  # Parameters of the request (a new dict)
+  def params( self ):
+    params = dict( self.items )
+    if self.stats:
+      stat = [ { 'statisticType':t, 'onStatisticField':f, 'outStatisticFieldName':n } for t, f, n in self.stats ]
+      params['outStatistics']=json.dumps(stat, separators=(',', ':'))
+    return params
+
+# Result of a query: the reply and what is parsed of it (on demand).
+# Self-contained, it does not refer to the arcgis_hub that got it.
+class arcgis_result:
+  # columnar: records() are numpy columns instead of list of dicts
+  def __init__( self, reply, columnar=False ):
+    self.reply = reply
+    self.columnar = columnar
+    self.__fields = None
+    self.__rows = None
+    self.__columns = None
+    self.__totals = None
+
+  def __len__( self ):
+    return len(self.features)
+
+  @property
+  def features( self ):
+    assert 'features' in self.reply
+    assert isinstance( self.reply['features'], list )
+    return self.reply['features']
+
+  # Fields of the reply by name and by alias
+  def fields( self ):
+    if self.__fields is None:
+      assert 'fields' in self.reply
+      assert isinstance( self.reply['fields'], list )
+      self.__fields = fields_by_name( self.reply['fields'] )
+    return self.__fields
+
+  # One dict per feature
+  def rows( self ):
+    if self.__rows is None:
+      fields = self.fields()
+      totals = dict()
+      rows = list()
+      for f in self.features:
+        assert 'attributes' in f
+        rows.append( parse_row( f['attributes'], fields, totals ) )
+      self.__rows, self.__totals = rows, totals
+    return self.__rows
+
+  # One typed numpy array per field
+  def columns( self ):
+    if self.__columns is None:
+      totals = dict()
+      self.__columns = parse_columns( self.features, self.fields(), totals )
+      self.__totals = totals
+    return self.__columns
+
+  # Rows or columns according to mode
+  def records( self ):
+    return self.columns() if self.columnar else self.rows()
+
+  # Sums of the numeric fields
+  def totals( self ):
+    if self.__totals is None:
+      self.records()
+    return self.__totals
+
+  # Value of a single value statistics query
+  def value( self, name='value' ):
+    assert 1 == len(self.features)
+    assert 'attributes' in self.features[0]
+    assert name in self.features[0]['attributes']
+    return int(self.features[0]['attributes'][name])
+
+  # Result of a count only query
+  def count( self ):
+    assert 'count' in self.reply
+    return int(self.reply['count'])
+
+  def print_fields( self, spacing=20 ):
+    fields = self.fields()
+    fmt = "{:<%d}" % spacing
+    for name in fields:
+      out = list()
+      out.append( name )
+      out.append( fields[name]['type'] )
+      if name != fields[name]['alias']:
+        out.append( fields[name]['alias'] )
+      print( ";".join( [ fmt.format(s) for s in out ] ) )
+
+  def print_data_table( self, spacing=8 ):
+    fields = self.fields()
+    if self.columnar:
+      columns = self.columns()
+      names = list( columns )
+      lines = [ dict( (name, columns[name][n]) for name in names )
+                for n in range( len(columns[names[0]]) if names else 0 ) ]
+    else:
+      lines = self.rows()
+      names = list( lines[0] ) if lines else []
+    # header with names
+    print( ";".join( names ) )
+    # values
+    fmt = "{:<%d}" % spacing
+    for line in lines:
+      out = list()
+      for name in names:
+        val = line[name]
+        if fields[name]['type'] == 'esriFieldTypeDate':
+          if isinstance( val, numpy.datetime64 ):
+            val = val.astype( datetime.datetime )
+          if (val.time() == datetime.time(0,0)):
+            out.append( str( val.date() ) )
+          else:
+            out.append( str( val ))
+        else:
+          out.append( str( val ) )
+      print( ";".join( [ fmt.format(s) for s in out ] ) )
+    print( self.totals() )
+
+  def print( self ):
+    # Formatted output as a table
+    self.print_data_table()
+
 # Read data from ArcGIS feature servers
 class arcgis_hub:
-  def __init__( self ):
+  # cache: optional reply_cache to keep replies on disk
+  # columnar: parse results into numpy columns instead of list of dicts
+  # server: optional base URI (e.g. http://localhost:8080) to use instead of the ArcGIS servers
+  # metrics: optional fetch_metrics to record every request
+  # session: http_session to share connections with others (own one if None)
+  # mirror: optional layer_mirror to evaluate queries of mirrored layers locally
+  def __init__( self, cache=None, columnar=False, server=None, metrics=None, session=None, mirror=None ):
     # URIs of feature servers:
     self.uri_dict={
         # https://npgeo-corona-npgeo-de.hub.arcgis.com/datasets/dd4580c810204019a7b8eb3e0b329dd6_0
@@ -64,6 +431,8 @@ class arcgis_hub:
         # ['AnzahlFall', 'AnzahlTodesfall', 'AnzahlGenesen', 'SummeFall', 'SummeTodesfall', 'SummeGenesen',
         #  'ObjectId', 'Datenstand', 'Meldedatum', 'Bundesland', 'IdBundesland', 'Landkreis', 'IdLandkreis']
         }
+    if server:
+      self.uri_dict = dict( (label, rebase_uri( uri, server )) for label, uri in self.uri_dict.items() )
     self.esriTypes = {  'esriFieldTypeInteger':int,        # Integer value
                         'esriFieldTypeDouble':[float,int], # Floating point or integer (e.g. statistic result)
                         'esriFieldTypeOID':int,       # Integer identifier / index
@@ -71,203 +440,475 @@ class arcgis_hub:
                         'esriFieldTypeString':str     # General string
                     }
     self.user_agent = {'user-agent': 'IE 9/Windows: Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; WOW64; Trident/5.0)'}
-    self.http = urllib3.PoolManager( 10, headers=self.user_agent )
-    self.__default_query()
-    self.pp = pprint.PrettyPrinter(indent=4)
+    # Number of concurrent requests (e.g. pages) and connections kept per host
+    self.workers = 8
+    # One pool of worker threads for all concurrent requests (created on first use)
+    self.pool = None
+    self.pool_lock = threading.Lock()
+    self.local = threading.local()
+    self.http = session or http_session.http_session( maxsize=self.workers, headers=self.user_agent )
+    # Description of layers (e.g. maxRecordCount) by URI label (futures, see __once)
+    self.layer_info = dict()
+    # Cache of replies and current version (Datenstand) of layers by URI label (futures)
+    self.cache = cache
+    self.versions = dict()
+    # Guards the dictionaries of futures only, never held while fetching
+    self.once_lock = threading.Lock()
+    self.columnar = columnar
+    self.metrics = metrics
+    self.mirror = mirror
   
-  # Request the query
-  def __get( self, uri_label, query=None ):
+  # Call function with each of items on the pool, returns the results in order.
+  # Calls of workers of the pool (nested, e.g. pages of each of concurrent
+  # queries) are done one after the other, so there are never more than
+  # workers concurrent requests.
+  def __map( self, function, items ):
+    if getattr( self.local, 'worker', False ):
+      return [ function( i ) for i in items ]
+    with self.pool_lock:
+      if not self.pool:
+        self.pool = concurrent.futures.ThreadPoolExecutor( self.workers, initializer=self.__init_worker )
+    futures = [ self.pool.submit( function, i ) for i in items ]
+    return [ f.result() for f in futures ]
+
+  def __init_worker( self ):
+    self.local.worker = True
+
+  # Result of function( base ) computed once per base and kept in table.
+  # The first caller computes it, concurrent callers of the same base wait for
+  # its future, callers of other bases go on. Errors are not kept.
+  def __once( self, table, base, function ):
+    with self.once_lock:
+      future = table.get( base )
+      first = future is None
+      if first:
+        future = table[base] = concurrent.futures.Future()
+    if first:
+      try:
+        future.set_result( function( base ) )
+      except BaseException as e:
+        with self.once_lock:
+          del table[base]
+        future.set_exception( e )
+    return future.result()
+
+  # Concatenate URI and parameters (of the query or of the layer itself)
+  def __uri( self, uri_label, query, layer=False ):
     assert uri_label in self.uri_dict
-    # Concatenate URI and parameters
     uri_parts = uritools.urisplit( self.uri_dict[uri_label] )
-    if not query: query=self.query
-    uri = uritools.uricompose( scheme=uri_parts.scheme, host=uri_parts.host,
-        port=uri_parts.port, path=uri_parts.path, query=query, fragment=None )
-    #print( uri )
-    try:
-      request = self.http.urlopen('GET', uri )
-    except urllib3.exceptions.SSLError as e:
-      print( "TSL error", e.reason, uri )
-      sys.exit(-1)
-    except urllib3.exceptions.HTTPError as e:
-      print( e.reason, uri )
-      sys.exit(-1)
-    self.reply = None
-    self.fields = None
-    self.values = None
+    path = uri_parts.path
+    if layer:
+      path = path[:path.rindex( '/query' )]
+    return uritools.uricompose( scheme=uri_parts.scheme, host=uri_parts.host,
+        port=uri_parts.port, path=path, query=query, fragment=None )
+
+  # Request an URI and return the decoded reply (thread safe, does not touch self).
+  # Timings and size are put into the metrics event if given.
+  # Raises http_session.session_error.
+  def __fetch( self, uri, event=None ):
+    data = self.__read( uri, event )
+    if event: parse = self.metrics.elapsed( event )
     try:
-      self.reply = json.loads( request.data )
+      reply = json.loads( data )
     except json.JSONDecodeError as e:
-      print( e.reason, uri )
       # May be HTML error e.g. <title>404 - File or directory not found.</title>
-      sys.exit(-1)
-    if 'error' in self.reply:
-      e = self.reply['error']
-      eprint( "ERROR: %d %s %s" % ( e['code'], " ".join( e['details'] ), " ".join( e['message'] ) ) )
-      sys.exit(-1)
-
-  # The base query of all others
-  def __default_query( self ):
-    self.query = {  'f':'json',         # output format JSON
-                    'where':'1=1',      # SQL request anything
-                    'returnGeometry':'false',   # No geometry needed
-                    'spatialRel':'esriSpatialRelIntersects',
-                    'outFields':'*',            # output any field
-                    'resultType':'standard',
-                    'cacheHint':'true' }
-
-  # Do any kind of statistics query
-  def __query_statistics( self, stat ):
-    self.query['outStatistics']=json.dumps(stat, separators=(',', ':'))
-
-  # Do statistics of one type on one field.
-  def __query_statistics_type_field( self, stype, sfield, sname = 'value' ):
-    stat=[{'statisticType':stype, 'onStatisticField':sfield, 'outStatisticFieldName':sname}]
-    self.__query_statistics( stat )
-
-  # Accumulate fields by sum over group
-  def __query_sum_per_field( self, field_to_sum, field_to_group ):
-    self.query['where']="%s<>0" % field_to_sum
-    self.query['groupByFieldsForStatistics']=field_to_group
-    self.query['orderByFields']="%s asc" % field_to_group
-    self.__query_statistics_type_field( 'sum', field_to_sum )
-
-  # Do request a part only
-  def __query_part( self, offset=0, count=1 ):
-    self.query['resultRecordCount']=count
-    if (offset > 0):
-      self.query['resultOffset']=offset
+      raise http_session.reply_error( e.msg, uri ) from e
+    if event: event['parse'] = self.metrics.elapsed( event )-parse
+    self.__check_error( reply, uri )
+    return reply
 
-  # Add new condition to where
-  def __query_where_and( self, condition=None ):
-    if condition:
-      self.query['where']='%s AND %s' % (self.query['where'], condition )
+  # Request an URI and return the raw reply (bytes), same as __fetch otherwise
+  def __read( self, uri, event=None ):
+    #print( uri )
+    request = self.http.urlopen('GET', uri, preload_content=False )
+    if event: event['ttfb'] = self.metrics.elapsed( event )
+    request, data = self.http.read( request, uri )
+    if event: event['bytes'] = len(data)
+    return data
 
-  # Check and parse the result of a single value statistics query
-  def __parse_sigle_statistics( self ):
-    assert 'features' in self.reply
-    assert isinstance( self.reply['features'], list )
-    assert 1 == len(self.reply['features'])
-    assert 'attributes' in self.reply['features'][0]
-    assert 'value' in self.reply['features'][0]['attributes']
-    return int(self.reply['features'][0]['attributes']['value'])
-
-  def __parse_fields( self ):
-    if self.fields: return self.fields
-    assert 'fields' in self.reply
-    assert isinstance( self.reply['fields'], list )
-    self.fields = dict()
-    for f in self.reply['fields']:
-      self.fields[f['alias']] = f
-      self.fields[f['name']] = f
-    return self.fields
-
-  def __parse_values( self ):
-    if self.values: return self.values
-    self.__parse_fields()
-    assert 'features' in self.reply
-    assert isinstance( self.reply['features'], list )
-    self.values = list()
-    self.totals = dict()
-    for f in self.reply['features']:
-      d = dict()
-      assert 'attributes' in f
-      for a in f['attributes']:
-        val = f['attributes'][a]
-        esriType = self.fields[a]['type']
-        if esriType == 'esriFieldTypeDate':
-          assert isinstance( val, int )  # epoche in msec
-          d[a] = datetime.datetime.utcfromtimestamp(val/1000)
-        elif esriType == 'esriFieldTypeInteger':
-          assert isinstance( val, int )
-          self.totals[a] = self.totals.setdefault(a,0) + val
-          d[a] = val
-        elif esriType == 'esriFieldTypeDouble':
-          assert isinstance( val, float ) or isinstance( val, int )
-          self.totals[a] = self.totals.setdefault(a,0) + val
-          d[a] = val
-        elif esriType == 'esriFieldTypeOID':
-          assert isinstance( val, int )
-          d[a] = val
-        else:
-          d[a] = val
-      self.values.append( d )
-    return self.values
+  # Request a query of a layer undecoded and record metrics of it
+  def __read_recorded( self, uri_label, query ):
+    uri = self.__uri( uri_label, query )
+    if not self.metrics:
+      return uri, self.__read( uri )
+    event = self.metrics.start( uri_label, query )
+    data = self.__read( uri, event )
+    event['total'] = self.metrics.elapsed( event )
+    self.metrics.record( event )
+    return uri, data
 
-  def print_fields( self, spacing=20 ):
-    self.__parse_fields()
-    fmt = "{:<%d}" % spacing
-    for name in self.fields:
-      out = list()
-      out.append( name )
-      out.append( self.fields[name]['type'] )
-      if name != self.fields[name]['alias']:
-        out.append( self.fields[name]['alias'] )
-      print( ";".join( [ fmt.format(s) for s in out ] ) )
+  # Request a query (or the description) of a layer and record metrics of it
+  def __fetch_recorded( self, uri_label, query, layer=False, cache=None ):
+    uri = self.__uri( uri_label, query, layer )
+    if not self.metrics:
+      return self.__fetch( uri )
+    event = self.metrics.start( uri_label, query )
+    event['cache'] = cache
+    reply = self.__fetch( uri, event )
+    event['total'] = self.metrics.elapsed( event )
+    self.metrics.record( event )
+    return reply
 
-  def print_data_table( self, spacing=8 ):
-    self.__parse_values()
-    # header with names
-    print( ";".join( self.values[0] ) )
-    # values
-    fmt = "{:<%d}" % spacing
-    for line in self.values:
-      out = list()
-      for name in self.values[0]:
-        val = line[name]
-        if self.fields[name]['type'] == 'esriFieldTypeDate':
-          if (val.time() == datetime.time(0,0)):
-            out.append( str( val.date() ) )
-          else:
-            out.append( str( val ))
+  # Raise on error replies of the feature server
+  def __check_error( self, reply, uri=None ):
+    if 'error' in reply:
+      e = reply['error']
+      raise http_session.reply_error( "ERROR: %d %s %s" % ( e['code'], " ".join( e.get( 'details', [] ) ), e.get( 'message', '' ) ), uri )
+
+  # Request the query and decode the features of the reply incrementally.
+  # Pages are requested one after the other, yields fields and feature.
+  # A page broken while reading is requested again behind the features
+  # yielded (with the retries and backoff of the session).
+  def __stream( self, uri_label, query ):
+    page = int(self.get_layer_info( uri_label ).get( 'maxRecordCount', 1000 ))
+    offset = 0
+    retry = self.http.retry
+    while True:
+      query = copy.copy( query )
+      query['resultOffset']=offset
+      query['resultRecordCount']=page
+      uri = self.__uri( uri_label, query )
+      event = self.metrics.start( uri_label, query ) if self.metrics else None
+      response = self.http.urlopen( 'GET', uri, preload_content=False )
+      if event: event['ttfb'] = self.metrics.elapsed( event )
+      stream = feature_stream.feature_stream( response )
+      fields = None
+      n = 0
+      complete = False
+      broken = None
+      try:
+        for f in stream:
+          if not fields:
+            # Fall back to fields of layer if reply has none in front of features
+            fields = fields_by_name( stream.header.get( 'fields', self.get_layer_info( uri_label ).get( 'fields', [] ) ) )
+          n += 1
+          yield fields, f
+        complete = True
+      except ValueError as e:
+        raise http_session.reply_error( str( e ), uri ) from e
+      except http_session.read_errors as e:
+        broken = e
+      except urllib3.exceptions.HTTPError as e:
+        raise http_session.connection_error( str( e ), uri ) from e
+      finally:
+        if complete:
+          response.release_conn()
         else:
-          out.append( str( val ) )
-      print( ";".join( [ fmt.format(s) for s in out ] ) )
-    print( self.totals )
+          response.close()
+      if broken:
+        try:
+          retry = retry.increment( 'GET', uri, error=broken )
+        except urllib3.exceptions.MaxRetryError:
+          raise http_session.connection_error( str( broken ), uri ) from broken
+        retry.sleep()
+        offset += n
+        continue
+      retry = self.http.retry
+      # Decoding is interleaved with receiving, so there is no parse time
+      if event:
+        event['bytes'] = response.tell()
+        event['total'] = self.metrics.elapsed( event )
+        self.metrics.record( event )
+      self.__check_error( stream.header, uri )
+      if not n or not stream.header.get( 'exceededTransferLimit', False ):
+        break
+      offset += n
 
-  def print( self ):
-    # RAW output without interpretation
-    #self.pp.pprint( self.reply )
-    # Formatted output as a table
-    self.print_data_table()
+  # Request a query of a layer, use cached reply if still valid
+  def __request( self, uri_label, query ):
+    if not self.cache:
+      return self.__fetch_recorded( uri_label, query )
+    version = self.get_version( uri_label )
+    event = self.metrics.start( uri_label, query ) if self.metrics else None
+    # Keyed by the full URI, the same label may be served by other servers
+    uri = self.uri_dict[uri_label]
+    reply = self.cache.get( uri, query, version )
+    if reply is None:
+      reply = self.__fetch_recorded( uri_label, query, cache='miss' )
+      self.cache.put( uri, query, reply, version )
+    elif event:
+      event['cache'] = 'hit'
+      event['total'] = self.metrics.elapsed( event )
+      self.metrics.record( event )
+    return reply
+
+  # Request the count of records only
+  def __get_count( self, uri_label, query ):
+    query = copy.copy( query )
+    for k in ['outStatistics', 'orderByFields', 'resultOffset', 'resultRecordCount']:
+      query.pop( k, None )
+    query['returnCountOnly']='true'
+    reply = self.__request( uri_label, query )
+    assert 'count' in reply
+    return int(reply['count'])
+
+  # Request one page, follow exceededTransferLimit until the page is complete
+  # (cached: use the cache of replies if there is one)
+  def __get_page( self, uri_label, query, offset, count, cached=True ):
+    features = list()
+    while len(features) < count:
+      query = copy.copy( query )
+      query['resultOffset']=offset+len(features)
+      query['resultRecordCount']=count-len(features)
+      reply = self.__request( uri_label, query ) if cached else self.__fetch_recorded( uri_label, query )
+      assert 'features' in reply
+      assert isinstance( reply['features'], list )
+      features.extend( reply['features'] )
+      if not reply['features'] or not reply.get( 'exceededTransferLimit', False ):
+        break
+    reply['features'] = features
+    return reply
+
+  # Request all records of the query page by page (pages are requested concurrently).
+  # Pages are not cached, they would evict the small replies the cache is for.
+  def __get_paged( self, uri_label, query ):
+    info = self.get_layer_info( uri_label )
+    page = int(info.get( 'maxRecordCount', 1000 ))
+    query = copy.copy( query )
+    # Paging needs a well defined order
+    query['orderByFields'] = stable_order( query.get( 'orderByFields' ), info['objectIdField'] )
+    total = self.__get_count( uri_label, query )
+    offsets = range( 0, max(total,1), page )
+    replies = self.__map( lambda o: self.__get_page( uri_label, query, o, page, False ), offsets )
+    # Records may have been added meanwhile
+    offset = offsets[-1]+page
+    while replies[-1].get( 'exceededTransferLimit', False ) and replies[-1]['features']:
+      replies.append( self.__get_page( uri_label, query, offset, page, False ) )
+      offset += page
+    # Merge all pages into one reply
+    reply = replies[0]
+    for r in replies[1:]:
+      reply['features'].extend( r['features'] )
+    reply['exceededTransferLimit'] = False
+    return reply
+
+  # Request all groups of a statistics query page by page (number of groups is not known ahead)
+  def __get_groups( self, uri_label, query ):
+    page = int(self.get_layer_info( uri_label ).get( 'maxRecordCount', 1000 ))
+    features = list()
+    while True:
+      reply = self.__get_page( uri_label, query, len(features), page )
+      features.extend( reply['features'] )
+      if not reply['features'] or not reply.get( 'exceededTransferLimit', False ):
+        break
+    reply['features'] = features
+    reply['exceededTransferLimit'] = False
+    return reply
 
   ###################################################################
   # Templates of requests:
 
+  # Execute a query (an arcgis_query) on a layer, returns an arcgis_result.
+  # Uses no state of the instance but the caches, so any number of threads
+  # may execute queries on one instance (sharing its connections).
+  # Queries of mirrored layers are evaluated locally.
+  def execute( self, base, query ):
+    if self.mirror and self.mirror.covers( base ):
+      return self.mirror.execute( self, base, query )
+    return self.fetch( base, query )
+
+  # Same as execute but always ask the feature server (never the mirror)
+  def fetch( self, base, query ):
+    params = query.params()
+    if not query.all_pages:
+      reply = self.__request( base, params )
+    elif query.grouped:
+      reply = self.__get_groups( base, params )
+    else:
+      reply = self.__get_paged( base, params )
+    return arcgis_result( reply, self.columnar )
+
+  # Get the description of a layer (e.g. fields, maxRecordCount, objectIdField)
+  def get_layer_info( self, base ):
+    return self.__once( self.layer_info, base, lambda b: self.__fetch_recorded( b, {'f':'json'}, layer=True ) )
+
+  # Get the version of the data of a layer (once per instance).
+  # This is 'Datenstand' if the layer has such a field else the date of last edit.
+  def get_version( self, base ):
+    return self.__once( self.versions, base, self.__fetch_version )
+
+  def __fetch_version( self, base ):
+    info = self.get_layer_info( base )
+    version = None
+    if 'Datenstand' in [ f['name'] for f in info.get( 'fields', [] ) ]:
+      query = { 'f':'json', 'where':'1=1', 'returnGeometry':'false',
+                'outFields':'Datenstand', 'resultRecordCount':1 }
+      reply = self.__fetch_recorded( base, query )
+      if reply.get( 'features' ):
+        version = reply['features'][0]['attributes']['Datenstand']
+    if version is None:
+      version = info.get( 'editingInfo', {} ).get( 'lastEditDate' )
+    return version
+
+  # Get all records (not limited by maxRecordCount)
+  def get_records( self, base, where=None, out_fields='*', order_by=None ):
+    query = arcgis_query().where( where ).out_fields( out_fields ).order_by( order_by ).paged()
+    return self.execute( base, query ).records()
+
+  # Query of all records to be streamed
+  def __stream_query( self, base, where, out_fields, order_by ):
+    order_by = stable_order( order_by, self.get_layer_info( base )['objectIdField'] )
+    return arcgis_query().where( where ).out_fields( out_fields ).order_by( order_by ).params()
+
+  # Same as get_records but yield one row after the other (flat memory)
+  def stream_rows( self, base, where=None, out_fields='*', order_by=None ):
+    for fields, f in self.__stream( base, self.__stream_query( base, where, out_fields, order_by ) ):
+      assert 'attributes' in f
+      yield parse_row( f['attributes'], fields )
+
+  # Same as get_records but yield chunks of columns (flat memory)
+  def stream_columns( self, base, where=None, out_fields='*', order_by=None, chunk=10000 ):
+    features = list()
+    for fields, f in self.__stream( base, self.__stream_query( base, where, out_fields, order_by ) ):
+      assert 'attributes' in f
+      features.append( f )
+      if len(features) >= chunk:
+        yield parse_columns( features, fields )
+        features = list()
+    if features:
+      yield parse_columns( features, fields )
+
+  # Same as get_records but as chunks of columns (one per page, in order) for
+  # bulk downloads: pages are requested concurrently as raw replies and decoded
+  # by the processes of decoders (of decoder_pool, kept open) or of a pool of
+  # jobs processes for this call. Replies are not cached and the mirror is
+  # not asked.
+  def get_column_chunks( self, base, where=None, out_fields='*', order_by=None, jobs=None, decoders=None ):
+    info = self.get_layer_info( base )
+    page = int(info.get( 'maxRecordCount', 1000 ))
+    fields = info.get( 'fields', [] )
+    query = self.__stream_query( base, where, out_fields, order_by )
+    total = self.__get_count( base, query )
+    own = decoders is None
+    if own:
+      decoders = decoder_pool( jobs )
+    # Chunks of one page, follow exceededTransferLimit until the page is complete
+    def get_page( offset ):
+      chunks = list()
+      n = 0
+      exceeded = False
+      while n < page:
+        uri, data = self.__read_recorded( base, dict( query, resultOffset=offset+n, resultRecordCount=page-n ) )
+        try:
+          if decoders:
+            columns, count, exceeded, error = decoders.submit( decode_page, data, fields ).result()
+          else:
+            columns, count, exceeded, error = decode_page( data, fields )
+        except ValueError as e:
+          # May be HTML error e.g. <title>404 - File or directory not found.</title>
+          raise http_session.reply_error( str( e ), uri ) from e
+        if error:
+          self.__check_error( { 'error':error }, uri )
+        if count:
+          chunks.append( columns )
+        n += count
+        if not count or not exceeded:
+          break
+      return chunks, exceeded and n > 0
+    try:
+      offsets = range( 0, max(total,1), page )
+      pages = self.__map( get_page, offsets )
+      # Records may have been added meanwhile
+      offset = offsets[-1]+page
+      while pages[-1][1]:
+        pages.append( get_page( offset ) )
+        offset += page
+    finally:
+      if own and decoders: decoders.shutdown( cancel_futures=True )
+    return [ c for chunks, exceeded in pages for c in chunks ]
+
   # Get the total over the complete database (scalar result)
   def get_total( self, counter, newcase, base ):
-    self.__default_query()
+    query = arcgis_query().statistics( 'sum', counter )
     if newcase:
-      self.query['where']='%s IN(0, 1)' % newcase
-    self.__query_statistics_type_field( 'sum', counter )
-    self.__get( base )
-    return self.__parse_sigle_statistics()
+      query = query.where( '%s IN(0, 1)' % newcase )
+    return self.execute( base, query ).value()
   
   # Get the maximum over the complete database (scalar result)
   def get_max( self, counter, base ):
-    self.__default_query()
-    self.__query_statistics_type_field( 'max', counter )
-    self.__get( base )
-    return self.__parse_sigle_statistics()
+    return self.execute( base, arcgis_query().statistics( 'max', counter ) ).value()
   
   # Get the current new (scalar result)
   def get_current_new( self, counter, newcase, base ):
     assert newcase
-    self.__default_query()
-    self.query['where']='%s IN(1,-1)' % newcase
-    self.__query_statistics_type_field( 'sum', counter )
-    self.__get( base )
-    return self.__parse_sigle_statistics()
-
-  # Get the totals of each day
-  # e.g. 
+    query = arcgis_query().where( '%s IN(1,-1)' % newcase ).statistics( 'sum', counter )
+    return self.execute( base, query ).value()
+
+  # Get the totals of each day (sum of counter grouped by timestamp), returns arcgis_result
   def get_total_per_day( self, counter, timestamp, newcase, base ):
-    self.__default_query()
-    self.__query_sum_per_field( counter, timestamp )
+    query = arcgis_query().where( "%s<>0" % counter ).group_by( timestamp ) \
+              .order_by( "%s asc" % timestamp ).statistics( 'sum', counter )
     if newcase:
-      self.__query_where_and( '%s IN(0, 1)' % newcase )
-    self.__get( base )
-    self.__parse_values()
+      query = query.where_and( '%s IN(0, 1)' % newcase )
+    result = self.execute( base, query )
+    result.records()
+    return result
+
+  # Get several statistics of one layer with as few queries as possible.
+  # requests: dict of name -> (statisticType, field, where), where may be None.
+  # Requests with where None or "<field> IN(...)" are merged into one query
+  # grouped by these fields, other ones are merged if they have the same where.
+  # Queries are sent concurrently. Returns dict of name -> value.
+  def get_statistics( self, base, requests ):
+    merged = dict()
+    by_where = dict()
+    for name in requests:
+      stype, field, where = requests[name]
+      condition = flag_condition( where )
+      if condition is not False and stype in combinable_statistics:
+        merged[name] = condition
+      else:
+        by_where.setdefault( where, list() ).append( name )
+    # Queries with names of requests
+    queries = list()
+    if merged:
+      groups = sorted( set( c[0] for c in merged.values() if c ) )
+      queries.append( ( arcgis_query().group_by( *groups ), list( merged ) ) )
+    for where in by_where:
+      queries.append( ( arcgis_query().where( where ), by_where[where] ) )
+    names = list( requests )
+    for n, ( query, group ) in enumerate( queries ):
+      for name in group:
+        query = query.statistics( requests[name][0], requests[name][1], 'value_%d' % names.index( name ) )
+      queries[n] = ( query, group )
+    results = self.__map( lambda q: self.execute( base, q[0] ), queries )
+    # Combine the groups
+    result = dict()
+    for (query, group), r in zip( queries, results ):
+      for name in group:
+        stype = requests[name][0]
+        out = 'value_%d' % names.index( name )
+        condition = merged.get( name )
+        vals = [ f['attributes'][out] for f in r.features
+                 if f['attributes'][out] is not None and
+                    ( not condition or f['attributes'][condition[0]] in condition[1] ) ]
+        if stype in combinable_statistics:
+          value = combinable_statistics[stype]( vals ) if vals else None
+        else:
+          assert len(vals) <= 1
+          value = vals[0] if vals else None
+        if stype in [ 'sum', 'count' ]:
+          value = int(value or 0)
+        result[name] = value
+    return result
+
+  # Sum of counter per district and day of report as columns IdLandkreis, Meldedatum
+  # and value (numpy, IdLandkreis dictionary encoded). One query per Bundesland,
+  # queries are sent concurrently.
+  def get_total_per_district_and_day( self, counter='AnzahlFall', newcase='NeuerFall', base='rki covid19' ):
+    query = arcgis_query().group_by( 'IdLandkreis', 'Meldedatum' ) \
+              .order_by( 'IdLandkreis asc', 'Meldedatum asc' ).statistics( 'sum', counter ).paged()
+    queries = [ query.where( 'IdBundesland=%d AND %s IN(0, 1)' % ( n, newcase ) ) for n in range( 1, 17 ) ]
+    results = self.__map( lambda q: self.execute( base, q ), queries )
+    features = [ f for r in results for f in r.features ]
+    if not features:
+      return { 'IdLandkreis':dictionary_column( [] ), 'Meldedatum':numpy.array( [], dtype='datetime64[ms]' ),
+               'value':numpy.array( [], dtype=numpy.float64 ) }
+    return parse_columns( features, results[0].fields() )
+
+  # Population (EWZ) and name of each district as columns RS, GEN and EWZ
+  def get_population_per_district( self, base='rki landkreis' ):
+    return self.execute( base, arcgis_query().out_fields( 'RS,GEN,EWZ' ).paged() ).columns()
 
   ###################################################################
   # Examples of concrete requests:
@@ -280,14 +921,11 @@ class arcgis_hub:
   def get_current_total_cases_03( self ):
     return self.get_total( 'AnzahlFall', 'NeuerFall', 'rki covid19' )
   def get_current_total_cases_04( self ):
-    self.get_total_per_day( 'AnzahlFall', 'Meldedatum', 'NeuerFall', 'rki covid19' )
-    return self.totals['value']
+    return self.get_total_per_day( 'AnzahlFall', 'Meldedatum', 'NeuerFall', 'rki covid19' ).totals()['value']
   def get_current_total_cases_05( self ):
-    self.get_total_per_day( 'AnzahlFall', 'Datum', None, 'rki covid19 refdate' )
-    return self.totals['value']
+    return self.get_total_per_day( 'AnzahlFall', 'Datum', None, 'rki covid19 refdate' ).totals()['value']
   def get_current_total_cases_06( self ):
-    self.get_total_per_day( 'AnzahlFall', 'Meldedatum', None, 'rki covid19 sums' )
-    return self.totals['value']
+    return self.get_total_per_day( 'AnzahlFall', 'Meldedatum', None, 'rki covid19 sums' ).totals()['value']
 
   # New cases (delta within 24h)
   def get_current_new_cases( self ):
@@ -301,11 +939,9 @@ class arcgis_hub:
   def get_current_total_deaths_03( self ):
     return self.get_total( 'AnzahlTodesfall', None, 'rki covid19' )
   def get_current_total_deaths_04( self ):
-    self.get_total_per_day( 'AnzahlTodesfall', 'Meldedatum', 'NeuerFall', 'rki covid19' )
-    return self.totals['value']
+    return self.get_total_per_day( 'AnzahlTodesfall', 'Meldedatum', 'NeuerFall', 'rki covid19' ).totals()['value']
   def get_current_total_deaths_05( self ):
-    self.get_total_per_day( 'AnzahlTodesfall', 'Meldedatum', None, 'rki covid19 sums' )
-    return self.totals['value']
+    return self.get_total_per_day( 'AnzahlTodesfall', 'Meldedatum', None, 'rki covid19 sums' ).totals()['value']
 
   # New deaths (delta within 24h)
   def get_current_new_deaths( self ):
@@ -329,46 +965,42 @@ class arcgis_hub:
 ####################################################################
 
   def get_total_by_age_and_sex( self ):
-    self.__default_query()
-    self.query['where']="Geschlecht<>'unbekannt' AND Altersgruppe<>'unbekannt' AND NeuerFall IN(0, 1)"
-    self.query['groupByFieldsForStatistics']='Altersgruppe,Geschlecht'
-    self.query['orderByFields']='Altersgruppe asc'
-    self.__query_statistics_type_field( 'sum', 'AnzahlFall' )
-    self.__get( 'rki covid19' )
-    self.print()
+    query = arcgis_query().where( "Geschlecht<>'unbekannt' AND Altersgruppe<>'unbekannt' AND NeuerFall IN(0, 1)" ) \
+              .group_by( 'Altersgruppe', 'Geschlecht' ).order_by( 'Altersgruppe asc' ).statistics( 'sum', 'AnzahlFall' )
+    self.execute( 'rki covid19', query ).print()
 
   # Count of entries per bundesland ?
   def get_BL_per_bundesland( self ):
-    self.__default_query()
-    self.query['groupByFieldsForStatistics']='BL'
-    self.query['orderByFields']='BL asc'
-    self.__query_statistics_type_field( 'count', 'BL' )
-    self.__get( 'rki landkreis' )
-    self.print()
+    query = arcgis_query().group_by( 'BL' ).order_by( 'BL asc' ).statistics( 'count', 'BL' )
+    self.execute( 'rki landkreis', query ).print()
 
   # Accumulated cases per 100000 population
   def get_cases_per_100000_per_bundesland( self ):
-    self.__default_query()
-    self.query['groupByFieldsForStatistics']='LAN_ew_GEN'
-    self.query['orderByFields']='value desc'
-    self.__query_statistics_type_field( 'max', 'faelle_100000_EW' )
-    self.__get( 'rki bundesland' )
-    self.print()
+    query = arcgis_query().group_by( 'LAN_ew_GEN' ).order_by( 'value desc' ).statistics( 'max', 'faelle_100000_EW' )
+    self.execute( 'rki bundesland', query ).print()
 
 
   def get_cases_per_day_corrected(self ):
-    self.__default_query()
-    self.query['where']="AnzahlFall<>0" #" AND Datum>timestamp '2020-03-01 22:59:59'"
-    self.query['outFields']='AnzahlFall,Datum,IstErkrankungsbeginn'
-    self.query['orderByFields']='Datum asc'
-    self.query['groupByFieldsForStatistics']='Datum,IstErkrankungsbeginn'
-    self.__query_statistics_type_field( 'sum', 'AnzahlFall' )
-    self.__get( 'rki covid19 refdate' )
-    self.__parse_values()
+    query = arcgis_query().where( "AnzahlFall<>0" ) \
+              .out_fields( 'AnzahlFall,Datum,IstErkrankungsbeginn' ).order_by( 'Datum asc' ) \
+              .group_by( 'Datum', 'IstErkrankungsbeginn' ).statistics( 'sum', 'AnzahlFall' )
+              #.where_and( "Datum>timestamp '2020-03-01 22:59:59'" )
+    result = self.execute( 'rki covid19 refdate', query )
+
+    if self.columnar:
+      columns = result.columns()
+      days = columns['Datum'].astype( 'datetime64[D]' )
+      dates, index = numpy.unique( days, return_inverse=True )
+      sums = numpy.bincount( index, weights=columns['value'], minlength=len(dates) )
+      sums = numpy.rint( sums ).astype( numpy.int64 )
+      counts = numpy.cumsum( sums )
+      for d, t, v in zip( dates, counts, sums ):
+        print( d, t, v )
+      return { 'dates':dates, 'counts':counts }
 
     common = dict()
     total = 0
-    for v in self.values:
+    for v in result.rows():
       date = v['Datum'].date()
       if not date in common:
         common[date] = { 'sum':0, 'erkrankt':0, 'gemeldet':0, 'total':0 }
@@ -389,81 +1021,79 @@ class arcgis_hub:
     return { 'dates':dates, 'counts':counts }
 
   def get_04(self ):
-    self.__default_query()
-    self.query['where']="AnzahlFall<>0 AND Datum>timestamp '2020-03-01 22:59:59'"
-    self.query['outFields']='FID,AnzahlFall,Datum,IstErkrankungsbeginn'
-    self.query['orderByFields']='Datum asc'
-    self.__query_part( 0, 320 )
-    self.__get( 'rki covid19 refdate' )
-    self.print()
+    query = arcgis_query().where( "AnzahlFall<>0 AND Datum>timestamp '2020-03-01 22:59:59'" ) \
+              .out_fields( 'FID,AnzahlFall,Datum,IstErkrankungsbeginn' ).order_by( 'Datum asc' ).page( 0, 320 )
+    self.execute( 'rki covid19 refdate', query ).print()
 
   def get_03( self ):
-    self.__default_query()
-    self.query['where']="Meldedatum>timestamp '2020-03-01 22:59:59' AND Meldedatum NOT BETWEEN timestamp '2020-12-10 23:00:00' AND timestamp '2020-12-11 22:59:59'"
-    self.query['outFields']="ObjectId,SummeFall,Meldedatum"
-    self.query['orderByFields']="Meldedatum asc"
-    self.__query_part( 0, 10000 )
-    self.__get( 'rki covid19 sums' )
-    self.print()
+    query = arcgis_query() \
+              .where( "Meldedatum>timestamp '2020-03-01 22:59:59' AND Meldedatum NOT BETWEEN timestamp '2020-12-10 23:00:00' AND timestamp '2020-12-11 22:59:59'" ) \
+              .out_fields( "ObjectId,SummeFall,Meldedatum" ).order_by( "Meldedatum asc" ).paged()
+    self.execute( 'rki covid19 sums', query ).print()
 
   def get_02( self ):
-    self.__default_query()
-    self.query['where']="Datum>timestamp '2020-03-01 22:59:59' AND AnzahlFall<>0"
-    self.query['outFields']='FID,AnzahlFall,Datum,IstErkrankungsbeginn'
-    self.query['orderByFields']='Datum asc'
-    self.__query_part( 0, 10 )
-    self.__get( 'rki covid19 refdate' )
-    self.print()
+    query = arcgis_query().where( "Datum>timestamp '2020-03-01 22:59:59' AND AnzahlFall<>0" ) \
+              .out_fields( 'FID,AnzahlFall,Datum,IstErkrankungsbeginn' ).order_by( 'Datum asc' ).page( 0, 10 )
+    self.execute( 'rki covid19 refdate', query ).print()
 
   def get_01( self ):
-    self.__default_query()
-    self.query['groupByFieldsForStatistics']='BL'
-    self.query['orderByFields']='BL asc'
-    self.__query_statistics_type_field( 'count', 'BL', 'count_result' )
-    self.query['outSR']='102100'  # wkid
-    self.__get( 'rki landkreis' )
-    self.print()
+    query = arcgis_query().group_by( 'BL' ).order_by( 'BL asc' ) \
+              .statistics( 'count', 'BL', 'count_result' ).set( outSR='102100' )  # wkid
+    self.execute( 'rki landkreis', query ).print()
 
   def get_total_cases_until( self ):
-    self.__default_query()
-    #self.query['where']="NeuerFall IN(0,1) AND Refdatum<timestamp '2020-12-01 22:59:59'"
-    self.query['where']="NeuerFall IN(0,1) AND Meldedatum<timestamp '2020-12-01 22:59:59'"
-    self.__query_statistics_type_field( 'sum', 'AnzahlFall' )
-    self.__get( 'rki covid19' )
-    return self.__parse_sigle_statistics()
+    #query = arcgis_query().where( "NeuerFall IN(0,1) AND Refdatum<timestamp '2020-12-01 22:59:59'" )
+    query = arcgis_query().where( "NeuerFall IN(0,1) AND Meldedatum<timestamp '2020-12-01 22:59:59'" )
+    return self.execute( 'rki covid19', query.statistics( 'sum', 'AnzahlFall' ) ).value()
 
   # Get field names by requesting 1 record
   def get_fields( self, base='rki covid19' ):
-    self.__default_query()
-    self.__query_part(0,1)
-    self.__get( base )
-    self.__parse_fields()
-    #self.print_fields()
-    print( list(self.fields) )
+    result = self.execute( base, arcgis_query().page( 0, 1 ) )
+    #result.print_fields()
+    print( list(result.fields()) )
+
+  # Call requests (e.g. arcgis_hub.get_current_total_cases_01) concurrently.
+  # All share this instance, results are returned in order of requests.
+  def run_concurrent( self, requests ):
+    return self.__map( lambda r: r( self ), requests )
 
   def check( self ):
-    cases = [ self.get_current_total_cases_01(), 
-              self.get_current_total_cases_02(),
-              self.get_current_total_cases_03(),
-              self.get_current_total_cases_04(),
-              self.get_current_total_cases_05(),
-              self.get_current_total_cases_06() ]
-    are_values_equal( "total cases", cases )
-    deaths = [ self.get_current_total_deaths_01(),
-               self.get_current_total_deaths_02(),
-               self.get_current_total_deaths_03(),
-               self.get_current_total_deaths_04(),
-               self.get_current_total_deaths_05() ]
-    are_values_equal( "total deaths", deaths )
-    revovered = [ self.get_current_total_recovered_01(),
-                  self.get_current_total_recovered_02(),
-                  self.get_current_total_recovered_03() ]
-    are_values_equal( "total recovered", revovered )
+    # Scalar statistics: one query per layer
+    covid19 = { 'cases_03':( 'sum', 'AnzahlFall', 'NeuerFall IN(0, 1)' ),
+                'deaths_03':( 'sum', 'AnzahlTodesfall', None ),
+                'recovered_01':( 'sum', 'AnzahlGenesen', 'NeuGenesen IN(0, 1)' ) }
+    bundesland = { 'cases_01':( 'sum', 'Fallzahl', None ),
+                   'deaths_01':( 'sum', 'Death', None ) }
+    landkreis = { 'cases_02':( 'sum', 'cases', None ),
+                  'deaths_02':( 'sum', 'deaths', None ) }
+    sums = { 'recovered_03':( 'sum', 'AnzahlGenesen', None ) }
+    requests = [ lambda c: c.get_statistics( 'rki covid19', covid19 ),
+                 lambda c: c.get_statistics( 'rki bundesland', bundesland ),
+                 lambda c: c.get_statistics( 'rki landkreis', landkreis ),
+                 lambda c: c.get_statistics( 'rki covid19 sums', sums ),
+                 # Totals of groups and of other layers
+                 lambda c: { 'cases_04':c.get_current_total_cases_04() },
+                 lambda c: { 'cases_05':c.get_current_total_cases_05() },
+                 lambda c: { 'cases_06':c.get_current_total_cases_06() },
+                 lambda c: { 'deaths_04':c.get_current_total_deaths_04() },
+                 lambda c: { 'deaths_05':c.get_current_total_deaths_05() },
+                 lambda c: { 'recovered_02':c.get_current_total_recovered_02() } ]
+    values = dict()
+    for v in self.run_concurrent( requests ):
+      values.update( v )
+    are_values_equal( "total cases", [ values['cases_%02d' % n] for n in range(1,7) ] )
+    are_values_equal( "total deaths", [ values['deaths_%02d' % n] for n in range(1,6) ] )
+    are_values_equal( "total recovered", [ values['recovered_%02d' % n] for n in range(1,4) ] )
+    return values
 
 # Test cases
 def main():
   arcgis = arcgis_hub()
-  arcgis.check()
+  try:
+    arcgis.check()
+  except http_session.session_error as e:
+    eprint( e )
+    sys.exit(-1)
   #print( "Current cases: ", arcgis.get_current_total_cases() )
   #print( "Current new cases: ", arcgis.get_current_new_cases() )
   #print( "Current deaths: ", arcgis.get_current_total_deaths() )
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# One chart per Bundesland and per Landkreis rendered by a pool of processes.
+#
+# Input is the result of district_series.fetch. The totals of all regions
+# (one row per region) are passed once to each worker process, tasks are
+# just the row, title and file name. Files are named by region id:
+#   <directory>/bundesland_<id>.svg  e.g. bundesland_09.svg
+#   <directory>/landkreis_<id>.svg   e.g. landkreis_09162.svg
+#
+
+import os
+import concurrent.futures
+import multiprocessing
+import numpy
+import pygal_chart
+
+# Bundesländer by the first two digits of the district id (Regionalschlüssel)
+bundeslaender = { '01':'Schleswig-Holstein', '02':'Hamburg', '03':'Niedersachsen', '04':'Bremen',
+                  '05':'Nordrhein-Westfalen', '06':'Hessen', '07':'Rheinland-Pfalz', '08':'Baden-Württemberg',
+                  '09':'Bayern', '10':'Saarland', '11':'Berlin', '12':'Brandenburg',
+                  '13':'Mecklenburg-Vorpommern', '14':'Sachsen', '15':'Sachsen-Anhalt', '16':'Thüringen' }
+
+# Read only inputs of the tasks of a worker process (set once by init_worker)
+shared = dict()
+
+def init_worker( dates, totals, options ):
+  shared['dates'] = dates
+  shared['totals'] = totals
+  shared['options'] = options
+
+# Render one chart, task is (row of totals, title, file name)
+def render( task ):
+  row, title, filename = task
+  chart = pygal_chart.pygal_chart( { 'dates':shared['dates'], 'counts':shared['totals'][row] },
+                                   title, *shared['options'] )
+  chart.render_to_file( filename )
+  return filename
+
+# Sum the rows of districts per Bundesland, returns ids and matrix
+def per_bundesland( districts, per_day ):
+  prefix = numpy.asarray( districts, dtype=str ).astype( 'U2' )
+  ids, rows = numpy.unique( prefix, return_inverse=True )
+  sums = numpy.zeros( ( len(ids), per_day.shape[1] ), dtype=per_day.dtype )
+  numpy.add.at( sums, rows, per_day )
+  return ids, sums
+
+# Totals of all regions and the tasks to render them
+def tasks_of( result, directory ):
+  bl_ids, bl_per_day = per_bundesland( result['districts'], result['per_day'] )
+  totals = numpy.cumsum( numpy.vstack( [ bl_per_day, result['per_day'] ] ), axis=1 )
+  tasks = [ ( n, "Infections SARS-CoV-2 %s" % bundeslaender.get( i, i ),
+              os.path.join( directory, 'bundesland_%s.svg' % i ) ) for n, i in enumerate( bl_ids ) ]
+  tasks += [ ( len(bl_ids)+n, "Infections SARS-CoV-2 %s" % name,
+               os.path.join( directory, 'landkreis_%s.svg' % i ) )
+             for n, ( i, name ) in enumerate( zip( result['districts'], result['names'] ) ) ]
+  return totals, tasks
+
+# Render all charts into directory with jobs processes (all cores if None),
+# returns the file names. Options are those of pygal_chart.pygal_chart.
+def render_all( result, directory, jobs=None, points=None, method='lttb', labels=None ):
+  os.makedirs( directory, exist_ok=True )
+  totals, tasks = tasks_of( result, directory )
+  options = ( points, method, labels )
+  if jobs == 1:
+    init_worker( result['dates'], totals, options )
+    return [ render( t ) for t in tasks ]
+  jobs = jobs or os.cpu_count() or 1
+  # Started by a fork server (as arcgis_hub.decoder_pool), the caller runs threads
+  with concurrent.futures.ProcessPoolExecutor( jobs, mp_context=multiprocessing.get_context( 'forkserver' ),
+                                               initializer=init_worker,
+                                               initargs=( result['dates'], totals, options ) ) as pool:
+    return list( pool.map( render, tasks, chunksize=max( 1, len(tasks) // ( jobs*4 ) ) ) )
+
+#EOF
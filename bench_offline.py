@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Offline benchmark against the local stand-in servers (standin_server.py).
+#
+# For every data size (number of rki covid19 records) a stand-in server is
+# started and these are measured:
+#   * arcgis_hub queries (check, statistics, records, columns, stream)
+#   * parse_rki_xls of the spreadsheet
+#   * main() of sars_2_plot.py without plotting
+# Reported are latency (median of the runs), throughput (records per second)
+# and peak of allocated memory (one extra run with tracemalloc). The server
+# runs in a process of its own, so it is not part of the measurements.
+#
+#   ./bench_offline.py --records 10000 100000 -n 3
+#
+
+import os,sys,time
+import argparse
+import statistics
+import tempfile
+import multiprocessing
+import tracemalloc
+import standin_server
+import arcgis_hub
+import sars_2_plot
+
+# Median time in seconds of some runs and peak memory in bytes of one more run
+def measure( function, runs ):
+  times = list()
+  for n in range( runs ):
+    start = time.perf_counter()
+    function()
+    times.append( time.perf_counter()-start )
+  tracemalloc.start()
+  function()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return statistics.median( times ), peak
+
+# Run a stand-in server (in a process of its own) and pass its base URI
+def serve( records, days, queue ):
+  server = standin_server.standin_server( standin_server.standin_data( records, days ) )
+  queue.put( server.base() )
+  server.serve_forever()
+
+# Benchmarks as (name, function, number of records processed)
+def benchmarks( base, records, days, directory ):
+  def check():
+    arcgis_hub.arcgis_hub( server=base ).check()
+
+  def statistics_batch():
+    arcgis_hub.arcgis_hub( server=base ).get_statistics( 'rki covid19',
+        { 'cases':( 'sum', 'AnzahlFall', 'NeuerFall IN(0,1)' ),
+          'deaths':( 'sum', 'AnzahlTodesfall', 'NeuerTodesfall IN(0,1)' ),
+          'recovered':( 'sum', 'AnzahlGenesen', 'NeuGenesen IN(0,1)' ),
+          'count_delta':( 'sum', 'AnzahlFall', 'NeuerFall IN(1,-1)' ) } )
+
+  def records_rows():
+    arcgis_hub.arcgis_hub( server=base ).get_records( 'rki covid19' )
+
+  def records_columns():
+    arcgis_hub.arcgis_hub( server=base, columnar=True ).get_records( 'rki covid19' )
+
+  def column_chunks():
+    arcgis_hub.arcgis_hub( server=base ).get_column_chunks( 'rki covid19' )
+
+  def stream_rows():
+    for row in arcgis_hub.arcgis_hub( server=base ).stream_rows( 'rki covid19' ):
+      pass
+
+  # Download once, parse without snapshot each time
+  covid = sars_2_plot.classCovid( 0 )
+  os.chdir( directory )
+  covid.get_file( covid.get_rki_internal_link( arcgis_hub.rebase_uri( xlsx_uri, base ) ) )
+  def parse_xls():
+    covid.snapshot = None
+    if os.path.exists( covid.snapshot_name( covid.filename ) ):
+      os.remove( covid.snapshot_name( covid.filename ) )
+    covid.parse_rki_xls()
+
+  # Fresh directory each time (spreadsheet is downloaded again)
+  def pipeline():
+    with tempfile.TemporaryDirectory() as temp:
+      os.chdir( temp )
+      argv = sys.argv
+      sys.argv = [ 'sars_2_plot.py', '--no-cache', '--plot', 'none',
+                   '--rki-server', base, '--arcgis-server', base ]
+      try:
+        sars_2_plot.main()
+      finally:
+        sys.argv = argv
+        os.chdir( directory )
+
+  return [ ( 'arcgis check', check, None ),
+           ( 'arcgis get_statistics', statistics_batch, None ),
+           ( 'arcgis get_records', records_rows, records ),
+           ( 'arcgis get_records columnar', records_columns, records ),
+           ( 'arcgis get_column_chunks', column_chunks, records ),
+           ( 'arcgis stream_rows', stream_rows, records ),
+           ( 'parse_rki_xls', parse_xls, days ),
+           ( 'main() pipeline', pipeline, None ) ]
+
+xlsx_uri = 'https://www.rki.de/DE/Content/InfAZ/N/Neuartiges_Coronavirus/Daten/Fallzahlen_Kum_Tab.xlsx'
+
+def main():
+  parser = argparse.ArgumentParser( description='Offline benchmark against local stand-in servers' )
+  parser.add_argument( '--records', type=int, nargs='+', default=[ 10000, 100000 ],
+                       help='Numbers of rki covid19 records (one run per size).' )
+  parser.add_argument( '--days', type=int, default=120, help='Number of days of the series.' )
+  parser.add_argument( '-n', '--runs', type=int, default=3, help='Number of runs to take the median of.' )
+  parser.add_argument( '-k', '--select', type=str, default=None, help='Run benchmarks containing this text only.' )
+  args = parser.parse_args()
+
+  cwd = os.getcwd()
+  print( "%-30s %9s %11s %14s %10s" % ( 'benchmark', 'records', 'latency ms', 'records/s', 'peak MiB' ) )
+  for size in args.records:
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process( target=serve, args=( size, args.days, queue ), daemon=True )
+    server.start()
+    try:
+      base = queue.get()
+      with tempfile.TemporaryDirectory() as directory:
+        for name, function, count in benchmarks( base, size, args.days, directory ):
+          if args.select and not args.select in name: continue
+          latency, peak = measure( function, args.runs )
+          print( "%-30s %9d %11.1f %14s %10.1f" % ( name, size, latency*1000,
+                 '%.0f' % ( count/latency ) if count else '-', peak/1024/1024 ) )
+          sys.stdout.flush()
+        os.chdir( cwd )
+    finally:
+      server.terminate()
+      server.join()
+
+if __name__ == '__main__':
+  main()
+
+#EOF
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Startup benchmark of sars_2_plot.py to catch import time regressions.
+#
+#   * Time of "sars_2_plot.py --help" (median of some runs)
+#   * Slowest imports as reported by "python -X importtime"
+#   * Heavy modules that must not be loaded by just importing sars_2_plot
+#
+# Exit code is 1 if a heavy module is loaded or the time exceeds --max.
+#
+
+import os,sys,re,time
+import argparse
+import statistics
+import subprocess
+
+# Modules to be loaded only by the stages that need them
+heavy = [ 'pandas', 'bs4', 'matplotlib', 'mplexporter', 'pygal', 'plotly' ]
+
+here = os.path.dirname( os.path.abspath( __file__ ) )
+
+def time_help( runs ):
+  times = list()
+  for n in range( runs ):
+    start = time.perf_counter()
+    subprocess.run( [ sys.executable, os.path.join( here, 'sars_2_plot.py' ), '--help' ],
+                    check=True, stdout=subprocess.DEVNULL )
+    times.append( time.perf_counter()-start )
+  return statistics.median( times )
+
+# Cumulative import times in usec by module
+def import_times():
+  result = subprocess.run( [ sys.executable, '-X', 'importtime', '-c', 'import sars_2_plot' ],
+                           cwd=here, check=True, stderr=subprocess.PIPE, text=True )
+  times = dict()
+  pat = re.compile( r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)' )
+  for line in result.stderr.splitlines():
+    m = pat.match( line )
+    if m: times[m.group(3)] = int(m.group(2))
+  return times
+
+def loaded_heavy_modules():
+  code = 'import sys, sars_2_plot; print( " ".join( sorted( sys.modules ) ) )'
+  result = subprocess.run( [ sys.executable, '-c', code ], cwd=here, check=True,
+                           stdout=subprocess.PIPE, text=True )
+  modules = result.stdout.split()
+  return [ h for h in heavy if h in modules ]
+
+def main():
+  parser = argparse.ArgumentParser( description='Startup benchmark of sars_2_plot.py' )
+  parser.add_argument( '-n', '--runs', type=int, default=5, help='Number of runs to take the median of.' )
+  parser.add_argument( '--max', type=float, default=None, help='Fail if --help takes longer (seconds).' )
+  parser.add_argument( '--top', type=int, default=10, help='Number of slowest imports to show.' )
+  args = parser.parse_args()
+
+  failed = False
+  median = time_help( args.runs )
+  print( "sars_2_plot.py --help: %.3f s (median of %d)" % ( median, args.runs ) )
+  if args.max and median > args.max:
+    print( "FAIL: slower than %.3f s" % args.max )
+    failed = True
+
+  times = import_times()
+  print( "Slowest imports (cumulative):" )
+  for name in sorted( times, key=times.get, reverse=True )[:args.top]:
+    print( "  %8.1f ms %s" % ( times[name]/1000, name ) )
+
+  loaded = loaded_heavy_modules()
+  if loaded:
+    print( "FAIL: loaded on import: %s" % ", ".join( loaded ) )
+    failed = True
+  sys.exit( 1 if failed else 0 )
+
+if __name__ == '__main__':
+  main()
+
+#EOF
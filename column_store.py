@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Memory mapped store of columns of feature data.
+#
+# Each field is one file of fixed width values (little endian), opened by
+# numpy.memmap read only, so processes reading the same store share the
+# pages of the page cache and do not parse anything:
+#   strings  codes (uint8, uint16 or uint32) into a table of the strings
+#   dates    int64 epoch msec
+#   numbers  int64 or float64
+# A store is written as a new generation, the one before is kept until the
+# next save, so readers that just read 'current' before the switch can still
+# open it (and readers of older ones keep their mappings):
+#   <directory>/current           number of the current generation
+#   <directory>/<n>/meta.json     length, dtype and table of each field
+#                                 and any data of the writer
+#   <directory>/<n>/<field>.col   values of one field
+#
+
+import os,re,json
+import shutil
+import numpy
+import arcgis_hub
+
+# File of a field (names of fields of feature servers are plain words)
+def column_file( directory, name ):
+  return os.path.join( directory, re.sub( r'[^\w.-]', '_', name )+'.col' )
+
+# Smallest type of codes into a table
+def code_type( table ):
+  return numpy.min_scalar_type( max(len(table)-1,0) )
+
+class column_store:
+  def __init__( self, directory ):
+    self.directory = directory
+
+  # Directory of the current generation or None
+  def current( self ):
+    try:
+      with open( os.path.join( self.directory, 'current' ), 'r' ) as f:
+        return os.path.join( self.directory, f.read().strip() )
+    except FileNotFoundError:
+      return None
+
+  # Write columns (numpy arrays of equal length), tables of strings (list
+  # of strings by name of the column of codes) and meta (JSON) as a new
+  # generation, generations before the one before are removed.
+  def save( self, columns, tables=None, meta=None ):
+    tables = tables or dict()
+    current = self.current()
+    previous = int( os.path.basename( current ) ) if current else 0
+    generation = previous+1
+    directory = os.path.join( self.directory, str(generation) )
+    shutil.rmtree( directory, ignore_errors=True )
+    os.makedirs( directory )
+    lengths = set( len(c) for c in columns.values() )
+    assert len(lengths) <= 1
+    fields = dict()
+    for name, values in columns.items():
+      values = numpy.asarray( values )
+      if name in tables:
+        values = values.astype( code_type( tables[name] ) )
+      elif values.dtype.kind == 'M':
+        values = values.astype( 'datetime64[ms]' ).astype( numpy.int64 )
+      values = values.astype( values.dtype.newbyteorder( '<' ) )
+      values.tofile( column_file( directory, name ) )
+      fields[name] = { 'dtype':values.dtype.str }
+      if name in tables:
+        fields[name]['table'] = tables[name]
+    with open( os.path.join( directory, 'meta.json' ), 'w', encoding='utf-8' ) as f:
+      json.dump( { 'length':lengths.pop() if lengths else 0, 'fields':fields, 'meta':meta }, f )
+    # Switch to the new generation
+    with open( os.path.join( self.directory, 'current.tmp' ), 'w' ) as f:
+      f.write( str(generation) )
+    os.replace( os.path.join( self.directory, 'current.tmp' ), os.path.join( self.directory, 'current' ) )
+    for name in os.listdir( self.directory ):
+      if name.isdigit() and not int(name) in ( generation, previous ):
+        shutil.rmtree( os.path.join( self.directory, name ), ignore_errors=True )
+
+  # Columns (read only numpy.memmap), tables and meta of the current
+  # generation or None if there is none
+  def load( self ):
+    directory = self.current()
+    if not directory: return None
+    try:
+      with open( os.path.join( directory, 'meta.json' ), 'r', encoding='utf-8' ) as f:
+        meta = json.load( f )
+      columns = dict()
+      tables = dict()
+      for name, field in meta['fields'].items():
+        dtype = numpy.dtype( field['dtype'] )
+        if meta['length']:
+          columns[name] = numpy.memmap( column_file( directory, name ), dtype=dtype, mode='r',
+                                        shape=( meta['length'], ) )
+        else:
+          # Empty files can not be mapped
+          columns[name] = numpy.zeros( 0, dtype=dtype )
+        if 'table' in field:
+          tables[name] = field['table']
+    except (FileNotFoundError, ValueError, KeyError):
+      return None
+    return columns, tables, meta['meta']
+
+# Concatenate chunks of columns (of arcgis_hub.stream_columns) into columns
+# and tables of strings. Dates become epoch msec.
+def concatenate( chunks, fields ):
+  columns = dict()
+  tables = dict()
+  for f in fields:
+    name = f['name']
+    parts = [ c[name] for c in chunks if name in c ]
+    if f['type'] == 'esriFieldTypeString' or any( isinstance( p, arcgis_hub.dictionary_column ) for p in parts ):
+      # One table for all chunks
+      index = dict()
+      codes = [ numpy.array( [ index.setdefault( v, len(index) ) for v in p.table ]+[0], dtype=numpy.int64 )[p.codes]
+                for p in parts ]
+      codes = numpy.concatenate( codes ) if codes else numpy.zeros( 0, dtype=numpy.int64 )
+      columns[name] = codes.astype( code_type( index ) )
+      tables[name] = list( index )
+    elif not parts:
+      dtype = numpy.float64 if f['type'] == 'esriFieldTypeDouble' else numpy.int64
+      columns[name] = numpy.zeros( 0, dtype=dtype )
+    elif parts[0].dtype.kind == 'M':
+      columns[name] = numpy.concatenate( parts ).astype( 'datetime64[ms]' ).astype( numpy.int64 )
+    elif parts[0].dtype.kind == 'O':
+      # Any other type (e.g. small integers) is kept as table of values
+      index = dict()
+      codes = numpy.array( [ index.setdefault( v, len(index) ) for p in parts for v in p ], dtype=numpy.int64 )
+      columns[name] = codes.astype( code_type( index ) )
+      tables[name] = list( index )
+    else:
+      columns[name] = numpy.concatenate( parts )
+  return columns, tables
+
+# Columns of the features of a reply (e.g. arcgis_hub.arcgis_result.reply) for a store
+def from_reply( reply ):
+  fields = reply.get( 'fields', [] )
+  return concatenate( [ arcgis_hub.parse_columns( reply.get( 'features', [] ), arcgis_hub.fields_by_name( fields ) ) ],
+                      fields )
+
+#EOF
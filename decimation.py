@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Downsampling of long series before plotting.
+#
+# Functions return the indices of the points to keep (sorted, first and last
+# point are always kept), so all series of a chart and their x labels can be
+# reduced the same way. Methods keep the shape of the series:
+#   lttb    Largest Triangle Three Buckets (Sveinn Steinarsson, 2013)
+#   minmax  minimum and maximum of each bucket
+#
+
+import numpy
+
+# Indices of at most budget points selected by Largest Triangle Three Buckets
+def lttb( series, budget ):
+  y = numpy.asarray( series, dtype=numpy.float64 )
+  n = len(y)
+  if budget >= n or budget < 3:
+    return numpy.arange( n )
+  # Inner points are split into budget-2 buckets, one point is kept of each
+  edges = numpy.linspace( 1, n-1, budget-1 ).astype( numpy.int64 )
+  keep = numpy.empty( budget, dtype=numpy.int64 )
+  keep[0] = 0
+  keep[-1] = n-1
+  a = 0
+  for b in range( budget-2 ):
+    lo, hi = edges[b], edges[b+1]
+    # Average of the next bucket (the last point for the last bucket)
+    if b+2 < len(edges):
+      cx = ( edges[b+1]+edges[b+2]-1 ) / 2.0
+      cy = y[edges[b+1]:edges[b+2]].mean()
+    else:
+      cx, cy = n-1, y[n-1]
+    x = numpy.arange( lo, hi )
+    area = numpy.abs( ( a-cx ) * ( y[lo:hi]-y[a] ) - ( a-x ) * ( cy-y[a] ) )
+    a = lo+int( numpy.argmax( area ) )
+    keep[b+1] = a
+  return keep
+
+# Indices of minimum and maximum of budget/2 buckets (at most budget+2 points)
+def minmax( series, budget ):
+  y = numpy.asarray( series )
+  n = len(y)
+  if budget >= n or budget < 2:
+    return numpy.arange( n )
+  edges = numpy.linspace( 0, n, budget//2+1 ).astype( numpy.int64 )
+  keep = [ 0, n-1 ]
+  for lo, hi in zip( edges[:-1], edges[1:] ):
+    if hi > lo:
+      keep.append( lo+int( numpy.argmin( y[lo:hi] ) ) )
+      keep.append( lo+int( numpy.argmax( y[lo:hi] ) ) )
+  return numpy.unique( keep )
+
+methods = { 'lttb':lttb, 'minmax':minmax }
+
+# Indices to keep of several series sharing the x axis: the budget is shared
+# by the series and the points selected of each series are kept for all.
+def indices( series, budget, method='lttb' ):
+  series = [ numpy.asarray( s ) for s in series ]
+  n = len(series[0]) if series else 0
+  if not budget or budget >= n:
+    return numpy.arange( n )
+  share = max( budget // len(series), 3 )
+  return numpy.unique( numpy.concatenate( [ methods[method]( s, share ) for s in series ] ) )
+
+#EOF
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Time series of all districts (Landkreise) at once.
+#
+# Cases per district and day are put into one dense matrix (districts x days,
+# days without cases are 0). 7 day sums, incidence and change to the week
+# before are computed for all districts in one pass along the last axis.
+#
+
+import numpy
+import rolling
+
+# Row of each id in districts (-1 if unknown), districts need not be sorted
+def rows_of( districts, ids ):
+  districts = numpy.asarray( districts, dtype=str )
+  ids = numpy.asarray( ids, dtype=str )
+  if not len(districts):
+    return numpy.full( len(ids), -1, dtype=numpy.int64 )
+  order = numpy.argsort( districts )
+  pos = numpy.searchsorted( districts, ids, sorter=order )
+  rows = order[ numpy.minimum( pos, len(districts)-1 ) ]
+  return numpy.where( districts[rows] == ids, rows, -1 )
+
+# Dense matrix of the sums of values by district (rows) and day (columns).
+# district: id per record, day: datetime64 per record.
+# districts: ids of the rows (default: all ids found, sorted).
+# Returns districts, dates (datetime64[D]) and matrix.
+def matrix( district, day, value, districts=None, first=None, last=None ):
+  district = numpy.asarray( district, dtype=str )
+  if districts is None:
+    districts = numpy.unique( district )
+  districts = numpy.asarray( districts, dtype=str )
+  days = numpy.asarray( day ).astype( 'datetime64[D]' )
+  if first is None: first = days.min() if len(days) else numpy.datetime64( 'today', 'D' )
+  if last is None: last = days.max() if len(days) else first
+  first, last = numpy.datetime64( first, 'D' ), numpy.datetime64( last, 'D' )
+  dates = numpy.arange( first, last+1 )
+  rows = rows_of( districts, district )
+  cols = ( days-first ).astype( numpy.int64 )
+  keep = ( rows >= 0 ) & ( cols >= 0 ) & ( cols < len(dates) )
+  flat = numpy.bincount( rows[keep]*len(dates)+cols[keep], weights=numpy.asarray( value )[keep],
+                         minlength=len(districts)*len(dates) )
+  return districts, dates, numpy.rint( flat ).astype( numpy.int64 ).reshape( len(districts), len(dates) )
+
+# Statistics of all districts: per_day (the matrix), sums of the last days,
+# incidence (sums per 100000 inhabitants, nan if population is unknown) and
+# week_change (change of sums compared to the same day of the week before).
+def statistics( per_day, population, days=7 ):
+  sums = rolling.window_sum( per_day, days )
+  return { 'per_day':per_day, 'sums':sums,
+           'incidence':rolling.incidence( per_day, population, days ),
+           'week_change':rolling.week_change( sums ) }
+
+# Fetch cases per district and day and the population of districts
+# (arcgis is an arcgis_hub) and compute the statistics of all districts.
+# Returns dict with districts, names, dates, population and the statistics.
+def fetch( arcgis, counter='AnzahlFall', newcase='NeuerFall', days=7 ):
+  cases, districts = arcgis.run_concurrent( [ lambda a: a.get_total_per_district_and_day( counter, newcase ),
+                                              lambda a: a.get_population_per_district() ] )
+  ids, dates, per_day = matrix( cases['IdLandkreis'].decode(), cases['Meldedatum'], cases['value'],
+                                districts['RS'].decode() )
+  result = statistics( per_day, districts['EWZ'], days )
+  result.update( { 'districts':ids, 'names':districts['GEN'].decode().astype( str ),
+                   'dates':dates, 'population':districts['EWZ'] } )
+  return result
+
+#EOF
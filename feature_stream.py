@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Incremental decoder of feature server replies.
+#
+# The reply is read chunk by chunk from a file like object (e.g. an urllib3
+# response opened with preload_content=False). Only the feature currently
+# decoded is kept in memory, not the whole body nor the whole object tree.
+#
+
+import sys,io,json
+import codecs
+
+# Iterating yields the features of the reply one by one.
+# All other keys of the reply are collected in header. Keys in front of
+# 'features' (e.g. 'fields') are available before the first feature.
+class feature_stream:
+  def __init__( self, response, chunk_size=64*1024 ):
+    self.response = response
+    self.chunk_size = chunk_size
+    self.decoder = json.JSONDecoder()
+    self.text = codecs.getincrementaldecoder( 'utf-8' )()
+    self.buffer = ''
+    self.pos = 0
+    self.eof = False
+    self.header = dict()
+
+  # Read more data (drops what has been decoded already)
+  def __read( self ):
+    if self.eof: return False
+    data = self.response.read( self.chunk_size )
+    if data:
+      text = self.text.decode( data )
+    else:
+      text = self.text.decode( b'', final=True )
+      self.eof = True
+    self.buffer = self.buffer[self.pos:] + text
+    self.pos = 0
+    return True
+
+  # Next character that is not white space
+  def __peek( self ):
+    while True:
+      while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+        self.pos += 1
+      if self.pos < len(self.buffer):
+        return self.buffer[self.pos]
+      if not self.__read():
+        raise ValueError( 'Unexpected end of reply' )
+
+  # Consume one of the expected characters
+  def __expect( self, chars ):
+    c = self.__peek()
+    if not c in chars:
+      raise ValueError( "Expected '%s' at '%s'" % ( chars, self.buffer[self.pos:self.pos+32] ) )
+    self.pos += 1
+    return c
+
+  # Decode one complete JSON value
+  def __value( self ):
+    self.__peek()
+    while True:
+      try:
+        value, end = self.decoder.raw_decode( self.buffer, self.pos )
+        # A number at the end of the buffer may be incomplete
+        if end < len(self.buffer) or self.eof:
+          self.pos = end
+          return value
+      except json.JSONDecodeError:
+        if self.eof: raise
+      self.__read()
+
+  def __iter__( self ):
+    self.__expect( '{' )
+    if self.__peek() == '}':
+      self.pos += 1
+      return
+    while True:
+      key = self.__value()
+      self.__expect( ':' )
+      if key == 'features':
+        self.__expect( '[' )
+        if self.__peek() == ']':
+          self.pos += 1
+        else:
+          while True:
+            yield self.__value()
+            if self.__expect( ',]' ) == ']': break
+      else:
+        self.header[key] = self.__value()
+      if self.__expect( ',}' ) == '}': break
+
+###################################################################
+# Test cases
+
+# Replies and whether they are complete, each is decoded with all of
+# fixture_chunk_sizes so values are split at any position (numbers, escapes,
+# multi byte characters)
+fixture_replies = [
+  ( b'{}', True ),
+  ( b'{"features":[]}', True ),
+  ( b' { "maxRecordCount" : 32000, "fields" : [ {"name":"ObjectId"} ] ,\r\n "features" : [ ] , "exceededTransferLimit" : true } ', True ),
+  ( '{"objectIdFieldName":"ObjectId","features":[{"attributes":{"ObjectId":1,"Landkreis":"SK M\u00fcnchen",'
+    '"AnzahlFall":12345,"Meldedatum":1583020800000,"Altersgruppe":null}},{"attributes":{"ObjectId":2,'
+    '"Landkreis":"LK \\"Eber\\"sberg ]}","AnzahlFall":-1.5e3}}],"exceededTransferLimit":false}'.encode( 'utf-8' ), True ),
+  ( '{"features":[{"attributes":{"Landkreis":"SK Köln \\u00e4","AnzahlFall":7}}],"count":2}'.encode( 'utf-8' ), True ),
+  ( b'{"features":[{"attributes":{"ObjectId":1}},{"attributes":{"ObjectId":2', False ),
+  ( b'{"features":[{"attributes":{"ObjectId":1}}]', False ),
+  ( b'{"features":[{"attributes":{"ObjectId":1}}', False ) ]
+
+fixture_chunk_sizes = [ 1, 2, 3, 7, 64*1024 ]
+
+# Decode the replies and compare features and header with those of
+# json.loads, returns the number of failed cases
+def check():
+  failed = 0
+  for data, complete in fixture_replies:
+    if complete:
+      expected = json.loads( data )
+      features = expected.pop( 'features', [] )
+    for chunk_size in fixture_chunk_sizes:
+      stream = feature_stream( io.BytesIO( data ), chunk_size )
+      try:
+        got = list( stream )
+      except ValueError:
+        got = None
+      if not complete:
+        ok = got is None
+      else:
+        ok = got == features and stream.header == expected
+      if not ok:
+        print( "Failed %r in chunks of %d:\n  got %s %s" % ( data[:40], chunk_size, got, stream.header ) )
+        failed += 1
+  return failed
+
+def main():
+  failed = check()
+  print( "%d of %d cases failed" % ( failed, len(fixture_replies)*len(fixture_chunk_sizes) ) )
+  sys.exit( 1 if failed else 0 )
+
+if __name__ == '__main__':
+  main()
+
+#EOF
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Metrics of HTTP fetches.
+#
+# Every fetch is recorded as one event (a dict) with:
+#   label   URI label of the layer or the URI of the page
+#   query   hash of the query (None for pages)
+#   bytes   bytes received
+#   start   time of the request (seconds since epoch)
+#   ttfb    time to first byte (seconds, reply header received)
+#   total   time of the whole fetch (seconds)
+#   parse   time to decode or parse the reply (seconds, None if interleaved)
+#   cache   'hit' (cache or "304 Not Modified"), 'miss' or None (no cache)
+# Events go to a callback and optionally to a JSON lines file or to a
+# Chrome trace file (chrome://tracing, https://ui.perfetto.dev).
+#
+
+import os,json,time
+import hashlib
+import threading
+
+# Short hash of a query (same query, same hash)
+def query_hash( query ):
+  if query is None: return None
+  canonical = json.dumps( query, sort_keys=True, separators=(',', ':'), default=str )
+  return hashlib.sha1( canonical.encode( 'utf-8' ) ).hexdigest()[:12]
+
+class fetch_metrics:
+  # callback: called with each event
+  # filename: JSON lines file to append events to
+  # trace: Chrome trace file (JSON array of complete events)
+  def __init__( self, callback=None, filename=None, trace=None ):
+    self.callback = callback
+    self.lock = threading.Lock()
+    self.events = list()
+    self.file = open( filename, 'a', encoding='utf-8' ) if filename else None
+    self.trace = open( trace, 'w', encoding='utf-8' ) if trace else None
+    self.traced = 0
+    if self.trace: self.trace.write( '[\n' )
+
+  # Start an event, to be passed to record() when the fetch is done
+  def start( self, label, query=None ):
+    return { 'label':label, 'query':query_hash( query ), 'bytes':0, 'start':time.time(),
+             'ttfb':None, 'total':None, 'parse':None, 'cache':None,
+             'clock':time.perf_counter() }
+
+  # Time since start of the event
+  def elapsed( self, event ):
+    return time.perf_counter()-event['clock']
+
+  def record( self, event ):
+    event = dict( event )
+    event.pop( 'clock', None )
+    if event['total'] is None: event['total'] = 0.0
+    with self.lock:
+      self.events.append( event )
+      if self.file:
+        self.file.write( json.dumps( event, separators=(',', ':') )+'\n' )
+        self.file.flush()
+      if self.trace:
+        trace = { 'name':event['label'], 'cat':event['cache'] or 'fetch', 'ph':'X',
+                  'ts':int( event['start']*1e6 ), 'dur':int( event['total']*1e6 ),
+                  'pid':os.getpid(), 'tid':threading.get_ident(), 'args':event }
+        self.trace.write( ( ',\n' if self.traced else '' )+json.dumps( trace, separators=(',', ':') ) )
+        self.traced += 1
+    if self.callback:
+      self.callback( event )
+
+  # Total time, bytes and number of fetches by label (most expensive first)
+  def summary( self ):
+    totals = dict()
+    with self.lock:
+      for e in self.events:
+        t = totals.setdefault( e['label'], { 'label':e['label'], 'fetches':0, 'hits':0, 'bytes':0, 'total':0.0, 'parse':0.0 } )
+        t['fetches'] += 1
+        t['hits'] += e['cache'] == 'hit'
+        t['bytes'] += e['bytes']
+        t['total'] += e['total']
+        t['parse'] += e['parse'] or 0.0
+    return sorted( totals.values(), key=lambda t: t['total'], reverse=True )
+
+  def close( self ):
+    with self.lock:
+      if self.file:
+        self.file.close()
+        self.file = None
+      if self.trace:
+        self.trace.write( '\n]\n' )
+        self.trace.close()
+        self.trace = None
+
+#EOF
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# One HTTP session shared by all fetches of a run.
+#
+# Keeps the connection pools (keep-alive) of all hosts, retries on 429 and
+# 5xx replies and on connection errors and timeouts with exponential backoff
+# (Retry-After is honored) and raises typed exceptions instead of exiting.
+# Replies requested with preload_content=False are read by read(), which
+# requests again (same backoff) if the connection breaks while reading:
+#   session_error       base of all
+#   connection_error    no reply (after retries), e.g. timeout or TLS error
+#   status_error        reply with error status (after retries)
+#   reply_error         reply that can not be used, e.g. malformed JSON
+#
+
+import urllib3
+
+class session_error( Exception ):
+  def __init__( self, message, uri=None ):
+    Exception.__init__( self, "%s %s" % ( message, uri ) if uri else message )
+    self.uri = uri
+
+class connection_error( session_error ):
+  pass
+
+class status_error( session_error ):
+  def __init__( self, status, uri=None ):
+    session_error.__init__( self, "HTTP status %d" % status, uri )
+    self.status = status
+
+class reply_error( session_error ):
+  pass
+
+# Status of replies worth a retry
+retry_status = [ 429, 500, 502, 503, 504 ]
+# Errors while reading the content of a reply worth a retry
+read_errors = ( urllib3.exceptions.ProtocolError, urllib3.exceptions.ReadTimeoutError )
+# Headers of conditional requests (dropped to read the content again)
+conditional_headers = [ 'if-none-match', 'if-modified-since' ]
+
+class http_session:
+  # pools: number of hosts to keep connections of
+  # maxsize: connections kept per host (concurrent requests of a host)
+  # retries: retries of a request, backoff: first delay (seconds, doubled each retry)
+  # timeout: seconds to connect and seconds between bytes read
+  def __init__( self, pools=10, maxsize=8, retries=5, backoff=0.5, backoff_max=60.0,
+                timeout=(10.0, 60.0), headers=None ):
+    self.retry = urllib3.Retry( total=retries, backoff_factor=backoff, backoff_max=backoff_max,
+                                status_forcelist=retry_status, allowed_methods=[ 'GET', 'HEAD' ],
+                                respect_retry_after_header=True, raise_on_status=False )
+    self.timeout = urllib3.Timeout( connect=timeout[0], read=timeout[1] )
+    self.http = urllib3.PoolManager( pools, maxsize=maxsize, headers=headers,
+                                     retries=self.retry, timeout=self.timeout )
+
+  # Request an URI, returns the reply (status 2xx or 304) or raises session_error
+  def request( self, method, uri, headers=None, preload_content=True ):
+    try:
+      reply = self.http.request( method, uri, headers=headers, preload_content=preload_content )
+    except urllib3.exceptions.SSLError as e:
+      raise connection_error( "TLS error %s" % e, uri ) from e
+    except urllib3.exceptions.MaxRetryError as e:
+      raise connection_error( str( e.reason ), uri ) from e
+    except urllib3.exceptions.HTTPError as e:
+      raise connection_error( str( e ), uri ) from e
+    if reply.status >= 400:
+      if not preload_content:
+        reply.drain_conn()
+        reply.release_conn()
+      raise status_error( reply.status, uri )
+    return reply
+
+  # Read the content of a reply (of a GET with preload_content=False) and
+  # release the connection. If the connection breaks or times out while
+  # reading, the URI is requested again (with the retries and backoff of
+  # requests, unconditionally as the content is needed).
+  # Returns the reply (of the last request) and its content.
+  def read( self, reply, uri, headers=None ):
+    headers = dict( (k,v) for k,v in (headers or {}).items() if not k.lower() in conditional_headers )
+    retry = self.retry
+    while True:
+      try:
+        data = reply.data
+        reply.release_conn()
+        return reply, data
+      except read_errors as e:
+        reply.close()
+        try:
+          retry = retry.increment( 'GET', uri, error=e )
+        except urllib3.exceptions.MaxRetryError:
+          raise connection_error( str( e ), uri ) from e
+      except urllib3.exceptions.HTTPError as e:
+        raise connection_error( str( e ), uri ) from e
+      retry.sleep()
+      reply = self.request( 'GET', uri, headers, preload_content=False )
+
+  def urlopen( self, method, uri, headers=None, preload_content=True ):
+    return self.request( method, uri, headers, preload_content )
+
+  def clear( self ):
+    self.http.clear()
+
+#EOF
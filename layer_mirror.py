@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Local mirror of feature server layers with an in-process query engine.
+#
+# A mirrored layer is downloaded once (pages decoded by a pool of processes,
+# arcgis_hub.get_column_chunks) into a column_store (memory mapped, strings
+# as codes into a table, dates as epoch msec) in <directory>/<layer>, with
+# the description and version (Datenstand) of the layer.
+# If the version on the server did change only new and changed records are
+# fetched (delta): records with a flag NeuerFall, NeuerTodesfall or NeuGenesen
+# of -1 or 1 (changed with the new publication), records with such a flag in
+# the mirror (changed with the publication before, e.g. gone now) and records
+# with an ObjectId above the ones of the mirror. The layer is downloaded again
+# if it has no flags, if it has been republished (ObjectIds of other records)
+# or if counts and sums of the result are not those of the server.
+#
+# Queries (arcgis_hub.arcgis_query) of mirrored layers are evaluated with
+# vectorized filters and group-by: where (AND of =, <>, <, >, <=, >=,
+# [NOT] IN, [NOT] BETWEEN, IS [NOT] NULL), outFields, orderByFields,
+# groupByFieldsForStatistics with outStatistics (sum, count, min, max, avg),
+# returnCountOnly, resultOffset and resultRecordCount. The replies are those
+# of the feature server (but never exceed a transfer limit).
+# Where clauses are parsed by where_clause (as by standin_server). Run
+# ./layer_mirror.py to check the engine against replies written by hand.
+#
+
+import os,sys,json,time
+import threading
+import numpy
+import arcgis_hub
+import column_store
+import where_clause
+import http_session
+import reply_cache
+
+# Layers mirrored by default
+default_layers = [ 'rki covid19', 'rki covid19 sums' ]
+
+# Fields telling what changed with a publication
+# (1: only in the new one, -1: only in the one before, 0: in both)
+flag_fields = [ 'NeuerFall', 'NeuerTodesfall', 'NeuGenesen' ]
+# ObjectIds per query of records by ObjectId (length of URI)
+ids_per_query = 400
+# Records compared to detect a republished layer
+probe_records = 16
+
+# Default location of the mirror
+def default_directory():
+  return os.path.join( reply_cache.default_directory(), 'mirror' )
+
+###################################################################
+# One mirrored layer
+
+# Columns of a layer: columns by name (numpy arrays), tables of the strings
+# by name (codes of the column index the table), fields of the layer.
+class mirrored_layer:
+  def __init__( self, info, version, columns, tables ):
+    self.info = info
+    self.version = version
+    self.columns = columns
+    self.tables = tables
+    self.fields = arcgis_hub.fields_by_name( info.get( 'fields', [] ) )
+
+  def __len__( self ):
+    return len(next( iter( self.columns.values() ) )) if self.columns else 0
+
+  # Values of a field (strings decoded) of rows
+  def values( self, name, rows=slice(None) ):
+    if name in self.tables:
+      return numpy.array( self.tables[name]+[None], dtype=object )[self.columns[name][rows]]
+    return self.columns[name][rows]
+
+  # Layer of some rows only
+  def select( self, rows ):
+    return mirrored_layer( self.info, self.version, dict( (n, c[rows]) for n, c in self.columns.items() ), dict( self.tables ) )
+
+  def save( self, directory ):
+    os.makedirs( directory, exist_ok=True )
+    column_store.column_store( directory ).save( self.columns, self.tables,
+                                                 { 'info':self.info, 'version':self.version } )
+
+  # Layer of the store in directory (columns are memory mapped) or None
+  @staticmethod
+  def load( directory ):
+    stored = column_store.column_store( directory ).load()
+    if stored is None:
+      return None
+    columns, tables, meta = stored
+    return mirrored_layer( meta['info'], meta['version'], columns, tables )
+
+  # Mask of the records matching the conditions of a where clause
+  def mask( self, where ):
+    mask = numpy.ones( len(self), dtype=bool )
+    for condition in where_clause.parse_where( where ):
+      field, operator, value, negate = condition
+      if not field in self.columns:
+        raise ValueError( "Invalid field: %s" % field )
+      if field in self.tables:
+        # Test the strings of the table, not each record
+        if operator == 'IS NULL':
+          ok = [ ( v is None ) != negate for v in self.tables[field] ]
+        else:
+          ok = [ v is not None and bool( where_clause.test( condition, v ) ) for v in self.tables[field] ]
+        mask &= numpy.array( ok+[False], dtype=bool )[self.columns[field]]
+      elif operator == 'IS NULL':
+        # Numbers and dates are never null
+        mask &= negate
+      else:
+        mask &= numpy.asarray( where_clause.test( condition, self.columns[field] ), dtype=bool )
+    return mask
+
+  # Statistics grouped by fields of the records of mask, returns columns
+  # by name as (values, table or None) and their fields
+  def __statistics( self, mask, groups, stats ):
+    out = dict()
+    fields = list()
+    if groups:
+      # Numbers of the groups: one index per combination of values
+      keys = list()
+      for g in groups:
+        if not g in self.columns:
+          raise ValueError( "Invalid field: %s" % g )
+        values, index = numpy.unique( self.columns[g][mask], return_inverse=True )
+        keys.append( ( g, values, index.reshape( -1 ) ) )
+      dims = [ max( len(values), 1 ) for g, values, index in keys ]
+      combined = numpy.ravel_multi_index( [ index for g, values, index in keys ], dims ) \
+                   if keys[0][2].size else numpy.zeros( 0, dtype=numpy.int64 )
+      ids, group = numpy.unique( combined, return_inverse=True )
+      group = group.reshape( -1 )
+      for ( g, values, index ), key in zip( keys, numpy.unravel_index( ids, dims ) ):
+        out[g] = ( values[key], self.tables.get( g ) )
+        fields.append( self.fields[g] )
+      count = len(ids)
+    else:
+      group = numpy.zeros( int( mask.sum() ), dtype=numpy.int64 )
+      count = 1
+    for s in stats:
+      stype, field, name = s['statisticType'], s['onStatisticField'], s['outStatisticFieldName']
+      if not field in self.columns:
+        raise ValueError( "Invalid field: %s" % field )
+      values = self.columns[field][mask]
+      n = numpy.bincount( group, minlength=count )
+      if stype == 'count':
+        result = n
+      elif field in self.tables:
+        raise ValueError( "Unsupported statistic on strings: %s" % stype )
+      elif stype in [ 'sum', 'avg' ]:
+        result = numpy.bincount( group, weights=values, minlength=count )
+        if stype == 'avg':
+          result = result / numpy.maximum( n, 1 )
+        elif values.dtype.kind in 'iu':
+          result = numpy.rint( result ).astype( numpy.int64 )
+      elif stype in [ 'min', 'max' ]:
+        result = numpy.zeros( count, dtype=values.dtype )
+        if len(values):
+          order = numpy.argsort( group, kind='stable' )
+          starts = numpy.flatnonzero( numpy.r_[ True, numpy.diff( group[order] ) != 0 ] )
+          reduce = numpy.minimum if stype == 'min' else numpy.maximum
+          result[group[order][starts]] = reduce.reduceat( values[order], starts )
+      else:
+        raise ValueError( "Unsupported statistic: %s" % stype )
+      # No value of a statistic over no records (but count)
+      if stype != 'count' and not groups and not len(values):
+        result = numpy.array( [ None ], dtype=object )
+      out[name] = ( result, None )
+      fields.append( { 'name':name, 'alias':name, 'type':'esriFieldTypeDouble' } )
+    return out, fields
+
+  # Order of rows by "field asc, other desc" (also by any field of the layer
+  # if the mask of the rows is given)
+  def __order( self, out, order, mask=None ):
+    keys = list()
+    for key in reversed( [ k.split() for k in order.split( ',' ) if k.strip() ] ):
+      if key[0] in out:
+        values, table = out[key[0]]
+      elif mask is not None and key[0] in self.columns:
+        # Records may be ordered by fields not in outFields
+        values, table = self.columns[key[0]][mask], self.tables.get( key[0] )
+      else:
+        raise ValueError( "Invalid field: %s" % key[0] )
+      if table is not None:
+        # Rank of the strings of the table
+        ranks = sorted( range( len(table) ), key=lambda n: ( table[n] is not None, table[n] or '' ) )
+        rank = numpy.empty( len(table)+1, dtype=numpy.int64 )
+        rank[ranks] = numpy.arange( len(table) )
+        values = rank[values]
+      if len(key) > 1 and key[1].lower() == 'desc':
+        values = -values.astype( numpy.float64 if values.dtype.kind == 'f' else numpy.int64 )
+      keys.append( values )
+    return numpy.lexsort( keys ) if keys else None
+
+  # Answer a query (parameters of an arcgis_query) like the feature server
+  def query( self, params ):
+    try:
+      mask = self.mask( params.get( 'where', '1=1' ) )
+      if params.get( 'returnCountOnly', 'false' ) == 'true':
+        return { 'count':int( mask.sum() ) }
+      if 'outStatistics' in params:
+        groups = [ g.strip() for g in params.get( 'groupByFieldsForStatistics', '' ).split( ',' ) if g.strip() ]
+        out, fields = self.__statistics( mask, groups, json.loads( params['outStatistics'] ) )
+      else:
+        names = params.get( 'outFields', '*' )
+        names = [ f['name'] for f in self.info.get( 'fields', [] ) if f['name'] in self.columns ] \
+                  if names.strip() == '*' else [ n.strip() for n in names.split( ',' ) ]
+        out = dict()
+        for n in names:
+          if not n in self.columns:
+            raise ValueError( "Invalid field: %s" % n )
+          out[n] = ( self.columns[n][mask], self.tables.get( n ) )
+        fields = [ self.fields[n] for n in names ]
+      rows = self.__order( out, params['orderByFields'], None if 'outStatistics' in params else mask ) \
+               if params.get( 'orderByFields' ) else None
+      if rows is None:
+        rows = numpy.arange( len(out[fields[0]['name']][0]) if fields else 0 )
+      offset = int( params.get( 'resultOffset', 0 ) )
+      rows = rows[offset:offset+int( params['resultRecordCount'] )] \
+               if 'resultRecordCount' in params else rows[offset:]
+    except (ValueError, KeyError, TypeError) as e:
+      return { 'error':{ 'code':400, 'message':str(e), 'details':[ str(e) ] } }
+    # Plain values (int, float, str) as in a decoded reply
+    lists = list()
+    for f in fields:
+      values, table = out[f['name']]
+      if table is not None:
+        lists.append( numpy.array( table+[None], dtype=object )[values[rows]].tolist() )
+      else:
+        lists.append( values[rows].tolist() )
+    names = [ f['name'] for f in fields ]
+    return { 'objectIdFieldName':self.info.get( 'objectIdField' ), 'fields':fields,
+             'features':[ { 'attributes':dict( zip( names, row ) ) } for row in zip( *lists ) ] }
+
+# Rows of two layers in one (the tables of strings are merged)
+def stack( first, second ):
+  columns = dict()
+  tables = dict()
+  for name in first.columns:
+    a, b = first.columns[name], second.columns[name]
+    if name in first.tables:
+      index = dict( (v,n) for n,v in enumerate( first.tables[name] ) )
+      remap = numpy.array( [ index.setdefault( v, len(index) ) for v in second.tables[name] ]+[0], dtype=numpy.int64 )
+      codes = numpy.concatenate( [ a.astype( numpy.int64 ), remap[b] ] )
+      columns[name] = codes.astype( column_store.code_type( index ) )
+      tables[name] = list( index )
+    else:
+      columns[name] = numpy.concatenate( [ a, b ] )
+  return mirrored_layer( first.info, first.version, columns, tables )
+
+###################################################################
+# Mirror of several layers
+
+class layer_mirror:
+  # directory: location of the mirror (default_directory() if None)
+  # layers: URI labels of the layers to mirror (default_layers if None)
+  # refresh: check the version of the layers on the server (once per instance)
+  # jobs: processes decoding pages of downloads (all cores if None)
+  def __init__( self, directory=None, layers=None, refresh=True, jobs=None ):
+    self.directory = directory or default_directory()
+    self.labels = list( layers or default_layers )
+    self.refresh = refresh
+    self.jobs = jobs
+    # Processes decoding pages of downloads (started on the first download)
+    self.decoders = None
+    self.layers = dict()
+    self.checked = set()
+    # Label, mode ('delta' or 'full'), records, records fetched and seconds of each sync
+    self.syncs = list()
+    self.lock = threading.Lock()
+
+  # Stop the processes decoding downloads
+  def close( self ):
+    if self.decoders:
+      self.decoders.shutdown()
+      self.decoders = None
+
+  # Is the layer mirrored
+  def covers( self, base ):
+    return base in self.labels
+
+  def path( self, base ):
+    return os.path.join( self.directory, base.replace( ' ', '_' ) )
+
+  # Download all records of the layer (arcgis is an arcgis_hub)
+  def download( self, arcgis, base ):
+    info = arcgis.get_layer_info( base )
+    version = arcgis.get_version( base )
+    fields = [ f for f in info.get( 'fields', [] ) if f['type'] != 'esriFieldTypeGeometry' ]
+    if self.decoders is None:
+      self.decoders = arcgis_hub.decoder_pool( self.jobs )
+    columns, tables = column_store.concatenate( arcgis.get_column_chunks( base, decoders=self.decoders, jobs=1 ),
+                                                fields )
+    info = { 'objectIdField':info.get( 'objectIdField' ), 'maxRecordCount':info.get( 'maxRecordCount' ),
+             'fields':[ f for f in fields if f['name'] in columns ] }
+    return mirrored_layer( info, version, columns, tables )
+
+  # Records of the layer matching any of the where clauses (as one layer)
+  def __fetch( self, arcgis, base, layer, wheres ):
+    chunks = [ c for where in wheres for c in arcgis.stream_columns( base, where ) ]
+    columns, tables = column_store.concatenate( chunks, layer.info['fields'] )
+    return mirrored_layer( layer.info, layer.version, columns, tables )
+
+  # Records of the layer by ObjectId
+  def __fetch_ids( self, arcgis, base, layer, ids ):
+    oid = layer.info['objectIdField']
+    return self.__fetch( arcgis, base, layer, [ '%s IN(%s)' % ( oid, ','.join( str(i) for i in ids[n:n+ids_per_query] ) )
+                                                for n in range( 0, len(ids), ids_per_query ) ] )
+
+  # Has the layer been republished: records not changed with the publication
+  # before must be the same cases (strings and dates) on the server
+  def __republished( self, arcgis, base, layer, changed ):
+    oid = layer.info['objectIdField']
+    stable = numpy.flatnonzero( ~changed )
+    if not len(stable): return False
+    rows = stable[ numpy.unique( numpy.linspace( 0, len(stable)-1, probe_records ).astype( numpy.int64 ) ) ]
+    probe = self.__fetch_ids( arcgis, base, layer, layer.columns[oid][rows].tolist() )
+    if len(probe) != len(rows):
+      return True
+    order = numpy.argsort( probe.columns[oid] )
+    for f in layer.info['fields']:
+      if f['type'] in [ 'esriFieldTypeString', 'esriFieldTypeDate' ] and f['name'] != 'Datenstand':
+        if not ( layer.values( f['name'], rows ) == probe.values( f['name'], order ) ).all():
+          return True
+    return False
+
+  # Do count and sums of numbers of the layer match those of the server
+  def __verify( self, arcgis, base, layer ):
+    oid = layer.info['objectIdField']
+    names = [ f['name'] for f in layer.info['fields']
+              if f['type'] in [ 'esriFieldTypeOID', 'esriFieldTypeInteger' ] and f['name'] in layer.columns ]
+    query = arcgis_hub.arcgis_query().statistics( 'count', oid, 'records' )
+    for n, name in enumerate( names ):
+      query = query.statistics( 'sum', name, 'sum_%d' % n )
+    server = arcgis.fetch( base, query ).features[0]['attributes']
+    if int( server['records'] ) != len(layer):
+      return False
+    return all( int( server['sum_%d' % n] or 0 ) == int( layer.columns[name].sum() ) for n, name in enumerate( names ) )
+
+  # Apply the changes of the publications since the one of the layer,
+  # returns the updated layer and number of records fetched or None if
+  # the layer has to be downloaded again.
+  def update( self, arcgis, base, layer ):
+    oid = layer.info.get( 'objectIdField' )
+    flags = [ f for f in flag_fields if f in layer.columns ]
+    if not flags or not oid in layer.columns:
+      return None
+    ids = layer.columns[oid]
+    changed = numpy.zeros( len(layer), dtype=bool )
+    for f in flags:
+      changed |= numpy.isin( layer.columns[f], [ -1, 1 ] )
+    if self.__republished( arcgis, base, layer, changed ):
+      return None
+    # Changed with the new publication and new ones
+    wheres = [ '%s IN(-1,1)' % f for f in flags ] + [ '%s>%d' % ( oid, ids.max() if len(ids) else 0 ) ]
+    fetched = self.__fetch( arcgis, base, layer, wheres )
+    fetched = fetched.select( numpy.unique( fetched.columns[oid], return_index=True )[1] )
+    # Changed with the publication before: may be changed again or gone
+    again = ids[ changed & ~numpy.isin( ids, fetched.columns[oid] ) ]
+    if len(again):
+      fetched = stack( fetched, self.__fetch_ids( arcgis, base, layer, again.tolist() ) )
+    n = len(fetched)
+    result = stack( layer.select( ~( numpy.isin( ids, fetched.columns[oid] ) | numpy.isin( ids, again ) ) ), fetched )
+    result = result.select( numpy.argsort( result.columns[oid], kind='stable' ) )
+    # All records are of the new publication
+    result.version = arcgis.get_version( base )
+    if 'Datenstand' in result.tables and isinstance( result.version, str ):
+      result.tables['Datenstand'] = [ result.version ]
+      result.columns['Datenstand'] = numpy.zeros( len(result), dtype=numpy.uint8 )
+    if not self.__verify( arcgis, base, result ):
+      return None
+    return result, n
+
+  # Bring the mirrored layer up to date by applying the changes or by
+  # downloading it (layer is None), the layer is saved
+  def sync( self, arcgis, base, layer=None ):
+    started = time.perf_counter()
+    delta = self.update( arcgis, base, layer ) if layer is not None else None
+    if delta:
+      layer, fetched = delta
+    else:
+      layer = self.download( arcgis, base )
+      fetched = len(layer)
+    layer.save( self.path( base ) )
+    self.syncs.append( { 'label':base, 'mode':'delta' if delta else 'full', 'records':len(layer),
+                         'fetched':fetched, 'seconds':time.perf_counter()-started } )
+    return layer
+
+  # The mirrored layer, loaded from disk, updated if outdated or downloaded if missing
+  def get( self, arcgis, base ):
+    with self.lock:
+      layer = self.layers.get( base )
+      if layer is None:
+        layer = mirrored_layer.load( self.path( base ) )
+      if layer is None:
+        layer = self.sync( arcgis, base )
+      elif self.refresh and not base in self.checked and layer.version != arcgis.get_version( base ):
+        layer = self.sync( arcgis, base, layer )
+      self.checked.add( base )
+      self.layers[base] = layer
+      return layer
+
+  # Evaluate a query (arcgis_hub.arcgis_query) of a mirrored layer, returns arcgis_hub.arcgis_result
+  def execute( self, arcgis, base, query ):
+    reply = self.get( arcgis, base ).query( query.params() )
+    if 'error' in reply:
+      e = reply['error']
+      raise http_session.reply_error( "ERROR: %d %s" % ( e['code'], e['message'] ), base )
+    return arcgis_hub.arcgis_result( reply, arcgis.columnar )
+
+###################################################################
+# Test cases
+
+# Reply of the feature server with some records of rki covid19
+# (Meldedatum 2020-03-01, 2020-03-02 and 2020-03-03)
+fixture_reply = {
+  'objectIdFieldName':'ObjectId',
+  'fields':[ { 'name':'ObjectId', 'alias':'ObjectId', 'type':'esriFieldTypeOID' },
+             { 'name':'IdBundesland', 'alias':'IdBundesland', 'type':'esriFieldTypeInteger' },
+             { 'name':'Landkreis', 'alias':'Landkreis', 'type':'esriFieldTypeString' },
+             { 'name':'Altersgruppe', 'alias':'Altersgruppe', 'type':'esriFieldTypeString' },
+             { 'name':'Meldedatum', 'alias':'Meldedatum', 'type':'esriFieldTypeDate' },
+             { 'name':'AnzahlFall', 'alias':'AnzahlFall', 'type':'esriFieldTypeInteger' },
+             { 'name':'NeuerFall', 'alias':'NeuerFall', 'type':'esriFieldTypeInteger' } ],
+  'features':[ { 'attributes':dict( zip( [ 'ObjectId', 'IdBundesland', 'Landkreis', 'Altersgruppe',
+                                           'Meldedatum', 'AnzahlFall', 'NeuerFall' ], r ) ) } for r in [
+    [ 1, 9, 'SK München', 'A35-A59', 1583020800000, 3, 0 ],
+    [ 2, 9, 'SK München', 'A15-A34', 1583107200000, 2, 1 ],
+    [ 3, 9, 'LK Ebersberg', None, 1583107200000, 1, -1 ],
+    [ 4, 1, 'SK Kiel', 'A35-A59', 1583193600000, 5, 0 ],
+    [ 5, 1, 'SK Kiel', 'A80+', 1583020800000, 4, 1 ],
+    [ 6, 9, 'SK München', 'A15-A34', 1583193600000, 1, 0 ] ] ] }
+
+# Queries of the fixture and the expected attributes of the features of the
+# reply (count of returnCountOnly, None for an error reply), written by hand
+# following the query operation of the feature server
+def fixture_queries():
+  q = arcgis_hub.arcgis_query()
+  return [
+    ( q.where( 'NeuerFall IN(0,1)' ).statistics( 'sum', 'AnzahlFall' ), [ { 'value':15 } ] ),
+    ( q.where( 'NeuerFall IN(0, 1)' ).group_by( 'Meldedatum' ).order_by( 'Meldedatum asc' ).statistics( 'sum', 'AnzahlFall' ),
+      [ { 'Meldedatum':1583020800000, 'value':7 }, { 'Meldedatum':1583107200000, 'value':2 },
+        { 'Meldedatum':1583193600000, 'value':6 } ] ),
+    ( q.where( "Landkreis = 'SK München' AND Meldedatum >= timestamp '2020-03-02 00:00:00'" )
+       .out_fields( 'ObjectId' ).order_by( 'ObjectId asc' ), [ { 'ObjectId':2 }, { 'ObjectId':6 } ] ),
+    ( q.where( "Meldedatum BETWEEN date '2020-03-02' AND date '2020-03-03'" ).count_only(), 4 ),
+    ( q.where( 'Altersgruppe IS NULL' ).count_only(), 1 ),
+    ( q.where( 'Altersgruppe IS NOT NULL' ).count_only(), 5 ),
+    ( q.where( "Altersgruppe > 'A15-A34'" ).count_only(), 3 ),
+    ( q.where( 'AnzahlFall NOT BETWEEN 2 AND 4 AND IdBundesland <> 1' ).count_only(), 2 ),
+    ( q.where( "Landkreis NOT IN('SK Kiel', 'LK Ebersberg')" ).count_only(), 3 ),
+    ( q.out_fields( 'ObjectId' ).order_by( 'Meldedatum desc', 'ObjectId asc' ).page( 1, 3 ),
+      [ { 'ObjectId':6 }, { 'ObjectId':2 }, { 'ObjectId':3 } ] ),
+    # Order by a field not in outFields
+    ( q.out_fields( 'Landkreis' ).order_by( 'AnzahlFall desc', 'ObjectId asc' ),
+      [ { 'Landkreis':l } for l in [ 'SK Kiel', 'SK Kiel', 'SK München', 'SK München', 'LK Ebersberg', 'SK München' ] ] ),
+    ( q.group_by( 'IdBundesland' ).order_by( 'IdBundesland asc' ).statistics( 'count', 'ObjectId', 'count' )
+       .statistics( 'max', 'AnzahlFall', 'max' ).statistics( 'avg', 'AnzahlFall', 'avg' ),
+      [ { 'IdBundesland':1, 'count':2, 'max':5, 'avg':4.5 }, { 'IdBundesland':9, 'count':4, 'max':3, 'avg':1.75 } ] ),
+    ( q.where( 'ObjectId=3' ).out_fields( 'Landkreis,Altersgruppe,Meldedatum' ),
+      [ { 'Landkreis':'LK Ebersberg', 'Altersgruppe':None, 'Meldedatum':1583107200000 } ] ),
+    # Quoted literals are not split
+    ( q.where( "Landkreis IN('SK Kiel, LK Ebersberg')" ).count_only(), 0 ),
+    ( q.where( "Landkreis IN('SK Kiel', 'It''s, (a) AND b')" ).count_only(), 2 ),
+    ( q.where( "Landkreis <> 'SK München AND IdBundesland = 1' AND Altersgruppe = 'A80+'" ).count_only(), 1 ),
+    ( q.where( 'Unknown=1' ), None ),
+    ( q.where( 'AnzahlFall LIKE 1' ), None ) ]
+
+# Compare the replies of the mirror with the expected ones, returns the
+# number of failed queries
+def check():
+  columns, tables = column_store.from_reply( fixture_reply )
+  layer = mirrored_layer( { 'objectIdField':'ObjectId', 'maxRecordCount':1000, 'fields':fixture_reply['fields'] },
+                          None, columns, tables )
+  failed = 0
+  for query, expected in fixture_queries():
+    reply = layer.query( query.params() )
+    if expected is None:
+      got = None if 'error' in reply else reply
+    elif isinstance( expected, int ):
+      got = reply.get( 'count' )
+    else:
+      got = [ f['attributes'] for f in reply.get( 'features', [] ) ]
+    if got != expected:
+      print( "Failed %s:\n  expected %s\n  got      %s" % ( query, expected, got ) )
+      failed += 1
+  return failed
+
+def main():
+  failed = check()
+  print( "%d of %d queries failed" % ( failed, len(fixture_queries()) ) )
+  sys.exit( 1 if failed else 0 )
+
+if __name__ == '__main__':
+  main()
+
+#EOF
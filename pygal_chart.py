@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Chart of infections per day (pygal) of a series of totals, used by
+# sars_2_plot and batch_charts. pygal is imported when a chart is made.
+#
+
+import datetime
+import numpy
+# Rolling statistics of time series
+import rolling
+# Downsampling of series before plotting
+import decimation
+
+# Chart of infections per day derived from the totals of each day (counts)
+def pygal_chart( result, title, points=None, method='lttb', labels=None ):
+  # Plot
+  import pygal
+  # Lists as well as numpy arrays (e.g. columnar results) are accepted
+  dates = numpy.asarray( result['dates'] ).astype( 'datetime64[D]' ).astype( datetime.date )
+  y1 = numpy.asarray( result['counts'] )
+  y2 = rolling.diff( y1 )        # infections per day
+  y3 = rolling.week_change( y2 ) # change of infections per day within one week
+  y4 = rolling.mean( y2, 7 )     # 7 day mean of infections per day
+  y5 = rolling.mean( y3, 7 )     # 7 day mean of change
+  one_day = datetime.timedelta(days=1)  # Show day of cases occurring not of report
+
+  # Same points of all series (and labels)
+  keep = decimation.indices( [ y2, y3, y4, y5 ], points, method )
+
+  chart = pygal.Line()
+  chart.title = title
+  chart.x_labels = [(i-one_day).strftime("%a, %d %b") for i in dates[keep] ]
+  if labels and len(keep) > labels:
+    chart.x_labels_major_every = -(-len(keep) // labels)
+    chart.show_minor_x_labels = False
+  chart.add( '1. Δ inf./day',   y2[keep].tolist() )
+  chart.add( '2. 7 day Ø of 1', y4[keep].tolist() )
+  chart.add( '3. week Δ of 1',  y3[keep].tolist() )
+  chart.add( '4. 7 day Ø of 3', y5[keep].tolist() )
+  return chart
+
+#EOF
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Persistent cache of decoded replies (e.g. of ArcGIS feature servers).
+#
+# Each entry is one JSON file keyed by the canonical (uri, query), the full
+# URI so replies of other servers (e.g. a local stand-in) are never mixed.
+# An entry is valid as long as it is younger than the TTL and the version
+# of the data (e.g. 'Datenstand' of the layer) did not change. The total
+# size of the cache is bounded, least recently used entries are evicted
+# (down to 3/4 of the bound once it is exceeded). Replies larger than
+# max_entry are not kept (e.g. pages of complete downloads).
+#
+
+import os,json,time
+import hashlib
+import threading
+
+# Default location of the cache, base URIs of servers used instead of the
+# real ones (e.g. a local stand-in, None if not) get a location of their own
+def default_directory( servers=() ):
+  directory = os.path.join( os.path.expanduser( '~' ), '.cache', 'sars_2_plot' )
+  servers = [ s for s in servers if s ]
+  if servers:
+    name = hashlib.sha1( ' '.join( servers ).encode( 'utf-8' ) ).hexdigest()[:16]
+    directory = os.path.join( directory, 'servers', name )
+  return directory
+
+class reply_cache:
+  def __init__( self, directory=None, ttl=24*3600, max_bytes=64*1024*1024, max_entry=1024*1024 ):
+    if not directory: directory = default_directory()
+    self.directory = directory
+    self.ttl = ttl              # Time to live in seconds
+    self.max_bytes = max_bytes  # Upper bound of size of all entries
+    self.max_entry = max_entry  # Upper bound of size of one entry
+    self.total = None           # Size of all entries (None until known)
+    self.lock = threading.Lock()
+    os.makedirs( self.directory, exist_ok=True )
+
+  # Canonical key of a request
+  def key( self, uri, query ):
+    canonical = json.dumps( [uri, query], sort_keys=True, separators=(',', ':'), default=str )
+    return hashlib.sha1( canonical.encode( 'utf-8' ) ).hexdigest()
+
+  def __filename( self, key ):
+    return os.path.join( self.directory, key+'.json' )
+
+  # Get a valid reply or None
+  def get( self, uri, query, version=None ):
+    filename = self.__filename( self.key( uri, query ) )
+    try:
+      with open( filename, 'rb' ) as f:
+        entry = json.load( f )
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+    if (time.time() - entry['time']) > self.ttl or entry['version'] != version:
+      self.__remove( filename )
+      return None
+    # Mark as recently used
+    try:
+      os.utime( filename )
+    except FileNotFoundError:
+      pass
+    return entry['reply']
+
+  # Store a reply
+  def put( self, uri, query, reply, version=None ):
+    filename = self.__filename( self.key( uri, query ) )
+    entry = { 'time':time.time(), 'version':version, 'uri':uri, 'reply':reply }
+    data = json.dumps( entry, separators=(',', ':') ).encode( 'utf-8' )
+    if len(data) > self.max_entry:
+      return
+    # Write and rename to never expose partial entries
+    temp = '%s.%d.%d' % ( filename, os.getpid(), threading.get_ident() )
+    with open( temp, 'wb' ) as f:
+      f.write( data )
+    os.replace( temp, filename )
+    # Evict only when the bound is exceeded (replaced entries are counted twice)
+    with self.lock:
+      if self.total is not None:
+        self.total += len(data)
+      if self.total is not None and self.total <= self.max_bytes:
+        return
+    self.evict()
+
+  # Remove least recently used entries until size is within 3/4 of the bound
+  def evict( self ):
+    with self.lock:
+      entries = list()
+      total = 0
+      for filename in self.__entries():
+        try:
+          st = os.stat( filename )
+        except FileNotFoundError:
+          continue
+        entries.append( (st.st_mtime, st.st_size, filename) )
+        total += st.st_size
+      entries.sort()
+      if total > self.max_bytes:
+        while entries and total > self.max_bytes*3 // 4:
+          mtime, size, filename = entries.pop(0)
+          self.__remove( filename )
+          total -= size
+      self.total = total
+
+  def __entries( self ):
+    return [ os.path.join( self.directory, n ) for n in os.listdir( self.directory ) if n.endswith( '.json' ) ]
+
+  def __remove( self, filename ):
+    try:
+      os.remove( filename )
+    except FileNotFoundError:
+      pass
+
+#EOF
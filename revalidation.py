@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Conditional HTTP requests (ETag / If-Modified-Since).
+#
+# Validators of the last reply and the result of parsing it are kept per URI
+# (optionally in a JSON file). The next request sends If-None-Match and
+# If-Modified-Since, on "304 Not Modified" the kept result is used again.
+#
+
+import os,json
+import threading
+
+class revalidation:
+  # metrics: optional fetch_metrics to record every request
+  def __init__( self, http, filename=None, metrics=None ):
+    self.http = http
+    self.filename = filename
+    self.metrics = metrics
+    self.lock = threading.Lock()
+    self.entries = dict()
+    if filename:
+      try:
+        with open( filename, 'r', encoding='utf-8' ) as f:
+          self.entries = json.load( f )
+      except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+  # Headers to revalidate the kept result of an URI
+  def headers( self, uri ):
+    headers = dict()
+    entry = self.entries.get( uri )
+    if entry:
+      if entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+      if entry['last-modified']:
+        headers['If-Modified-Since'] = entry['last-modified']
+    return headers
+
+  # Kept result of an URI (None if unknown)
+  def result( self, uri ):
+    entry = self.entries.get( uri )
+    return entry['result'] if entry else None
+
+  # Keep validators of the reply and the result of parsing it
+  def store( self, uri, reply, result ):
+    with self.lock:
+      self.entries[uri] = { 'etag':reply.headers.get( 'etag' ),
+                            'last-modified':reply.headers.get( 'last-modified' ),
+                            'result':result }
+      if self.filename:
+        temp = '%s.%d' % ( self.filename, os.getpid() )
+        with open( temp, 'w', encoding='utf-8' ) as f:
+          json.dump( self.entries, f, indent=1 )
+        os.replace( temp, self.filename )
+
+  # GET the URI and return parse(reply) or the kept result if not modified.
+  # The result of parse must be JSON serializable.
+  def get( self, uri, parse ):
+    event = self.metrics.start( uri ) if self.metrics else None
+    headers = self.headers( uri )
+    reply = self.http.request( 'GET', uri, headers=headers, preload_content=False )
+    if event: event['ttfb'] = self.metrics.elapsed( event )
+    if reply.status == 304 and uri in self.entries:
+      reply.drain_conn()
+      reply.release_conn()
+      if event:
+        event['cache'] = 'hit'
+        event['total'] = self.metrics.elapsed( event )
+        self.metrics.record( event )
+      return self.entries[uri]['result']
+    reply, data = self.http.read( reply, uri, headers )
+    if event:
+      event['bytes'] = len(data)
+      start = self.metrics.elapsed( event )
+    result = parse( reply )
+    if event:
+      event['parse'] = self.metrics.elapsed( event )-start
+      event['cache'] = 'miss'
+      event['total'] = self.metrics.elapsed( event )
+      self.metrics.record( event )
+    self.store( uri, reply, result )
+    return result
+
+#EOF
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Rolling statistics of time series using numpy.
+#
+# Series are 1-D arrays (one value per day) or 2-D matrices with one series
+# per row (e.g. districts x days). All functions work along the last axis.
+# Windows are computed from cumulative sums, so cost does not depend on the
+# window width.
+#
+
+import sys
+import numpy
+
+# Sum of the step preceding elements (including the element itself).
+# The first elements sum what is available.
+def window_sum( series, step ):
+  a = numpy.asarray( series )
+  dtype = numpy.int64 if numpy.issubdtype( a.dtype, numpy.integer ) else numpy.float64
+  sums = numpy.cumsum( a, axis=-1, dtype=dtype )
+  sums[..., step:] = sums[..., step:] - sums[..., :-step].copy()
+  return sums
+
+# Difference to preceding element (step elements before).
+# Same edges as legacy_diff (see check): the first step elements are 0,
+# element step is kept as is.
+def diff( series, step=1 ):
+  a = numpy.asarray( series )
+  out = a.copy()
+  out[..., step+1:] = a[..., step+1:] - a[..., 1:-step]
+  out[..., :step] = 0
+  return out
+
+# Mean of preceding elements rounded to integers.
+# Same edges as legacy_mean (see check): the first step+1 elements are kept as is.
+def mean( series, step=2 ):
+  a = numpy.asarray( series )
+  out = a.copy()
+  means = numpy.rint( window_sum( a, step ) / step )
+  out[..., step+1:] = means[..., step+1:]
+  return out
+
+# Change of values per day compared to the same day of the week before
+def week_change( per_day ):
+  return diff( per_day, 7 )
+
+# Sum of the last days per 100000 inhabitants (7 day incidence).
+# population is a scalar or one value per series (row), nan where the
+# population is unknown (not above 0).
+def incidence( per_day, population, days=7 ):
+  population = numpy.asarray( population, dtype=numpy.float64 )
+  population = numpy.where( population > 0, population, numpy.nan )
+  if population.ndim:
+    population = population.reshape( population.shape+(1,) )
+  return window_sum( per_day, days ) * 100000.0 / population
+
+###################################################################
+# Test cases
+
+# The list based functions these replace (kept to compare the edges)
+def legacy_diff( lin, step=1 ):
+  lout = list( lin )
+  n = len(lout)-1
+  while n > step:
+    lout[n] = lout[n]-lout[n-step]
+    n=n-1
+  for n in range(step):
+    lout[n] = 0
+  return lout
+
+def legacy_mean( lin, step=2 ):
+  lout = list( lin )
+  n = len(lout)-1
+  while n > step:
+    mean = 0
+    for m in range(step):
+      mean = mean + lin[n-m]
+    lout[n] = round(mean/step)
+    n=n-1
+  return lout
+
+# Calls and the expected results, written by hand
+def fixture_cases():
+  total = [ 1, 3, 6, 10, 15, 21, 28, 36, 45, 55 ]
+  per_day = [ 0, 3, 3, 4, 5, 6, 7, 8, 9, 10 ]
+  nan = numpy.nan
+  return [
+    ( 'window_sum', lambda: window_sum( [ 1, 2, 3, 4, 5 ], 3 ), [ 1, 3, 6, 9, 12 ] ),
+    # First element 0, second kept as is
+    ( 'diff', lambda: diff( total ), per_day ),
+    ( 'diff step 7', lambda: diff( total, 7 ), [ 0, 0, 0, 0, 0, 0, 0, 36, 42, 49 ] ),
+    ( 'diff short', lambda: diff( [ 5, 7 ], 7 ), [ 0, 0 ] ),
+    ( 'diff rows', lambda: diff( [ total, total[::-1] ] ),
+      [ per_day, [ 0, 45, -9, -8, -7, -6, -5, -4, -3, -2 ] ] ),
+    ( 'week_change', lambda: week_change( per_day ), [ 0, 0, 0, 0, 0, 0, 0, 8, 6, 7 ] ),
+    # First three kept as is, halves rounded to even
+    ( 'mean', lambda: mean( per_day ), [ 0, 3, 3, 4, 4, 6, 6, 8, 8, 10 ] ),
+    ( 'mean step 3', lambda: mean( per_day, 3 ), [ 0, 3, 3, 4, 4, 5, 6, 7, 8, 9 ] ),
+    ( 'incidence', lambda: incidence( [ [ 10, 20, 30 ], [ 5, 5, 5 ] ], [ 200000, 0 ], 2 ),
+      [ [ 5.0, 15.0, 25.0 ], [ nan, nan, nan ] ] ),
+    ( 'incidence scalar', lambda: incidence( [ 10, 20, 30 ], 50000, 7 ), [ 20.0, 60.0, 120.0 ] ) ]
+
+# Compare the results with the expected ones and the edges of diff and mean
+# with those of the list based functions, returns the number of failed cases
+def check():
+  failed = 0
+  for name, call, expected in fixture_cases():
+    got = call()
+    if not numpy.array_equal( got, numpy.asarray( expected, dtype=numpy.float64 ), equal_nan=True ):
+      print( "Failed %s:\n  expected %s\n  got      %s" % ( name, expected, got.tolist() ) )
+      failed += 1
+  # All lengths (not shorter than step, legacy_diff fails on these) and steps
+  series = numpy.random.default_rng( 1 ).integers( -50, 1000, 12 ).tolist()
+  wrong = [ ( series[:n], step ) for step in range( 1, 9 ) for n in range( step, len(series)+1 )
+            if diff( series[:n], step ).tolist() != legacy_diff( series[:n], step ) or
+               mean( series[:n], step ).tolist() != legacy_mean( series[:n], step ) ]
+  if wrong:
+    print( "Failed legacy edges of %d series, e.g. %s step %d" % ( len(wrong), wrong[0][0], wrong[0][1] ) )
+    failed += 1
+  return failed
+
+def main():
+  failed = check()
+  print( "%d of %d cases failed" % ( failed, len(fixture_cases())+1 ) )
+  sys.exit( 1 if failed else 0 )
+
+if __name__ == '__main__':
+  main()
+
+#EOF
@@ -9,17 +9,10 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
-# SW requirements:
-#   Data structures for "relational" or "labeled" data
-#     apt-get install python3-pandas python3-pandas-lib
-#   Extract data from Microsoft Excel spreadsheet files
-#     apt-get install python3-xlrd
-#   HTTP library with thread-safe connection pooling for Python3
-#     apt-get install python3-urllib3
-#   Error-tolerant HTML parser for Python 3
-#     apt-get install python3-bs4
-#   RFC 3986 compliant replacement for urlparse (Python 3)
-#     apt-get install python3-uritools
+# SW requirements (see README.md):
+#   Python 3.9 or newer
+#   pip install numpy pandas openpyxl "urllib3>=2" beautifulsoup4 lxml uritools
+#   pip install python-dateutil pytz pygal
 #
 # Get new infections and victims per day in Germany:
 #   https://www.rki.de/DE/Content/InfAZ/N/Neuartiges_Coronavirus/Daten/Fallzahlen_Kum_Tab.xlsx
@@ -46,49 +39,148 @@
 #   * Plotly https://plotly.com/python/ apt-get install python3-plotly
 #
 
-import sys,os,re,math,copy
+import sys,os,re
+import hashlib
+import zipfile
+import email.utils
 import argparse
-import pandas
+import asyncio
+# Heavy modules (pandas, bs4 and the plotting backends) are imported lazily
+# by the functions that need them, so e.g. --help starts quickly.
 # https://docs.python.org/3/library/datetime.html#datetime.datetime
 import datetime
 import dateutil.parser
 import pytz
 # https://urllib3.readthedocs.io/en/latest/
 import urllib3
-# https://www.crummy.com/software/BeautifulSoup/bs4/doc/
-from bs4 import BeautifulSoup
 # https://pypi.org/project/uritools/
 import uritools
-# https://docs.python.org/3/library/shutil.html
-import shutil
 # https://numpy.org/ https://www.python-kurs.eu/numpy.php
 import numpy
-# https://matplotlib.org/api/pyplot_api.html
-import matplotlib.pyplot, mplexporter
-# Plot
-import pygal
-#import plotly.express
 #import holoviews
 # Own little helpers (optional)
 #import helper
+# Rolling statistics of time series
+import rolling
 # Read data from ArcGIS feature servers
 import arcgis_hub
+# Keep replies of feature servers on disk
+import reply_cache
+# Local mirror of layers of feature servers
+import layer_mirror
+# Conditional requests of RKI pages and files
+import revalidation
+# Shared HTTP connections with retries
+import http_session
+# Persisted time series
+import series_store
+# Timings of fetches
+import fetch_metrics
+# Time series of all districts
+import district_series
+# Downsampling of series before plotting
+import decimation
+# Chart of infections per day (pygal)
+import pygal_chart
 
-# RKI data is handcrafted and thus sometimes inconsistent
-# => do check and correct if possible
-def check_date( date, last=None ):
+# Version of the snapshots of parsed spreadsheets, to be incremented with any
+# change of parsing (e.g. of parse_rki_xls or in_file_time), snapshots of
+# other versions are parsed again
+snapshot_version = 2
+
+# Spreadsheet with inconsistent rows (problems: one message per row)
+class inconsistency_error( Exception ):
+  def __init__( self, filename, problems ):
+    Exception.__init__( self, "%d inconsistencies in %s" % ( len(problems), filename ) )
+    self.filename = filename
+    self.problems = problems
+
+# Convert a column of the spreadsheet to integers, rows that are no integers are reported
+def integer_column( column, name, problems, nan=None ):
+  import pandas
+  values = pandas.to_numeric( column, errors='coerce' ).to_numpy( dtype=numpy.float64, copy=True )
+  if nan is not None:
+    values[ column.isna().to_numpy() ] = nan
+  bad = numpy.isnan( values ) | ( values != numpy.floor( values ) )
+  for n in numpy.flatnonzero( bad ):
+    problems.append( "Row %d: %s is not an integer: %r" % ( column.index[n], name, column.iloc[n] ) )
+  values[bad] = 0
+  return values.astype( numpy.int64 )
+
+# Parse and check the table of the "-gesamt" sheet (first row is the header) at once.
+# Returns arrays of dates, counts and deaths and a list of problems found.
+def parse_gesamt( dataframe ):
+  import pandas
+  problems = []
+  frame = dataframe.iloc[1:]
   # Some fields are of type string and some are datetime
-  if isinstance( date, str ):
-    # Some date strings do contain ',' instead of '.'
-    date = date.replace( ',', '.' )
-    date = datetime.datetime.strptime( date+" 00:00:00", '%d.%m.%Y %H:%M:%S')
+  raw = frame.iloc[:,0]
+  is_str = raw.map( lambda v: isinstance( v, str ) ).to_numpy( dtype=bool )
+  dates = pandas.Series( pandas.NaT, index=raw.index, dtype='datetime64[ns]' )
+  # Some date strings do contain ',' instead of '.'
+  dates[is_str] = pandas.to_datetime( raw[is_str].str.replace( ',', '.' ), format='%d.%m.%Y', errors='coerce' )
+  dates[~is_str] = pandas.to_datetime( raw[~is_str], errors='coerce' )
+  dates = dates.to_numpy( dtype='datetime64[ns]' )
+  for n in numpy.flatnonzero( numpy.isnat( dates ) ):
+    problems.append( "Row %d: no date: %r" % ( raw.index[n], raw.iloc[n] ) )
+  days = dates.astype( 'datetime64[D]' )
   # Now all shall be unique and isochron
-  assert isinstance( date, datetime.datetime )
-  assert date.time() == datetime.time(0,0,0)
-  date = date.date()
-  if last:
-    assert (date-last) == datetime.timedelta(days=1)
-  return date
+  for n in numpy.flatnonzero( ~numpy.isnat( dates ) & ( dates != days ) ):
+    problems.append( "Row %d: date is not at midnight: %s" % ( raw.index[n], dates[n] ) )
+  valid = ~numpy.isnat( days )
+  for n in numpy.flatnonzero( ( numpy.diff( days ) != numpy.timedelta64( 1, 'D' ) ) & valid[1:] & valid[:-1] ):
+    problems.append( "Row %d: %s does not follow %s" % ( raw.index[n+1], days[n+1], days[n] ) )
+  counts = integer_column( frame.iloc[:,1], "count", problems )
+  deaths = integer_column( frame.iloc[:,4], "deaths", problems, nan=0 )
+  # Check diff for consistency
+  if len(frame) > 1:
+    diffs = integer_column( frame.iloc[1:,3], "difference", problems )
+    for n in numpy.flatnonzero( counts[1:] != counts[:-1] + diffs ):
+      problems.append( "Row %d: count %d != %d + %d" % ( frame.index[n+1], counts[n+1], counts[n], diffs[n] ) )
+  return days, counts, deaths, problems
+
+# Get date and row of totals of the first table with "Stand:" of the Fallzahlen page
+def parse_latest_table( html ):
+  # https://www.crummy.com/software/BeautifulSoup/bs4/doc/
+  from bs4 import BeautifulSoup, SoupStrainer
+  # Build the tree of the main text only
+  parsed_html = BeautifulSoup( html, "lxml", from_encoding="UTF-8",
+                               parse_only=SoupStrainer( 'div', id='main' ) )
+  # Inside the main text
+  div = parsed_html.find( 'div', id='main' )
+  assert div != None
+  # There are paragraphs with dates
+  pat = re.compile( '^Stand: *([0-9]+\.[0-9]+\.[0-9]+).*' )
+  for p in div.find_all( 'p' ):
+    m = pat.search( p.text )
+    if m: break
+  # Under the first date there is a table
+  s = p.next_sibling
+  while s:
+    if s.name == 'table': break
+    s = s.next_sibling
+  assert s != None
+  # Body of that table
+  tbody = s.find( 'tbody' )
+  # Last row is total counts
+  for tr in tbody.children: pass
+  tds = tr.find_all( 'td' )
+  # Check that this is the row with the "totals"
+  assert tds[0].text == 'Gesamt'
+  return { 'date':m.group(1), 'row':[t.text for t in tds] }
+
+# Get the (relative) link to the spreadsheet file
+def parse_internal_link( html ):
+  from bs4 import BeautifulSoup, SoupStrainer
+  # Parse using the lxml parser, build the tree of internal links only
+  internal = SoupStrainer( 'a', attrs={'class':'more downloadLink InternalLink'} )
+  parsed_html = BeautifulSoup( html, "lxml", from_encoding="UTF-8", parse_only=internal )
+  # Get internal links of this side
+  links = parsed_html.find_all( 'a', attrs={'class':'more downloadLink InternalLink'} )
+  assert len(links) == 1
+  link = links[0]
+  assert link.has_attr( 'href' )
+  return link['href']
 
 def element_that_fit( ilist, regstr ):
   olist=[]
@@ -101,73 +193,56 @@ def element_that_fit( ilist, regstr ):
   assert len(olist) == 1
   return olist[0]
 
-# Difference to preceding element
-def diff_list( lin, step=1 ):
-  lout = copy.deepcopy( lin )
-  n = len(lout)-1
-  while n > step:
-    lout[n] = lout[n]-lout[n-step]
-    n=n-1
-  for n in range(step):
-    lout[n] = 0
-  return lout
-
-# Mean of preceding elements
-def mean_list( lin, step=2 ):
-  lout = copy.deepcopy( lin )
-  n = len(lout)-1
-  while n > step:
-    mean = 0
-    for m in range(step):
-      mean = mean + lin[n-m]
-    lout[n] = round(mean/step)
-    n=n-1
-  return lout
-
 class classCovid:
-  def __init__( self, verb ):
+  # Like an ordinary windows IE user
+  user_agent = {'user-agent': 'IE 9/Windows: Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; WOW64; Trident/5.0)'}
+
+  # session: http_session to share connections with others (own one if None)
+  def __init__( self, verb, session=None ):
     self.verb = verb
-    # Like an ordinary windows IE user
-    self.user_agent = {'user-agent': 'IE 9/Windows: Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; WOW64; Trident/5.0)'}
-    self.http = urllib3.PoolManager( 10, headers=self.user_agent )
+    # Some connections per host as the sources may be fetched concurrently
+    self.http = session or http_session.http_session( maxsize=4, headers=self.user_agent )
+    # Optional metrics of all fetches (fetch_metrics)
+    self.metrics = None
+    # Validators and parsed results of last replies (in memory only by default)
+    self.revalidation = revalidation.revalidation( self.http )
     self.utc = pytz.UTC
     self.xls = None
+    # Directory of the downloaded spreadsheet (the current one by default)
+    self.directory = ''
+    self.filename = None
+    # Parsed series of the spreadsheet (if snapshot is up to date)
+    self.snapshot = None
+    # Keep the parsed series as snapshot next to the spreadsheet
+    self.snapshots = True
+    # Optional store of the series and source of each day
+    self.store = None
+    self.dates = []
+    self.counts = []
+    self.deaths = []
+    self.sources = []
+    # Optional cache of replies of feature servers
+    self.cache = None
+    # Optional local mirror of layers of feature servers
+    self.mirror = None
+    # Optional base URI of feature servers to use instead of ArcGIS (e.g. a local stand-in)
+    self.arcgis_server = None
+    # Reader of feature servers (created once, shares the session)
+    self.arcgis = None
 
-  # Sometimes RKI is lazy in updating XLS so let's check text table
-  def get_latest_entry( self, uri ):
+  # Sometimes RKI is lazy in updating XLS so let's check text table.
+  # Get date and totals of the text table (no change of the series)
+  def fetch_latest_entry( self, uri ):
     try:
-      request = self.http.urlopen('GET', uri )
-    except urllib3.exceptions.SSLError as e:
-      print( "TSL error", e.reason, uri )
-      sys.exit(-1)
+      return self.revalidation.get( uri, lambda reply: parse_latest_table( reply.data ) )
     except urllib3.exceptions.HTTPError as e:
-      print( e.reason, uri )
-      sys.exit(-1)
-    html =  request.data
-    parsed_html = BeautifulSoup( html, "lxml", from_encoding="UTF-8" )
-    # Inside the main text
-    div = parsed_html.find( 'div', id='main' )
-    # There are paragraphs with dates
-    pat = re.compile( '^Stand: *([0-9]+\.[0-9]+\.[0-9]+).*' )
-    for p in div.find_all( 'p' ):
-      m = pat.search( p.text )
-      if m: break
-    # Under the first date there is a table
-    s = p.next_sibling
-    while s:
-      if s.name == 'table': break
-      s = s.next_sibling
-    assert s != None
-    # Body of that table
-    tbody = s.find( 'tbody' )
-    # Last row is total counts
-    for tr in tbody.children: pass
-    tds = tr.find_all( 'td' )
-    # Check that this is the row with the "totals"
-    assert tds[0].text == 'Gesamt'
-    row = [t.text for t in tds]
+      raise http_session.connection_error( str( e ), uri ) from e
+
+  # Append the totals of the text table if these are of the next day
+  def apply_latest_entry( self, latest ):
+    row = latest['row']
     # Convert the date
-    date = dateutil.parser.parse( m.group(1) )
+    date = dateutil.parser.parse( latest['date'], dayfirst=True )
     assert date.time() == datetime.time(0,0,0)
     date = date.date()
     # Check if we can append this latest data
@@ -180,21 +255,35 @@ class classCovid:
       death = int(row[5].replace('.',''))
       assert death > self.deaths[-1]
       self.deaths.append( death )
+      self.sources.append( 'html' )
       if self.verb: print( self.dates[-1], self.counts[-1], self.counts[-1]-self.counts[-2], 
                  '(', self.deaths[-1], ',', self.deaths[-1]-self.deaths[-2], ')' )
 
-  # Sometimes RKI is lazy in updating XLS so let's check arcgis feature server
-  def get_latest_arcgis( self ):
-    arc = arcgis_hub.arcgis_hub()
-    # Do some consistecy checks
-    arc.check()
+  # Sometimes RKI is lazy in updating XLS so let's check arcgis feature server.
+  # Get totals and deltas of the feature servers (no change of the series)
+  def fetch_latest_arcgis( self ):
+    if not self.arcgis:
+      self.arcgis = arcgis_hub.arcgis_hub( self.cache, server=self.arcgis_server, metrics=self.metrics, mirror=self.mirror,
+                                           session=self.http )
+    arc = self.arcgis
+    # Do some consistecy checks (and keep the totals)
+    totals = arc.check()
+    # Deltas within 24h in one query
+    deltas = arc.get_statistics( 'rki covid19',
+        { 'count_delta':( 'sum', 'AnzahlFall', 'NeuerFall IN(1,-1)' ),
+          'death_delta':( 'sum', 'AnzahlTodesfall', 'NeuerTodesfall IN(1,-1)' ) } )
+    return { 'counts':totals['cases_01'], 'count_delta':deltas['count_delta'],
+             'deaths':totals['deaths_01'], 'death_delta':deltas['death_delta'] }
+
+  # Append the counts of the feature servers if these are new
+  def apply_latest_arcgis( self, values ):
     # Total infected germans until "now"
-    arc_counts2 = arc.get_current_total_cases_01()
-    arc_count_delta = arc.get_current_new_cases()
+    arc_counts2 = values['counts']
+    arc_count_delta = values['count_delta']
     arc_counts1 = arc_counts2 - arc_count_delta
     # Total german victims until "now"
-    arc_deaths2 = arc.get_current_total_deaths_01()
-    arc_death_delta = arc.get_current_new_deaths()
+    arc_deaths2 = values['deaths']
+    arc_death_delta = values['death_delta']
     arc_deaths1 = arc_deaths2 - arc_death_delta
     # Check if these are new counts
     if (self.counts[-1] < arc_counts2) or (self.deaths[-1] < arc_deaths2):
@@ -202,12 +291,14 @@ class classCovid:
         self.dates.append( self.dates[-1]+datetime.timedelta(days=1) )
         self.counts.append( arc_counts1 )
         self.deaths.append( arc_deaths1 )
+        self.sources.append( 'arcgis' )
         if self.verb:
           print( "Added:\n", self.dates[-1], self.counts[-1], self.counts[-1]-self.counts[-2], 
                  '(', self.deaths[-1], ',', self.deaths[-1]-self.deaths[-2], ')' )
       self.dates.append( self.dates[-1]+datetime.timedelta(days=1) )
       self.counts.append( arc_counts2 )
       self.deaths.append( arc_deaths2 )
+      self.sources.append( 'arcgis' )
       if self.verb:
         print( "Added:\n", self.dates[-1], self.counts[-1], self.counts[-1]-self.counts[-2], 
                  '(', self.deaths[-1], ',', self.deaths[-1]-self.deaths[-2], ')' )
@@ -215,22 +306,10 @@ class classCovid:
   def get_rki_internal_link( self, uri ):
     if self.verb: print( "Read %s" % uri )
     try:
-      request = self.http.urlopen('GET', uri )
-    except urllib3.exceptions.SSLError as e:
-      print( "TSL error", e.reason, uri )
-      sys.exit(-1)
+      href = self.revalidation.get( uri, lambda reply: parse_internal_link( reply.data ) )
     except urllib3.exceptions.HTTPError as e:
-      print( e.reason, uri )
-      sys.exit(-1)
-    html =  request.data
-    # Parse using the lxml parser
-    parsed_html = BeautifulSoup( html, "lxml", from_encoding="UTF-8" )
-    # Get internal links of this side
-    links = parsed_html.body.find_all( 'a', attrs={'class':'more downloadLink InternalLink'} )
-    assert len(links) == 1
-    link = links[0]
-    assert link.has_attr( 'href' )
-    return uritools.urijoin( uri, link['href'] )
+      raise http_session.connection_error( str( e ), uri ) from e
+    return uritools.urijoin( uri, href )
 
   # Make time non naive
   def non_naive( self, time ):
@@ -247,7 +326,7 @@ class classCovid:
     return self.non_naive( file_time )
 
   def in_file_time( self ):
-    if self.verb: print( "Check date of %s" % self.xls.io )
+    if self.verb: print( "Check date of %s" % self.filename )
     sheet = element_that_fit( self.xls.sheet_names, '^Tageswerte.*' )
     dataframe = self.xls.parse( sheet )
     stand = dataframe.columns[0]
@@ -259,88 +338,193 @@ class classCovid:
     time = re.search( '[0-9]+:[0-9]+:[0-9]+', stand )
     if time:
       date = date+' '+time.group(0)
-    in_time = dateutil.parser.parse( date )
+    in_time = dateutil.parser.parse( date, dayfirst=True )
     return self.non_naive( in_time )
 
+  # Name of the binary snapshot of the parsed spreadsheet
+  def snapshot_name( self, filename ):
+    return filename+'.npz'
+
+  # Key of the file content: modification time and hash
+  def file_key( self, filename ):
+    sha1 = hashlib.sha1()
+    with open( filename, 'rb' ) as f:
+      for block in iter( lambda: f.read( 1024*1024 ), b'' ):
+        sha1.update( block )
+    return os.path.getmtime( filename ), sha1.hexdigest()
+
+  # Load the snapshot if it does match the spreadsheet file
+  def load_snapshot( self, filename ):
+    try:
+      with numpy.load( self.snapshot_name( filename ), allow_pickle=False ) as npz:
+        snapshot = dict( (k, npz[k]) for k in npz.files )
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+      # Missing or truncated
+      return None
+    if not 'version' in snapshot or int(snapshot['version']) != snapshot_version:
+      return None
+    mtime, sha1 = self.file_key( filename )
+    if float(snapshot['mtime']) != mtime or str(snapshot['sha1']) != sha1:
+      return None
+    if self.verb: print( "Use snapshot %s" % self.snapshot_name( filename ) )
+    return snapshot
+
+  # Store the parsed series (and in file time) of the spreadsheet file
+  def save_snapshot( self, filename, in_time ):
+    mtime, sha1 = self.file_key( filename )
+    name = self.snapshot_name( filename )
+    temp = name+'.tmp.npz'
+    numpy.savez( temp, dates=numpy.array( self.dates, dtype='datetime64[D]' ),
+                 counts=numpy.array( self.counts, dtype=numpy.int64 ),
+                 deaths=numpy.array( self.deaths, dtype=numpy.int64 ),
+                 in_time=numpy.array( in_time.isoformat() ),
+                 mtime=numpy.array( mtime ), sha1=numpy.array( sha1 ),
+                 version=numpy.array( snapshot_version ) )
+    os.replace( temp, name )
+
   def get_file( self, uri ):
+    import pandas
     self.xls = None
+    self.snapshot = None
     parts = uritools.urisplit( uri )
-    filename = os.path.basename(parts.path).split( ';' )[0]
+    filename = os.path.join( self.directory, os.path.basename(parts.path).split( ';' )[0] )
+    self.filename = filename
     # Check file date
     file_time = self.file_time( filename )
     # Check in file date (if file exists)
     if os.path.isfile( filename ):
-      self.xls = pandas.ExcelFile( filename )
-      in_time = self.in_file_time()
+      if self.snapshots:
+        self.snapshot = self.load_snapshot( filename )
+      if self.snapshot:
+        in_time = dateutil.parser.parse( str(self.snapshot['in_time']) )
+      else:
+        self.xls = pandas.ExcelFile( filename )
+        in_time = self.in_file_time()
       if self.verb: print( "File as of: %s" % str(in_time) )
       # If date content is more that 1 day behind timestamp
       if (file_time - in_time) > datetime.timedelta(days=1):
         file_time = in_time
-    # Check URI date
-    reply = self.http.request( 'GET', uri, preload_content=False )
-    uri_time = dateutil.parser.parse( reply.headers['last-modified'] )
+    # Check URI date (server may answer "304 Not Modified" without content)
+    headers = dict()
+    if os.path.isfile( filename ):
+      if self.revalidation.result( uri ) == filename:
+        headers = self.revalidation.headers( uri )
+      headers['If-Modified-Since'] = email.utils.format_datetime( file_time.astimezone( datetime.timezone.utc ), usegmt=True )
+    event = self.metrics.start( uri ) if self.metrics else None
+    reply = self.http.request( 'GET', uri, headers=headers, preload_content=False )
+    if event: event['ttfb'] = self.metrics.elapsed( event )
+    if reply.status == 304:
+      reply.drain_conn()
+      reply.release_conn()
+      uri_time = file_time
+    else:
+      uri_time = dateutil.parser.parse( reply.headers['last-modified'] )
     if file_time >= uri_time:
       if self.verb: print( "%s is already up to date" % filename )
+      if reply.status != 304:
+        reply.drain_conn()
+        reply.release_conn()
+      if event: event['cache'] = 'hit'
     else:
       if self.verb:
         print( "File: %s, URI: %s" % ( str(file_time), str(uri_time) ) )
         print( "Download %s" % filename )
-      with reply as response, open(filename, 'wb') as out:
-        shutil.copyfileobj( response, out )
-      response.release_conn()
+      response, data = self.http.read( reply, uri, headers )
+      # Write and rename to never leave a partial file
+      with open( filename+'.tmp', 'wb' ) as out:
+        out.write( data )
+      os.replace( filename+'.tmp', filename )
+      self.revalidation.store( uri, response, filename )
       self.xls = None
-    if not self.xls:
+      self.snapshot = None
+      if event:
+        event['bytes'] = len(data)
+        event['cache'] = 'miss'
+    if event:
+      event['total'] = self.metrics.elapsed( event )
+      self.metrics.record( event )
+    if not self.xls and not self.snapshot:
       self.xls = pandas.ExcelFile( filename )
 
+  # Raises inconsistency_error
   def parse_rki_xls( self ):
-    if self.verb: print( "Parse %s" % self.xls.io )
+    if self.snapshot:
+      self.dates = self.snapshot['dates'].astype( datetime.date ).tolist()
+      self.counts = self.snapshot['counts'].tolist()
+      self.deaths = self.snapshot['deaths'].tolist()
+      self.sources = [ 'xlsx' ] * len(self.dates)
+      return
+    if self.verb: print( "Parse %s" % self.filename )
     # Take the one sheet with "-gesamt"
     sheet = element_that_fit( self.xls.sheet_names, '.*-gesamt$' )
     dataframe = self.xls.parse( sheet )
     # We are interested in date and count (and do check diff)
-    assert dataframe.iloc[0][0] == "Berichtsdatum"
-    assert dataframe.iloc[0][1] == "Anzahl COVID-19-Fälle"
-    assert dataframe.iloc[0][3] == "Differenz Vortag Fälle"
-    assert dataframe.iloc[0][4] == "Todesfälle"
+    assert dataframe.iloc[0,0] == "Berichtsdatum"
+    assert dataframe.iloc[0,1] == "Anzahl COVID-19-Fälle"
+    assert dataframe.iloc[0,3] == "Differenz Vortag Fälle"
+    assert dataframe.iloc[0,4] == "Todesfälle"
     # Extract accumulated infections
-    n=1
-    self.dates=[]
-    self.counts=[]
-    self.deaths=[]
-    while n < dataframe.shape[0]:
-      date = dataframe.iloc[n][0]
-      count = dataframe.iloc[n][1]
-      death = dataframe.iloc[n][4]
-      # Check consistency of dates
-      if self.dates:
-        self.dates.append( check_date( date, self.dates[-1] ) )
-      else:
-        self.dates.append( check_date( date ) )
-      if isinstance( death, float ) and math.isnan( death ):
-        death = int(0)
-      assert isinstance( count, int )
-      assert isinstance( death, int )
-      # Check diff for consistency
-      assert (n == 1) or isinstance( dataframe.iloc[n][3], int )
-      assert (n == 1) or (count == (self.counts[-1]+dataframe.iloc[n][3]))
-      # Keep data
-      self.counts.append( count )
-      self.deaths.append( death )
-      if self.verb:
-        if len(self.counts) > 1:
-          print( self.dates[-1], self.counts[-1], self.counts[-1]-self.counts[-2], 
-                 '(', self.deaths[-1], ',', self.deaths[-1]-self.deaths[-2], ')' )
+    dates, counts, deaths, problems = parse_gesamt( dataframe )
+    if problems:
+      raise inconsistency_error( self.filename, problems )
+    self.dates = dates.astype( datetime.date ).tolist()
+    self.counts = counts.tolist()
+    self.deaths = deaths.tolist()
+    self.sources = [ 'xlsx' ] * len(self.dates)
+    if self.verb:
+      for n in range( len(self.counts) ):
+        if n > 0:
+          print( self.dates[n], self.counts[n], self.counts[n]-self.counts[n-1], 
+                 '(', self.deaths[n], ',', self.deaths[n]-self.deaths[n-1], ')' )
         else:
-          print( self.dates[-1], self.counts[-1], '(', self.deaths[-1], ')' )
-      n=n+1
+          print( self.dates[n], self.counts[n], '(', self.deaths[n], ')' )
+    # Parse it only once
+    if self.snapshots:
+      self.save_snapshot( self.filename, self.in_file_time() )
+
+  # Continue with the series of the store (if any)
+  def load_store( self ):
+    if self.store and self.store.days:
+      self.dates, self.counts, self.deaths, self.sources = self.store.series()
+      if self.verb: print( "Stored series until %s" % self.dates[-1] )
+
+  # Write new days and corrected days to the store (if any)
+  def update_store( self ):
+    if self.store:
+      records = self.store.update( self.dates, self.counts, self.deaths, self.sources )
+      if self.verb:
+        for r in records:
+          print( "Stored %s %d (%d) from %s revision %d" % ( r['date'], r['count'], r['death'], r['source'], r['revision'] ) )
+
+  # Merge the parsed spreadsheet, the text table (of fetch_latest_entry) and the
+  # feature servers (of fetch_latest_arcgis) into the series in fixed order
+  def merge_latest( self, latest, values ):
+    # Keep new and corrected days of the spreadsheet, go on behind the last stored day
+    self.update_store()
+    self.load_store()
+    self.apply_latest_entry( latest )
+    self.apply_latest_arcgis( values )
+    self.update_store()
+
+  # Is there nothing to fetch? (the store has data up to today)
+  def is_up_to_date( self ):
+    return bool(self.dates) and self.dates[-1] >= datetime.date.today()
 
-  def plot_pyplot( self ):
+  # points: number of points to downsample to (method of decimation), all if None.
+  # headless: write covid.png instead of showing the chart.
+  def plot_pyplot( self, points=None, method='lttb', headless=False ):
+    # https://matplotlib.org/api/pyplot_api.html
+    import matplotlib
+    if headless: matplotlib.use( 'Agg' )
+    import matplotlib.pyplot
     # Time as x axes
     x = numpy.array( self.dates )
     # Infections as y axes
     y1 = numpy.array( self.counts )
-    y2 = diff_list( y1 )
-    y3 = diff_list( y2, 7 )
+    y2 = rolling.diff( y1 )
+    y3 = rolling.week_change( y2 )
+    keep = decimation.indices( [ y2 ], points, method )
+    x, y2 = x[keep], y2[keep]
     
     ## Difference in step width 1 ( https://numpy.org/doc/stable/reference/generated/numpy.diff.html )
     #y = numpy.diff( y, 1 ) 
@@ -350,35 +534,68 @@ class classCovid:
     #y = numpy.insert( y, [0,0,0,0,0,0,0], 0, axis=0 )
     matplotlib.pyplot.plot( x, y2, 'r+' )
     #matplotlib.pyplot.show()
-    mplexporter.show()
+    if headless:
+      matplotlib.pyplot.savefig( 'covid.png' )
+    else:
+      import mplexporter
+      mplexporter.show()
 
-  def plot_plotly( self ):
-    chart = plotly.express.line( self.counts, 
-        x="date", y="new", title="Infections/Victims SARS-CoV-2 Germany" )
-    chart.show()
+  def plot_plotly( self, points=None, method='lttb', headless=False ):
+    import plotly.express
+    x = numpy.array( self.dates )
+    y = rolling.diff( self.counts )
+    keep = decimation.indices( [ y ], points, method )
+    chart = plotly.express.line( x=x[keep], y=y[keep],
+        labels={ 'x':'date', 'y':'new' }, title="Infections/Victims SARS-CoV-2 Germany" )
+    if headless:
+      chart.write_html( 'covid_plotly.html' )
+    else:
+      chart.show()
 
 # For render_to_browser do
 #   update-alternatives --get-selections | grep www
 #   sudo update-alternatives --config x-www-browser
 # May still fail due to SVG content in HTML file.
 # => Do set default in file browser.
-def plot_pygal( result ):
-  y1 = result['counts']
-  y2 = diff_list( y1 )     # infections per day
-  y3 = diff_list( y2, 7 )  # change of infections per day within one week
-  y4 = mean_list( y2, 7 )  # 7 day mean of infections per day
-  y5 = mean_list( y3, 7 )  # 7 day mean of change
-  one_day = datetime.timedelta(days=1)  # Show day of cases occurring not of report
-
-  chart = pygal.Line()
-  chart.title = "Infections/Victims SARS-CoV-2 Germany"
-  chart.x_labels = [(i-one_day).strftime("%a, %d %b") for i in result['dates'] ]
-  chart.add( '1. Δ inf./day',   y2 )
-  chart.add( '2. 7 day Ø of 1', y4 )
-  chart.add( '3. week Δ of 1',  y3 )
-  chart.add( '4. 7 day Ø of 3', y5 )
+# points: number of points to downsample to (method of decimation), all if None.
+# labels: maximal number of x labels shown.
+# headless: render covid.html only (no browser).
+def plot_pygal( result, points=None, method='lttb', labels=None, headless=False ):
+  chart = pygal_chart.pygal_chart( result, "Infections/Victims SARS-CoV-2 Germany", points, method, labels )
   chart.render_to_file( 'covid.html' )
-  chart.render_in_browser()
+  if not headless:
+    chart.render_in_browser()
+
+# Print the districts of highest incidence on the last day
+def print_districts( result, top=10 ):
+  print( "%s: %d districts, %d days" % ( result['dates'][-1], len(result['districts']), len(result['dates']) ) )
+  incidence = result['incidence'][:,-1]
+  for n in numpy.argsort( numpy.nan_to_num( -incidence, nan=numpy.inf ) )[:top]:
+    print( "%-8s %-30s %8.1f %6d %+6d" % ( result['districts'][n], result['names'][n][:30], incidence[n],
+           result['sums'][n,-1], result['week_change'][n,-1] ) )
+
+# Print one fetch (callback of fetch_metrics)
+def print_fetch( event ):
+  print( "%-40s %-12s %9d bytes %8.1f ms %s" % ( event['label'][-40:], event['query'] or '', event['bytes'],
+         event['total']*1000, event['cache'] or '' ) )
+
+# Print the most expensive fetches
+def print_metrics( metrics ):
+  print( "%-40s %7s %5s %11s %10s %10s" % ( 'fetch', 'count', 'hits', 'bytes', 'total ms', 'parse ms' ) )
+  for t in metrics.summary():
+    print( "%-40s %7d %5d %11d %10.1f %10.1f" % ( t['label'][-40:], t['fetches'], t['hits'], t['bytes'],
+           t['total']*1000, t['parse']*1000 ) )
+
+# Fetch the spreadsheet, the text table and the feature servers concurrently,
+# then merge them (classCovid.merge_latest).
+async def ingest( covid, xlsx_uri, html_uri ):
+  def xlsx():
+    covid.get_file( covid.get_rki_internal_link( xlsx_uri ) )
+    covid.parse_rki_xls()
+  _, latest, values = await asyncio.gather( asyncio.to_thread( xlsx ),
+                                            asyncio.to_thread( covid.fetch_latest_entry, html_uri ),
+                                            asyncio.to_thread( covid.fetch_latest_arcgis ) )
+  covid.merge_latest( latest, values )
 
 def main():
   """
@@ -389,26 +606,134 @@ def main():
   #parser.add_argument( "excel", help="Microsoft excel file", type=str )
   parser.add_argument( '-v', '--verbose', type=int, default=0, 
                        help='Level of verbose output.' )
+  parser.add_argument( '--cache', type=str, default=None,
+                       help='Directory to cache replies, validators and the series (default depends on the servers).' )
+  parser.add_argument( '--no-cache', action='store_true',
+                       help='Do not cache replies, validators, the series and snapshots of the spreadsheet.' )
+  parser.add_argument( '--mirror', type=str, nargs='?', const='', default=None,
+                       help='Mirror layers of rki covid19 into this directory (default <cache>/mirror) and query them locally.' )
+  parser.add_argument( '--sequential', action='store_true',
+                       help='Fetch the sources one after the other.' )
+  parser.add_argument( '-p', '--plot', choices=['pygal', 'pyplot', 'plotly', 'none'], default='pygal',
+                       help='Plotting backend (only the chosen one is loaded).' )
+  parser.add_argument( '--points', type=int, default=None,
+                       help='Downsample series to about this number of points before plotting.' )
+  parser.add_argument( '--decimate', choices=list( decimation.methods ), default='lttb',
+                       help='Method of downsampling (shape preserving).' )
+  parser.add_argument( '--labels', type=int, default=None,
+                       help='Maximal number of labels on the x axis.' )
+  parser.add_argument( '--headless', action='store_true',
+                       help='Render charts to files only (do not open a browser).' )
+  parser.add_argument( '--rki-server', type=str, default=None,
+                       help='Base URI to use instead of www.rki.de (e.g. http://localhost:8080).' )
+  parser.add_argument( '--arcgis-server', type=str, default=None,
+                       help='Base URI to use instead of the ArcGIS feature servers.' )
+  parser.add_argument( '--districts', type=str, default=None,
+                       help='Compute series of all districts and save them to this .npz file.' )
+  parser.add_argument( '--charts', type=str, default=None,
+                       help='Render one chart per Bundesland and Landkreis into this directory.' )
+  parser.add_argument( '-j', '--jobs', type=int, default=None,
+                       help='Number of processes rendering charts and decoding downloads of mirrored layers (default: all cores).' )
+  parser.add_argument( '--retries', type=int, default=5,
+                       help='Retries of requests on errors (with exponential backoff).' )
+  parser.add_argument( '--timeout', type=float, default=60.0,
+                       help='Seconds to wait for data of a reply.' )
+  parser.add_argument( '--metrics', type=str, default=None,
+                       help='Append timings of all fetches to this JSON lines file.' )
+  parser.add_argument( '--trace', type=str, default=None,
+                       help='Write timings of all fetches to this Chrome trace file.' )
   args = parser.parse_args()
+  # Never mix cached data of other servers (e.g. a local stand-in) with real ones
+  if not args.cache:
+    args.cache = reply_cache.default_directory( ( args.rki_server, args.arcgis_server ) )
+  cache = None
+  if not args.no_cache:
+    cache = reply_cache.reply_cache( args.cache )
+  mirror = None
+  if args.mirror is not None:
+    mirror = layer_mirror.layer_mirror( args.mirror or os.path.join( args.cache, 'mirror' ), jobs=args.jobs )
+  metrics = None
+  if args.metrics or args.trace or args.verbose:
+    metrics = fetch_metrics.fetch_metrics( print_fetch if args.verbose > 1 else None, args.metrics, args.trace )
 
-  if True:
-    covid = classCovid( args.verbose )
-    xlsx_link = covid.get_rki_internal_link(
-        'https://www.rki.de/DE/Content/InfAZ/N/Neuartiges_Coronavirus/Daten/Fallzahlen_Kum_Tab.xlsx' )
-    xlsx_file = covid.get_file( xlsx_link )
-    covid.parse_rki_xls()
-    covid.get_latest_entry(
-        'https://www.rki.de/DE/Content/InfAZ/N/Neuartiges_Coronavirus/Fallzahlen.html' )
-    covid.get_latest_arcgis()
-    #covid.plot_pyplot()
-    plot_pygal( { 'counts':covid.counts, 'dates':covid.dates } )
-    #covid.plot_plotly()
-  else:
-    # Erkrankung bzw. Meldedatum
-    arcgis = arcgis_hub.arcgis_hub()
-    arcgis.check()
-    result = arcgis.get_cases_per_day_corrected()
-    plot_pygal( result )
+  xlsx_uri = 'https://www.rki.de/DE/Content/InfAZ/N/Neuartiges_Coronavirus/Daten/Fallzahlen_Kum_Tab.xlsx'
+  html_uri = 'https://www.rki.de/DE/Content/InfAZ/N/Neuartiges_Coronavirus/Fallzahlen.html'
+  if args.rki_server:
+    xlsx_uri = arcgis_hub.rebase_uri( xlsx_uri, args.rki_server )
+    html_uri = arcgis_hub.rebase_uri( html_uri, args.rki_server )
+  # One session (connection pools) for all fetches of the run
+  session = http_session.http_session( maxsize=8, retries=args.retries, timeout=( 10.0, args.timeout ),
+                                       headers=classCovid.user_agent )
+  try:
+    if args.districts or args.charts:
+      arcgis = arcgis_hub.arcgis_hub( cache, server=args.arcgis_server, metrics=metrics, session=session,
+                                      mirror=mirror )
+      result = district_series.fetch( arcgis )
+      if args.districts:
+        numpy.savez( args.districts, **result )
+      print_districts( result )
+      if args.charts:
+        import batch_charts
+        files = batch_charts.render_all( result, args.charts, args.jobs, args.points, args.decimate, args.labels )
+        if args.verbose: print( "Rendered %d charts into %s" % ( len(files), args.charts ) )
+    elif True:
+      covid = classCovid( args.verbose, session )
+      covid.cache = cache
+      covid.snapshots = not args.no_cache
+      covid.mirror = mirror
+      covid.arcgis_server = args.arcgis_server
+      covid.metrics = metrics
+      covid.revalidation.metrics = metrics
+      # The spreadsheet of another server is kept apart as well
+      if args.rki_server:
+        os.makedirs( args.cache, exist_ok=True )
+        covid.directory = args.cache
+      if cache:
+        covid.revalidation = revalidation.revalidation( covid.http, os.path.join( args.cache, 'validators.json' ), metrics )
+        covid.store = series_store.series_store( os.path.join( args.cache, 'series.jsonl' ) )
+      covid.load_store()
+      if covid.is_up_to_date():
+        if covid.verb: print( "Stored series is up to date" )
+      elif args.sequential:
+        covid.get_file( covid.get_rki_internal_link( xlsx_uri ) )
+        covid.parse_rki_xls()
+        covid.merge_latest( covid.fetch_latest_entry( html_uri ), covid.fetch_latest_arcgis() )
+      else:
+        asyncio.run( ingest( covid, xlsx_uri, html_uri ) )
+      if args.plot == 'pygal':
+        plot_pygal( { 'counts':covid.counts, 'dates':covid.dates }, args.points, args.decimate, args.labels, args.headless )
+      elif args.plot == 'pyplot':
+        covid.plot_pyplot( args.points, args.decimate, args.headless )
+      elif args.plot == 'plotly':
+        covid.plot_plotly( args.points, args.decimate, args.headless )
+    else:
+      # Erkrankung bzw. Meldedatum
+      arcgis = arcgis_hub.arcgis_hub( cache, columnar=True, server=args.arcgis_server, metrics=metrics,
+                                      session=session, mirror=mirror )
+      arcgis.check()
+      result = arcgis.get_cases_per_day_corrected()
+      if args.plot != 'none':
+        plot_pygal( result, args.points, args.decimate, args.labels, args.headless )
+  except http_session.session_error as e:
+    print( e, file=sys.stderr )
+    sys.exit(-1)
+  except inconsistency_error as e:
+    for p in e.problems:
+      print( p, file=sys.stderr )
+    print( e )
+    sys.exit(-1)
+  finally:
+    # Complete the files of metrics and stop the decoding processes on errors too
+    if metrics:
+      metrics.close()
+    if mirror:
+      mirror.close()
+  if metrics and args.verbose:
+    print_metrics( metrics )
+  if mirror and args.verbose:
+    for s in mirror.syncs:
+      print( "Mirrored %s (%s): %d records, %d fetched in %.1f s" % (
+             s['label'], s['mode'], s['records'], s['fetched'], s['seconds'] ) )
 
 if __name__ == '__main__':
   main()
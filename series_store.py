@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Append only store of the time series of counts and deaths per day.
+#
+# Every record is one JSON line with date, count, death, source (provenance)
+# and revision. A day is written once, a correction of a day is appended as
+# new revision of it. Replaying the file gives the last revision per day.
+# Sources are ranked: data of the spreadsheet does correct data of the HTML
+# table which does correct data of the ArcGIS feature server, not vice versa.
+#
+
+import sys,os,json
+import datetime
+import tempfile
+
+# Rank of sources (higher does correct lower)
+sources = { 'arcgis':0, 'html':1, 'xlsx':2 }
+
+class series_store:
+  def __init__( self, filename ):
+    self.filename = filename
+    # Last revision per day by date
+    self.days = dict()
+    self.load()
+
+  # Replay the file
+  def load( self ):
+    self.days = dict()
+    try:
+      with open( self.filename, 'r', encoding='utf-8' ) as f:
+        for line in f:
+          if not line.strip(): continue
+          record = json.loads( line )
+          date = datetime.date.fromisoformat( record['date'] )
+          if (not date in self.days) or (record['revision'] >= self.days[date]['revision']):
+            self.days[date] = record
+    except FileNotFoundError:
+      pass
+
+  def __append( self, records ):
+    if not records: return
+    directory = os.path.dirname( self.filename )
+    if directory: os.makedirs( directory, exist_ok=True )
+    with open( self.filename, 'a', encoding='utf-8' ) as f:
+      for record in records:
+        f.write( json.dumps( record, separators=(',', ':') )+'\n' )
+
+  def last_date( self ):
+    return max( self.days ) if self.days else None
+
+  # Lists of dates, counts, deaths and sources (days are consecutive)
+  def series( self ):
+    dates = sorted( self.days )
+    for n in range( 1, len(dates) ):
+      assert (dates[n]-dates[n-1]) == datetime.timedelta(days=1)
+    return ( dates, [ self.days[d]['count'] for d in dates ],
+                    [ self.days[d]['death'] for d in dates ],
+                    [ self.days[d]['source'] for d in dates ] )
+
+  # Append new days and revisions of known days, returns the records written.
+  # New days must follow the last known day.
+  def update( self, dates, counts, deaths, source_of_days ):
+    records = list()
+    now = datetime.datetime.now( datetime.timezone.utc ).isoformat( timespec='seconds' )
+    for date, count, death, source in zip( dates, counts, deaths, source_of_days ):
+      assert source in sources
+      old = self.days.get( date )
+      if old is None:
+        last = self.last_date()
+        assert (not last) or (date < last) or ((date-last) == datetime.timedelta(days=1)), \
+          "%s does not follow %s" % ( date, last )
+        revision = 0
+      elif (old['count'], old['death'], old['source']) == (count, death, source):
+        continue
+      elif sources[source] < sources[old['source']]:
+        continue
+      else:
+        revision = old['revision']+1
+      record = { 'date':date.isoformat(), 'count':int(count), 'death':int(death),
+                 'source':source, 'revision':revision, 'time':now }
+      self.days[date] = record
+      records.append( record )
+    self.__append( records )
+    return records
+
+###################################################################
+# Test cases
+
+# Updates of a store in order, (dates, counts, deaths, sources) of each and
+# the expected (date, source, revision) of the records written (None if the
+# update is rejected), written by hand following the ranking of sources
+def fixture_updates():
+  d1, d2, d3, d4 = [ datetime.date( 2020, 3, n ) for n in range( 1, 5 ) ]
+  return [
+    # New days
+    ( ( [ d1, d2 ], [ 10, 20 ], [ 0, 1 ], [ 'arcgis', 'arcgis' ] ),
+      [ ( '2020-03-01', 'arcgis', 0 ), ( '2020-03-02', 'arcgis', 0 ) ] ),
+    # The text table corrects the feature server (even with the same counts)
+    ( ( [ d1, d2 ], [ 10, 21 ], [ 0, 1 ], [ 'html', 'html' ] ),
+      [ ( '2020-03-01', 'html', 1 ), ( '2020-03-02', 'html', 1 ) ] ),
+    # The feature server does not correct the text table, a new day is kept
+    ( ( [ d2, d3 ], [ 25, 30 ], [ 1, 2 ], [ 'arcgis', 'arcgis' ] ),
+      [ ( '2020-03-03', 'arcgis', 0 ) ] ),
+    # The spreadsheet corrects both
+    ( ( [ d1, d2, d3 ], [ 11, 21, 30 ], [ 0, 1, 2 ], [ 'xlsx' ]*3 ),
+      [ ( '2020-03-01', 'xlsx', 2 ), ( '2020-03-02', 'xlsx', 2 ), ( '2020-03-03', 'xlsx', 1 ) ] ),
+    # Nothing changed
+    ( ( [ d1, d2, d3 ], [ 11, 21, 30 ], [ 0, 1, 2 ], [ 'xlsx' ]*3 ), [] ),
+    # The text table does not correct the spreadsheet
+    ( ( [ d3, d4 ], [ 31, 40 ], [ 2, 3 ], [ 'html', 'html' ] ), [ ( '2020-03-04', 'html', 0 ) ] ),
+    # A new day has to follow the last one
+    ( ( [ datetime.date( 2020, 3, 6 ) ], [ 50 ], [ 4 ], [ 'arcgis' ] ), None ) ]
+
+# Series replayed from the file after all updates
+fixture_series = ( [ datetime.date( 2020, 3, n ) for n in range( 1, 5 ) ],
+                   [ 11, 21, 30, 40 ], [ 0, 1, 2, 3 ], [ 'xlsx', 'xlsx', 'xlsx', 'html' ] )
+
+# Apply the updates to a new store and compare the records written and the
+# replayed series with the expected ones, returns the number of failed cases
+def check():
+  failed = 0
+  with tempfile.TemporaryDirectory() as directory:
+    filename = os.path.join( directory, 'series.jsonl' )
+    store = series_store( filename )
+    for update, expected in fixture_updates():
+      try:
+        got = [ ( r['date'], r['source'], r['revision'] ) for r in store.update( *update ) ]
+      except AssertionError:
+        got = None
+      if got != expected:
+        print( "Failed update %s:\n  expected %s\n  got      %s" % ( update, expected, got ) )
+        failed += 1
+    got = series_store( filename ).series()
+    if got != fixture_series:
+      print( "Failed replay:\n  expected %s\n  got      %s" % ( fixture_series, got ) )
+      failed += 1
+  return failed
+
+def main():
+  failed = check()
+  print( "%d of %d cases failed" % ( failed, len(fixture_updates())+1 ) )
+  sys.exit( 1 if failed else 0 )
+
+if __name__ == '__main__':
+  main()
+
+#EOF
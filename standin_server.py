@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Local stand-in of the RKI web pages and ArcGIS feature servers.
+#
+# Serves synthetic data shaped like 'rki covid19' and the layers derived
+# from it (sums, refdate, recovered, landkreis, bundesland) with the query
+# semantics used by arcgis_hub: where (AND of =, <>, <, >, <=, >=, IN,
+# BETWEEN, IS NULL), outFields, orderByFields, groupByFieldsForStatistics,
+# outStatistics, returnCountOnly and paging (resultOffset, resultRecordCount,
+# maxRecordCount, exceededTransferLimit). Also serves the Fallzahlen HTML
+# table, the page with the download link and the XLSX workbook, all with
+# Last-Modified/ETag and "304 Not Modified".
+#
+# standin_data.advance() publishes the data of the next day (new, removed
+# and no longer new cases, optionally with new ObjectIds of all records).
+#
+# Use the paths of the real servers, e.g.:
+#   ./standin_server.py --records 100000 --port 8080
+#   ./sars_2_plot.py --rki-server http://localhost:8080 --arcgis-server http://localhost:8080
+#
+
+import io,json,time
+import argparse
+import random
+import datetime
+import threading
+import email.utils
+import urllib.parse
+import http.server
+import arcgis_hub
+import where_clause
+import uritools
+
+bundeslaender = [ 'Schleswig-Holstein', 'Hamburg', 'Niedersachsen', 'Bremen', 'Nordrhein-Westfalen',
+                  'Hessen', 'Rheinland-Pfalz', 'Baden-Württemberg', 'Bayern', 'Saarland', 'Berlin',
+                  'Brandenburg', 'Mecklenburg-Vorpommern', 'Sachsen', 'Sachsen-Anhalt', 'Thüringen' ]
+altersgruppen = [ 'A00-A04', 'A05-A14', 'A15-A34', 'A35-A59', 'A60-A79', 'A80+', 'unbekannt' ]
+geschlechter = [ 'M', 'W', 'unbekannt' ]
+
+# Date fields of all layers (epoche in msec)
+date_fields = { 'Meldedatum', 'Refdatum', 'Datum' }
+# Object id fields of all layers
+oid_fields = { 'ObjectId', 'FID', 'OBJECTID', 'OBJECTID_1' }
+
+def epoch_ms( date ):
+  return int( datetime.datetime( date.year, date.month, date.day, tzinfo=datetime.timezone.utc ).timestamp() ) * 1000
+
+# Path of a layer of the real server (as served here)
+def layer_path( uri_label ):
+  path = uritools.urisplit( arcgis_hub.arcgis_hub().uri_dict[uri_label] ).path
+  return path[:path.rindex( '/query' )]
+
+xlsx_path = '/DE/Content/InfAZ/N/Neuartiges_Coronavirus/Daten/Fallzahlen_Kum_Tab.xlsx'
+html_path = '/DE/Content/InfAZ/N/Neuartiges_Coronavirus/Fallzahlen.html'
+
+###################################################################
+# Synthetic data
+
+# One layer: records and field descriptions
+class layer:
+  def __init__( self, name, records, oid, max_record_count, field_types=None ):
+    self.name = name
+    self.records = records
+    self.oid = oid
+    self.max_record_count = max_record_count
+    self.fields = list()
+    types = field_types or dict()
+    for name in ( records[0] if records else dict() ):
+      if name in types:
+        esriType = types[name]
+      elif name in oid_fields:
+        esriType = 'esriFieldTypeOID'
+      elif name in date_fields:
+        esriType = 'esriFieldTypeDate'
+      elif isinstance( records[0][name], str ):
+        esriType = 'esriFieldTypeString'
+      elif isinstance( records[0][name], float ):
+        esriType = 'esriFieldTypeDouble'
+      else:
+        esriType = 'esriFieldTypeInteger'
+      self.fields.append( { 'name':name, 'alias':name, 'type':esriType } )
+    self.field_by_name = dict( (f['name'], f) for f in self.fields )
+
+# Synthetic 'rki covid19' records and all derived layers
+class standin_data:
+  def __init__( self, records=10000, days=120, districts=400, today=None, seed=1 ):
+    rnd = random.Random( seed )
+    self.today = today or datetime.date.today()
+    self.days = days
+    self.datenstand = self.today.strftime( '%d.%m.%Y, 00:00 Uhr' )
+    self.last_edit = epoch_ms( self.today )
+    # Districts with population
+    self.districts = list()
+    for n in range( districts ):
+      bl = n % len(bundeslaender)
+      self.districts.append( { 'IdLandkreis':'%02d%03d' % ( bl+1, n ), 'Landkreis':'LK Kreis %d' % n,
+                               'IdBundesland':bl+1, 'Bundesland':bundeslaender[bl],
+                               'EWZ':rnd.randint( 50000, 1500000 ) } )
+    # Cases, more of them later on
+    rows = list()
+    for n in range( records ):
+      # The last one is a new case and death (the series does grow every day)
+      last = n == records-1
+      day = days-1 if last else min( int( days * rnd.random() ** 0.7 ), days-1 )
+      rows.append( self.__record( rnd, n+1, day, rnd.random() < 0.01 and not last, last ) )
+    self.layers = dict()
+    self.__publish( rows )
+
+  # One record of 'rki covid19' reported on day (0 is the first day)
+  def __record( self, rnd, oid, day, removed=False, death=False ):
+    d = self.districts[ rnd.randrange( len(self.districts) ) ]
+    first = self.today - datetime.timedelta(days=self.days-1)
+    melde = first + datetime.timedelta(days=day)
+    ref = melde - datetime.timedelta(days=rnd.randint( 0, 5 ))
+    row = { 'ObjectId':oid, 'IdBundesland':d['IdBundesland'], 'Bundesland':d['Bundesland'],
+            'Landkreis':d['Landkreis'], 'IdLandkreis':d['IdLandkreis'],
+            'Altersgruppe':rnd.choice( altersgruppen ), 'Geschlecht':rnd.choice( geschlechter ),
+            'Meldedatum':epoch_ms( melde ), 'Refdatum':epoch_ms( ref ),
+            'IstErkrankungsbeginn':int( ref != melde ), 'Datenstand':self.datenstand,
+            'Altersgruppe2':'Nicht übermittelt' }
+    if removed:
+      # Case of yesterday's publication that has been removed
+      row.update( { 'AnzahlFall':-rnd.randint( 1, 2 ), 'AnzahlTodesfall':0, 'AnzahlGenesen':0,
+                    'NeuerFall':-1, 'NeuerTodesfall':-9, 'NeuGenesen':-9 } )
+    else:
+      cases = rnd.randint( 1, 5 )
+      death = 1 if rnd.random() < 0.03 or death else 0
+      recovered = cases-death if day < self.days-14 else 0
+      new = day == self.days-1
+      row.update( { 'AnzahlFall':cases, 'AnzahlTodesfall':death, 'AnzahlGenesen':recovered,
+                    'NeuerFall':1 if new else 0,
+                    'NeuerTodesfall':( 1 if new else 0 ) if death else -9,
+                    'NeuGenesen':( 1 if day == self.days-15 else 0 ) if recovered else -9 } )
+    return row
+
+  # Records of 'rki covid19' become the current publication (with all derived layers)
+  def __publish( self, rows ):
+    layers = dict( self.layers )
+    self.layers = layers
+    layers['rki covid19'] = layer( 'RKI_COVID19', rows, 'ObjectId', 5000 )
+    current = [ r for r in rows if r['NeuerFall'] in (0,1) ]
+    self.__derive( current, self.datenstand )
+    # Totals of each day for spreadsheet and text table
+    first = self.today - datetime.timedelta(days=self.days-1)
+    per_day = dict()
+    for r in current:
+      day = per_day.setdefault( r['Meldedatum'], [0,0] )
+      day[0] += r['AnzahlFall']
+      day[1] += r['AnzahlTodesfall']
+    series = list()
+    count = death = 0
+    for n in range( self.days ):
+      ms = epoch_ms( first + datetime.timedelta(days=n) )
+      count += per_day.get( ms, [0,0] )[0]
+      death += per_day.get( ms, [0,0] )[1]
+      series.append( ( first + datetime.timedelta(days=n), count, death ) )
+    self.series = series
+    self.xlsx = None
+
+  # Publication of the next day: cases only in the one before (NeuerFall -1)
+  # are dropped, new cases of the day before are no longer new, some cases
+  # are removed (NeuerFall -1) and new ones are appended (next ObjectIds).
+  # With republish all records get new ObjectIds (in another order).
+  def advance( self, records=1000, removed=10, republish=False, seed=None ):
+    rnd = random.Random( self.days if seed is None else seed )
+    self.today += datetime.timedelta(days=1)
+    self.days += 1
+    self.datenstand = self.today.strftime( '%d.%m.%Y, 00:00 Uhr' )
+    self.last_edit = epoch_ms( self.today )
+    old = { 1:0, 0:0, -1:-9, -9:-9 }
+    rows = list()
+    for r in self.layers['rki covid19'].records:
+      if r['NeuerFall'] == -1: continue
+      r = dict( r )
+      r.update( { 'Datenstand':self.datenstand, 'NeuerFall':0, 'NeuerTodesfall':old[r['NeuerTodesfall']],
+                  'NeuGenesen':old[r['NeuGenesen']] } )
+      rows.append( r )
+    for r in rnd.sample( rows, min( removed, len(rows) ) ):
+      r.update( { 'AnzahlFall':-r['AnzahlFall'], 'AnzahlTodesfall':0, 'AnzahlGenesen':0,
+                  'NeuerFall':-1, 'NeuerTodesfall':-9, 'NeuGenesen':-9 } )
+    oid = max( [ r['ObjectId'] for r in rows ]+[0] )
+    for n in range( records ):
+      rows.append( self.__record( rnd, oid+n+1, self.days-1 - rnd.randint( 0, 3 ) * ( n % 2 ), death=n == records-1 ) )
+      rows[-1]['NeuerFall'] = 1
+      if rows[-1]['AnzahlTodesfall']: rows[-1]['NeuerTodesfall'] = 1
+    if republish:
+      rnd.shuffle( rows )
+      for n, r in enumerate( rows ):
+        r['ObjectId'] = n+1
+    self.__publish( rows )
+
+  def __derive( self, current, datenstand ):
+    # Sums per day and district
+    sums = dict()
+    for r in current:
+      s = sums.setdefault( ( r['Meldedatum'], r['IdLandkreis'] ), [ r, 0, 0, 0 ] )
+      s[1] += r['AnzahlFall']
+      s[2] += r['AnzahlTodesfall']
+      s[3] += r['AnzahlGenesen']
+    rows = list()
+    total = dict()
+    for key in sorted( sums ):
+      r, cases, deaths, recovered = sums[key]
+      t = total.setdefault( key[1], [0,0,0] )
+      t[0] += cases
+      t[1] += deaths
+      t[2] += recovered
+      rows.append( { 'ObjectId':len(rows)+1, 'Meldedatum':key[0], 'IdLandkreis':key[1],
+                     'Landkreis':r['Landkreis'], 'Bundesland':r['Bundesland'], 'IdBundesland':r['IdBundesland'],
+                     'AnzahlFall':cases, 'AnzahlTodesfall':deaths, 'AnzahlGenesen':recovered,
+                     'SummeFall':t[0], 'SummeTodesfall':t[1], 'SummeGenesen':t[2], 'Datenstand':datenstand } )
+    self.layers['rki covid19 sums'] = layer( 'Covid19_RKI_Sums', rows, 'ObjectId', 5000 )
+    # Cases per day of reference and district
+    refs = dict()
+    for r in current:
+      key = ( r['Refdatum'], r['IdLandkreis'], r['IstErkrankungsbeginn'] )
+      refs.setdefault( key, [ r, 0 ] )[1] += r['AnzahlFall']
+    rows = [ { 'FID':n+1, 'Landkreis':refs[k][0]['Landkreis'], 'Bundesland':refs[k][0]['Bundesland'],
+               'Datenstand':datenstand, 'Datum':k[0], 'AnzahlFall':refs[k][1], 'IstErkrankungsbeginn':k[2] }
+             for n, k in enumerate( sorted( refs ) ) ]
+    self.layers['rki covid19 refdate'] = layer( 'RKI_Covid19_Refdate', rows, 'FID', 2000 )
+    # Per district
+    per_lk = dict( (d['IdLandkreis'], [0,0]) for d in self.districts )
+    per_bl = dict( (n+1, [0,0,0,0]) for n in range(len(bundeslaender)) )
+    for r in current:
+      per_lk[r['IdLandkreis']][0] += r['AnzahlFall']
+      per_lk[r['IdLandkreis']][1] += r['AnzahlTodesfall']
+      per_bl[r['IdBundesland']][0] += r['AnzahlFall']
+      per_bl[r['IdBundesland']][1] += r['AnzahlTodesfall']
+      if r['NeuGenesen'] in (0,1):
+        per_bl[r['IdBundesland']][2] += r['AnzahlGenesen']
+      if r['NeuGenesen'] == 1:
+        per_bl[r['IdBundesland']][3] += r['AnzahlGenesen']
+    for d in self.districts:
+      per_bl[d['IdBundesland']].append( d['EWZ'] )
+    rows = [ { 'OBJECTID':n+1, 'RS':d['IdLandkreis'], 'GEN':d['Landkreis'][3:], 'county':d['Landkreis'],
+               'BL':d['Bundesland'], 'BL_ID':str(d['IdBundesland']), 'EWZ':d['EWZ'],
+               'cases':per_lk[d['IdLandkreis']][0], 'deaths':per_lk[d['IdLandkreis']][1],
+               'cases_per_100k':per_lk[d['IdLandkreis']][0]*100000.0/d['EWZ'] }
+             for n, d in enumerate( self.districts ) ]
+    self.layers['rki landkreis'] = layer( 'RKI_Landkreisdaten', rows, 'OBJECTID', 2000 )
+    rows = list()
+    for n, name in enumerate( bundeslaender ):
+      bl = per_bl[n+1]
+      ewz = sum( bl[4:] )
+      rows.append( { 'OBJECTID_1':n+1, 'LAN_ew_GEN':name, 'LAN_ew_EWZ':ewz, 'Fallzahl':bl[0], 'Death':bl[1],
+                     'faelle_100000_EW':bl[0]*100000.0/ewz } )
+    self.layers['rki bundesland'] = layer( 'Coronafaelle_in_den_Bundeslaendern', rows, 'OBJECTID_1', 2000 )
+    rows = [ { 'Bundesland':name, 'FID':n+1, 'Genesen':per_bl[n+1][2], 'DiffVortag':per_bl[n+1][3],
+               'Datenstand':datenstand, 'IdBundesland':n+1 } for n, name in enumerate( bundeslaender ) ]
+    rows.append( { 'Bundesland':'Bundesgebiet', 'FID':len(rows)+1, 'Genesen':sum( r['Genesen'] for r in rows ),
+                   'DiffVortag':sum( r['DiffVortag'] for r in rows ), 'Datenstand':datenstand, 'IdBundesland':0 } )
+    self.layers['rki covid19 recovered'] = layer( 'RKI_COVID19_Recovered_BL', rows, 'FID', 2000 )
+
+  # HTML table of the latest totals (as on the Fallzahlen page)
+  def html_table( self ):
+    date, count, death = self.series[-1]
+    diff = count - self.series[-2][1]
+    number = lambda v: '{:,}'.format( v ).replace( ',', '.' )
+    rows = [ '<tr><td>%s</td><td>0</td><td>0</td><td>0</td><td>0</td><td>0</td></tr>' % bl for bl in bundeslaender ]
+    rows.append( '<tr><td>Gesamt</td><td>%s</td><td>+%s</td><td>0</td><td>0</td><td>%s</td></tr>' % (
+                 number( count ), number( diff ), number( death ) ) )
+    return ( '<html><head><title>Fallzahlen</title></head><body><div id="nav"><p>Stand: 01.01.2020</p></div>'
+             '<div id="main"><h1>COVID-19: Fallzahlen in Deutschland</h1><p>Stand: %s, 00:00 Uhr</p>'
+             '<table><thead><tr><th>Bundesland</th></tr></thead><tbody>%s</tbody></table></div></body></html>' % (
+             date.strftime( '%d.%m.%Y' ), ''.join( rows ) ) ).encode( 'utf-8' )
+
+  # HTML page with the link to the spreadsheet
+  def html_link( self ):
+    return ( '<html><body><div id="main"><a class="more downloadLink InternalLink" '
+             'href="%s;jsessionid=0?__blob=publicationFile">Fallzahlen</a></div></body></html>' % xlsx_path ).encode( 'utf-8' )
+
+  # XLSX workbook of all days but the latest one (RKI is lazy in updating it)
+  def workbook( self ):
+    if self.xlsx: return self.xlsx
+    import pandas
+    stand = datetime.datetime.combine( self.series[-2][0], datetime.time(8,0,0) )
+    rows = [ [ 'Berichtsdatum', 'Anzahl COVID-19-Fälle', 'Fälle/100.000 EW', 'Differenz Vortag Fälle', 'Todesfälle' ] ]
+    last = None
+    for n, ( date, count, death ) in enumerate( self.series[:-1] ):
+      day = datetime.datetime.combine( date, datetime.time(0,0,0) )
+      rows.append( [ day if n % 2 else day.strftime( '%d.%m.%Y' ), count, None,
+                     None if last is None else count-last, death if death else None ] )
+      last = count
+    out = io.BytesIO()
+    with pandas.ExcelWriter( out, engine='openpyxl' ) as writer:
+      pandas.DataFrame( [ [ 'Fallzahlen' ] ], columns=[ 'Stand: %s' % stand.strftime( '%d.%m.%Y %H:%M:%S' ) ] ).to_excel(
+          writer, sheet_name='Tageswerte berechnet', index=False )
+      pandas.DataFrame( rows, columns=[ 'Fallzahlen in Deutschland', '', ' ', '  ', '   ' ] ).to_excel(
+          writer, sheet_name='Fälle-Todesfälle-gesamt', index=False )
+    self.xlsx = out.getvalue()
+    return self.xlsx
+
+###################################################################
+# Query of a layer
+
+# Predicate of a where clause (of where_clause) on a record
+def parse_where( where ):
+  conditions = where_clause.parse_where( where )
+  def keep( r ):
+    for c in conditions:
+      v = r.get( c[0] )
+      if c[1] == 'IS NULL':
+        if ( v is None ) == c[3]: return False
+      elif v is None or not where_clause.test( c, v ):
+        return False
+    return True
+  return keep
+
+# Sort records by "field asc, other desc"
+def order_by( records, order ):
+  keys = [ k.split() for k in order.split( ',' ) if k.strip() ]
+  for key in reversed( keys ):
+    field = key[0]
+    reverse = len(key) > 1 and key[1].lower() == 'desc'
+    records.sort( key=lambda r: ( r.get(field) is not None, r.get(field) ), reverse=reverse )
+  return records
+
+def statistic( stype, values ):
+  values = [ v for v in values if v is not None ]
+  if stype == 'count': return len(values)
+  if not values: return None
+  if stype == 'sum': return sum( values )
+  if stype == 'min': return min( values )
+  if stype == 'max': return max( values )
+  if stype == 'avg': return sum( values ) / len(values)
+  raise ValueError( "Unsupported statistic: %s" % stype )
+
+def error( message, code=400 ):
+  return { 'error':{ 'code':code, 'message':message, 'details':[ message ] } }
+
+# Answer a query of a layer like a feature server
+def query_layer( lay, params ):
+  try:
+    keep = parse_where( params.get( 'where', '1=1' ) )
+    records = [ r for r in lay.records if keep(r) ]
+    if params.get( 'returnCountOnly', 'false' ) == 'true':
+      return { 'count':len(records) }
+    fields = lay.field_by_name
+    if 'outStatistics' in params:
+      stats = json.loads( params['outStatistics'] )
+      groups = [ g.strip() for g in params.get( 'groupByFieldsForStatistics', '' ).split( ',' ) if g.strip() ]
+      grouped = dict()
+      for r in records:
+        grouped.setdefault( tuple( r.get(g) for g in groups ), list() ).append( r )
+      if not groups and not grouped:
+        grouped[()] = list()
+      records = list()
+      for key in grouped:
+        row = dict( zip( groups, key ) )
+        for s in stats:
+          if not s['onStatisticField'] in fields:
+            return error( "Invalid field: %s" % s['onStatisticField'] )
+          row[s['outStatisticFieldName']] = statistic( s['statisticType'],
+                                            [ r.get( s['onStatisticField'] ) for r in grouped[key] ] )
+        records.append( row )
+      out_fields = [ fields[g] for g in groups ] + [
+                   { 'name':s['outStatisticFieldName'], 'alias':s['outStatisticFieldName'],
+                     'type':'esriFieldTypeDouble' } for s in stats ]
+    else:
+      names = params.get( 'outFields', '*' )
+      names = list( fields ) if names.strip() == '*' else [ n.strip() for n in names.split( ',' ) ]
+      for n in names:
+        if not n in fields:
+          return error( "Invalid field: %s" % n )
+      # Records may be ordered by fields not in outFields
+      if params.get( 'orderByFields' ):
+        records = order_by( list( records ), params['orderByFields'] )
+      records = [ dict( (n, r.get(n)) for n in names ) for r in records ]
+      out_fields = [ fields[n] for n in names ]
+    if params.get( 'orderByFields' ) and 'outStatistics' in params:
+      records = order_by( records, params['orderByFields'] )
+    offset = int( params.get( 'resultOffset', 0 ) )
+    count = min( int( params.get( 'resultRecordCount', lay.max_record_count ) ), lay.max_record_count )
+    exceeded = len(records) > offset+count
+    records = records[offset:offset+count]
+  except (ValueError, KeyError) as e:
+    return error( str(e) )
+  reply = { 'objectIdFieldName':lay.oid, 'fields':out_fields,
+            'features':[ { 'attributes':r } for r in records ] }
+  if exceeded:
+    reply['exceededTransferLimit'] = True
+  return reply
+
+# Description of a layer
+def layer_info( lay, last_edit ):
+  return { 'name':lay.name, 'type':'Feature Layer', 'objectIdField':lay.oid,
+           'maxRecordCount':lay.max_record_count, 'standardMaxRecordCount':lay.max_record_count,
+           'supportsPagination':True, 'fields':lay.fields, 'editingInfo':{ 'lastEditDate':last_edit } }
+
+###################################################################
+# HTTP server
+
+class handler( http.server.BaseHTTPRequestHandler ):
+  protocol_version = 'HTTP/1.1'
+  # Header and body are written separately
+  disable_nagle_algorithm = True
+
+  def log_message( self, format, *args ):
+    if self.server.verb: http.server.BaseHTTPRequestHandler.log_message( self, format, *args )
+
+  def __send( self, body, content_type, validate=False ):
+    headers = { 'Content-Type':content_type }
+    if validate:
+      etag = '"%x-%x"' % ( self.server.started, len(body) )
+      modified = email.utils.formatdate( self.server.started, usegmt=True )
+      headers['ETag'] = etag
+      headers['Last-Modified'] = modified
+      since = self.headers.get( 'If-Modified-Since' )
+      not_modified = self.headers.get( 'If-None-Match' ) == etag
+      if since and not self.headers.get( 'If-None-Match' ):
+        try:
+          not_modified = email.utils.parsedate_to_datetime( since ).timestamp() >= self.server.started
+        except (TypeError, ValueError):
+          pass
+      if not_modified:
+        self.send_response( 304 )
+        for k in headers: self.send_header( k, headers[k] )
+        self.send_header( 'Content-Length', '0' )
+        self.end_headers()
+        return
+    self.send_response( 200 )
+    for k in headers: self.send_header( k, headers[k] )
+    self.send_header( 'Content-Length', str(len(body)) )
+    self.end_headers()
+    self.wfile.write( body )
+
+  def do_GET( self ):
+    # Transient errors to test retries
+    if self.server.fail_rate and self.server.random.random() < self.server.fail_rate:
+      self.send_response( 503 )
+      self.send_header( 'Retry-After', '0' )
+      self.send_header( 'Content-Length', '0' )
+      self.end_headers()
+      return
+    parts = urllib.parse.urlsplit( self.path )
+    path = urllib.parse.unquote( parts.path ).split( ';' )[0]
+    params = dict( urllib.parse.parse_qsl( parts.query, keep_blank_values=True ) )
+    data = self.server.data
+    if path == xlsx_path:
+      if '__blob' in params:
+        self.__send( data.workbook(), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', True )
+      else:
+        self.__send( data.html_link(), 'text/html; charset=utf-8', True )
+      return
+    if path == html_path:
+      self.__send( data.html_table(), 'text/html; charset=utf-8', True )
+      return
+    for label, lay in data.layers.items():
+      base = self.server.paths[label]
+      if path == base+'/query':
+        reply = query_layer( lay, params )
+      elif path == base:
+        reply = layer_info( lay, data.last_edit )
+      else:
+        continue
+      self.__send( json.dumps( reply, separators=(',', ':'), ensure_ascii=False ).encode( 'utf-8' ),
+                   'application/json; charset=utf-8' )
+      return
+    self.send_response( 404 )
+    body = b'<html><title>404 - File or directory not found.</title></html>'
+    self.send_header( 'Content-Type', 'text/html' )
+    self.send_header( 'Content-Length', str(len(body)) )
+    self.end_headers()
+    self.wfile.write( body )
+
+# Server running in a thread of its own
+class standin_server( http.server.ThreadingHTTPServer ):
+  daemon_threads = True
+
+  # fail_rate: part of requests answered with "503 Service Unavailable"
+  def __init__( self, data, port=0, verb=0, fail_rate=0.0 ):
+    http.server.ThreadingHTTPServer.__init__( self, ( '127.0.0.1', port ), handler )
+    self.data = data
+    self.verb = verb
+    self.started = int( time.time() )
+    self.fail_rate = fail_rate
+    self.random = random.Random( 1 )
+    self.paths = dict( (label, layer_path( label )) for label in data.layers )
+    self.thread = None
+
+  # Base URI (to be used by --rki-server and --arcgis-server)
+  def base( self ):
+    return 'http://127.0.0.1:%d' % self.server_address[1]
+
+  def start( self ):
+    self.thread = threading.Thread( target=self.serve_forever, daemon=True )
+    self.thread.start()
+    return self
+
+  def stop( self ):
+    self.shutdown()
+    self.server_close()
+
+def main():
+  parser = argparse.ArgumentParser( description='Local stand-in of RKI and ArcGIS servers' )
+  parser.add_argument( '--records', type=int, default=10000, help='Number of rki covid19 records.' )
+  parser.add_argument( '--days', type=int, default=120, help='Number of days.' )
+  parser.add_argument( '--port', type=int, default=8080, help='Port to listen on.' )
+  parser.add_argument( '--fail-rate', type=float, default=0.0, help='Part of requests to fail with 503.' )
+  parser.add_argument( '-v', '--verbose', type=int, default=0, help='Level of verbose output.' )
+  args = parser.parse_args()
+  server = standin_server( standin_data( args.records, args.days ), args.port, args.verbose, args.fail_rate )
+  print( "Serving %d records at %s" % ( args.records, server.base() ) )
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+if __name__ == '__main__':
+  main()
+
+#EOF
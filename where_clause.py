@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+# Where clauses of queries of feature servers, shared by the query engines
+# of layer_mirror (vectorized) and standin_server (record by record).
+#
+# A where clause is an AND of simple conditions:
+#   <field> =|<>|<|>|<=|>= <literal>
+#   <field> [NOT] IN(<literal>, ...)
+#   <field> [NOT] BETWEEN <literal> AND <literal>
+#   <field> IS [NOT] NULL
+#   1=1
+# Literals are numbers, 'strings' and timestamp/date 'YYYY-MM-DD[ hh:mm:ss]'
+# (epoch msec, UTC). Quoted literals are replaced by tokens before the
+# clause is split, so strings may contain e.g. ' AND ', ',' or ')'.
+#
+
+import re
+import datetime
+import numpy
+
+# Quoted literals ('' is a quote inside a string) and the tokens replacing them
+quoted_pattern = re.compile( r"(?:(?:timestamp|date)\s+)?'(?:[^']|'')*'", re.I )
+token_pattern = re.compile( r"^\x01(\d+)\x01$" )
+literal = r"(?:\x01\d+\x01|-?\d+(?:\.\d+)?)"
+between_pattern = re.compile( r"(\w+)\s+(NOT\s+)?BETWEEN\s+(%s)\s+AND\s+(%s)" % ( literal, literal ), re.I )
+in_pattern = re.compile( r"^(\w+)\s+(NOT\s+)?IN\s*\((.*)\)$", re.I )
+compare_pattern = re.compile( r"^(\w+)\s*(<>|<=|>=|=|<|>)\s*(%s)$" % literal, re.I )
+null_pattern = re.compile( r"^(\w+)\s+IS\s+(NOT\s+)?NULL$", re.I )
+
+compare = { '=':lambda a,b: a == b, '<>':lambda a,b: a != b, '<':lambda a,b: a < b,
+            '>':lambda a,b: a > b, '<=':lambda a,b: a <= b, '>=':lambda a,b: a >= b }
+
+# Value of a literal, timestamps are epoch msec (UTC)
+def parse_literal( text ):
+  text = text.strip()
+  m = re.match( r"^(timestamp|date)\s+'([^']*)'$", text, re.I )
+  if m:
+    value = m.group(2) if len(m.group(2)) > 10 else m.group(2)+' 00:00:00'
+    t = datetime.datetime.strptime( value, '%Y-%m-%d %H:%M:%S' ).replace( tzinfo=datetime.timezone.utc )
+    return int( t.timestamp() ) * 1000
+  if text.startswith( "'" ):
+    return text[1:-1].replace( "''", "'" )
+  return float( text ) if '.' in text else int( text )
+
+# Conditions of a where clause as list of (field, operator, value, negate):
+#   '=', '<>', '<', '>', '<=', '>='  value is the literal
+#   'IN'                             value is a list of literals
+#   'BETWEEN'                        value is (low, high)
+#   'IS NULL'                        value is None
+# Raises ValueError if the clause is not supported.
+def parse_where( where ):
+  quoted = list()
+  def hide( m ):
+    quoted.append( m.group(0) )
+    return '\x01%d\x01' % ( len(quoted)-1 )
+  def unhide( text ):
+    m = token_pattern.match( text.strip() )
+    return parse_literal( quoted[int(m.group(1))] if m else text )
+  where = quoted_pattern.sub( hide, ( where or '1=1' ).strip() )
+  betweens = list()
+  def keep( m ):
+    betweens.append( m )
+    return '\x00%d\x00' % ( len(betweens)-1 )
+  where = between_pattern.sub( keep, where )
+  conditions = list()
+  for clause in re.split( r'\s+AND\s+', where, flags=re.I ):
+    clause = clause.strip()
+    while clause.startswith( '(' ) and clause.endswith( ')' ):
+      clause = clause[1:-1].strip()
+    m = re.match( '^\x00(\\d+)\x00$', clause )
+    if m:
+      b = betweens[int(m.group(1))]
+      conditions.append( ( b.group(1), 'BETWEEN', ( unhide( b.group(3) ), unhide( b.group(4) ) ),
+                           bool(b.group(2)) ) )
+      continue
+    if re.match( r'^1\s*=\s*1$', clause ):
+      continue
+    m = in_pattern.match( clause )
+    if m:
+      values = list( set( unhide( v ) for v in m.group(3).split( ',' ) ) )
+      conditions.append( ( m.group(1), 'IN', values, bool(m.group(2)) ) )
+      continue
+    m = compare_pattern.match( clause )
+    if m:
+      conditions.append( ( m.group(1), m.group(2), unhide( m.group(3) ), False ) )
+      continue
+    m = null_pattern.match( clause )
+    if m:
+      conditions.append( ( m.group(1), 'IS NULL', None, bool(m.group(2)) ) )
+      continue
+    raise ValueError( "Unsupported where clause: %s" % clause )
+  return conditions
+
+# Test values of the field of a condition (other than IS NULL): numpy array
+# (returns array of bool) or one value (not None, returns bool)
+def test( condition, values ):
+  field, operator, value, negate = condition
+  if operator == 'IN':
+    result = numpy.isin( values, value ) if isinstance( values, numpy.ndarray ) else values in value
+  elif operator == 'BETWEEN':
+    result = ( value[0] <= values ) & ( values <= value[1] )
+  else:
+    result = compare[operator]( values, value )
+  return result != negate
+
+#EOF